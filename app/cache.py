@@ -0,0 +1,91 @@
+# app/cache.py
+"""
+Caché en proceso acotada (LRU) con caducidad por entrada.
+Cada worker tiene la suya; por eso los TTL deben ser cortos si los datos
+pueden cambiar desde otro worker.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from .metrics import Counter, Gauge
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Lecturas de caché en proceso por resultado",
+    ["cache", "result"],
+)
+CACHE_ENTRIES = Gauge(
+    "cache_entries",
+    "Entradas en caché en proceso",
+    ["cache"],
+)
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is not _MISSING:
+            expires_at, value = entry
+            if expires_at > self._clock():
+                self._data.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.inc(cache=self.name, result="hit")
+                return value
+            del self._data[key]
+            self._update_size()
+        self.misses += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="miss")
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        self._data[key] = (self._clock() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        self._update_size()
+
+    def pop(self, key: Hashable) -> None:
+        if self._data.pop(key, None) is not None:
+            self._update_size()
+
+    def expire(self) -> None:
+        """Elimina las entradas caducadas (recorre toda la caché)."""
+        now = self._clock()
+        for key in [k for k, (expires_at, _) in self._data.items() if expires_at <= now]:
+            del self._data[key]
+        self._update_size()
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._update_size()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _update_size(self) -> None:
+        CACHE_ENTRIES.set(len(self._data), cache=self.name)
@@ -1,5 +1,7 @@
 from functools import lru_cache
+from typing import Dict
 from pydantic import BaseModel
+import json
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -15,8 +17,103 @@ class Settings(BaseModel):
     media_dir: str = os.getenv("MEDIA_DIR", str(Path(__file__).resolve().parents[1] / "media"))
     frontend_base_url: str = os.getenv("FRONTEND_BASE_URL", "http://localhost:5173")
     billing_provider: str = os.getenv("BILLING_PROVIDER", "mock").lower()
+    # WebSocket: tamaño de la cola de salida por conexión y política con consumidores lentos
+    ws_send_queue_size: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+    ws_slow_consumer_policy: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop").lower()  # drop|close
+    # WebSocket: heartbeat (segundos), cierre por inactividad y límites de conexiones
+    ws_ping_interval: float = float(os.getenv("WS_PING_INTERVAL", "25"))
+    ws_idle_timeout: float = float(os.getenv("WS_IDLE_TIMEOUT", "75"))
+    ws_max_connections_per_user: int = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "5"))
+    ws_max_connections: int = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+    # WebSocket: coalescing de "escribiendo" y límite de frames send_message por conexión
+    ws_typing_interval: float = float(os.getenv("WS_TYPING_INTERVAL", "1"))
+    ws_typing_timeout: float = float(os.getenv("WS_TYPING_TIMEOUT", "5"))
+    ws_message_rate: float = float(os.getenv("WS_MESSAGE_RATE", "5"))  # mensajes/segundo
+    ws_message_burst: int = int(os.getenv("WS_MESSAGE_BURST", "10"))
+    # WebSocket: reanudación tras reconexión (buffer en memoria y máximo a reproducir desde DB)
+    ws_resume_buffer_size: int = int(os.getenv("WS_RESUME_BUFFER_SIZE", "200"))
+    ws_resume_max_age: float = float(os.getenv("WS_RESUME_MAX_AGE", "600"))
+    ws_resume_max_users: int = int(os.getenv("WS_RESUME_MAX_USERS", "10000"))
+    ws_resume_max_messages: int = int(os.getenv("WS_RESUME_MAX_MESSAGES", "200"))
+    # Presencia (segundos): paso a away/offline y sincronización entre workers
+    presence_away_after: float = float(os.getenv("PRESENCE_AWAY_AFTER", "300"))
+    presence_offline_grace: float = float(os.getenv("PRESENCE_OFFLINE_GRACE", "15"))
+    presence_sync_interval: float = float(os.getenv("PRESENCE_SYNC_INTERVAL", "5"))
+    presence_entry_ttl: float = float(os.getenv("PRESENCE_ENTRY_TTL", "60"))
+    presence_query_max_ids: int = int(os.getenv("PRESENCE_QUERY_MAX_IDS", "500"))
+    # Caché del usuario autenticado (por worker): tamaño y TTL en segundos
+    user_cache_size: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    user_cache_ttl: float = float(os.getenv("USER_CACHE_TTL", "5"))
+    # Rate limiting: "mongo" comparte los contadores entre workers, "memory" cuenta por worker
+    rate_limit_backend: str = os.getenv("RATE_LIMIT_BACKEND", "mongo").lower()
+    rate_limit_max_keys: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+    # Límites por ruta, aplicados antes del enrutado. ROUTE_RATE_LIMITS (JSON) los reemplaza
+    route_rate_limits: Dict[str, str] = json.loads(os.getenv("ROUTE_RATE_LIMITS", "null")) or {
+        "POST /auth/signup": "5/minute",
+        "POST /auth/login": "10/minute",
+        "POST /bookings": "15/minute",
+        "POST /payments": "10/minute",
+        "POST /payments/{payment_id}/process": "20/minute",
+    }
+    # Presupuesto por clase de consulta a MongoDB (ms) y margen del deadline asyncio (s)
+    query_timeouts_ms: Dict[str, int] = json.loads(os.getenv("QUERY_TIMEOUTS_MS", "null")) or {
+        "point": 500, "list": 2000, "search": 3000, "aggregate": 5000, "write": 2000,
+    }
+    query_deadline_grace: float = float(os.getenv("QUERY_DEADLINE_GRACE", "0.25"))
+    # Métricas: token opcional para /metrics y directorio compartido entre workers del host
+    metrics_token: str = os.getenv("METRICS_TOKEN", "")
+    metrics_dir: str = os.getenv("METRICS_DIR", "")
+    metrics_flush_interval: float = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+    # Libro de ganancias: cada cuánto se reconcilia con los pagos (0 = nunca) y si se corrige
+    ledger_reconcile_interval: float = float(os.getenv("LEDGER_RECONCILE_INTERVAL", "3600"))
+    ledger_reconcile_fix: bool = os.getenv("LEDGER_RECONCILE_FIX", "true").lower() == "true"
+    # Procesamiento de pagos en segundo plano (0 workers = en la propia petición) y reintentos (s)
+    payment_workers: int = int(os.getenv("PAYMENT_WORKERS", "4"))
+    payment_max_attempts: int = int(os.getenv("PAYMENT_MAX_ATTEMPTS", "5"))
+    payment_retry_base: float = float(os.getenv("PAYMENT_RETRY_BASE", "1"))
+    payment_retry_max: float = float(os.getenv("PAYMENT_RETRY_MAX", "60"))
+    payment_lease: float = float(os.getenv("PAYMENT_LEASE", "60"))
+    payment_sweep_interval: float = float(os.getenv("PAYMENT_SWEEP_INTERVAL", "5"))
+    # Proveedor de pagos simulado: latencia media (s) y probabilidad de fallo transitorio y de rechazo
+    # (0 por defecto: los fallos simulados sólo se activan a propósito)
+    payment_provider_latency: float = float(os.getenv("PAYMENT_PROVIDER_LATENCY", "0"))
+    payment_provider_failure_rate: float = float(os.getenv("PAYMENT_PROVIDER_FAILURE_RATE", "0"))
+    payment_provider_decline_rate: float = float(os.getenv("PAYMENT_PROVIDER_DECLINE_RATE", "0"))
+    # Secreto HMAC de POST /payments/webhook (vacío = deshabilitado)
+    payment_webhook_secret: str = os.getenv("PAYMENT_WEBHOOK_SECRET", "")
+    # Idempotency-Key: vida de las respuestas guardadas, lock de una clave en curso y caché por worker
+    idempotency_ttl: float = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    idempotency_lock_timeout: float = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "30"))
+    idempotency_cache_size: int = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+    idempotency_cache_ttl: float = float(os.getenv("IDEMPOTENCY_CACHE_TTL", "300"))
+    # Exportaciones CSV/NDJSON: documentos por lote del cursor y rango máximo en días
+    export_batch_size: int = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+    export_max_days: int = int(os.getenv("EXPORT_MAX_DAYS", "366"))
+    # Diagnóstico: token de los endpoints /diagnostics (vacío = deshabilitados) y monitor de lag del loop
+    diagnostics_token: str = os.getenv("DIAGNOSTICS_TOKEN", "")
+    loop_monitor_enabled: bool = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+    loop_lag_interval: float = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+    loop_lag_threshold: float = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+    # Frames guardados por asignación cuando se activa tracemalloc desde /diagnostics/memory
+    tracemalloc_frames: int = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+    # Control de admisión: peticiones en curso y en cola por grupo de rutas
+    admission_concurrency: Dict[str, int] = json.loads(os.getenv("ADMISSION_CONCURRENCY", "null")) or {
+        "search": 20, "writes": 40, "auth": 8, "media": 4, "exports": 4,
+    }
+    admission_queue_size: Dict[str, int] = json.loads(os.getenv("ADMISSION_QUEUE_SIZE", "null")) or {
+        "search": 20, "writes": 40, "auth": 32, "media": 4, "exports": 4,
+    }
+    admission_queue_timeout: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "0.5"))
+    admission_retry_after: int = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+    # Hash de contraseñas (bcrypt) en un pool de hilos acotado
+    hash_workers: int = int(os.getenv("HASH_WORKERS", "2"))
+    hash_max_pending: int = int(os.getenv("HASH_MAX_PENDING", "32"))
+    hash_retry_after: int = int(os.getenv("HASH_RETRY_AFTER", "2"))
+    # Caché de tokens JWT ya verificados (por worker); nunca supera el exp del token
+    token_cache_size: int = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+    token_cache_ttl: float = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
 
-    
 
 _settings: Settings | None = None
 def get_settings() -> Settings:
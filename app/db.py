@@ -1,5 +1,13 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import pymongo
+from pymongo.errors import OperationFailure, PyMongoError
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from .config import get_settings
+from .metrics import Counter
+from . import dbstats
 
 _settings = get_settings()
 _client: AsyncIOMotorClient | None = None
@@ -8,7 +16,7 @@ _db: AsyncIOMotorDatabase | None = None
 async def get_db() -> AsyncIOMotorDatabase:
     global _client, _db
     if _db is None:
-        _client = AsyncIOMotorClient(_settings.mongodb_uri)
+        _client = AsyncIOMotorClient(_settings.mongodb_uri, event_listeners=[dbstats.listener])
         _db = _client[_settings.db_name]
         # Create indexes you need
         await _db.users.create_index("email", unique=True)
@@ -18,10 +26,80 @@ async def get_db() -> AsyncIOMotorDatabase:
         await _db.messages.create_index([("thread_id", 1)])
         await _db.messages.create_index([("sender_id", 1), ("receiver_id", 1)])
         await _db.messages.create_index([("receiver_id", 1), ("read", 1)])
-        await _db.payments.create_index([("booking_id", 1)])
+        # Reanudación del WebSocket: mensajes recibidos posteriores a un _id
+        await _db.messages.create_index([("receiver_id", 1), ("_id", 1)])
+        # Un pago por reserva: el índice único cierra la carrera de dos creaciones simultáneas
+        try:
+            await _db.payments.create_index([("booking_id", 1)], unique=True)
+        except OperationFailure as e:
+            if e.code not in (85, 86):  # IndexOptionsConflict/IndexKeySpecsConflict
+                raise
+            # Sustituye al índice no único de versiones anteriores
+            await _db.payments.drop_index("booking_id_1")
+            await _db.payments.create_index([("booking_id", 1)], unique=True)
         await _db.reports.create_index([("booking_id", 1)])
         await _db.reports.create_index([("caretaker_id", 1)])
         await _db.payments.create_index([("owner_id", 1), ("caretaker_id", 1)])
+        # Reconciliación del libro de ganancias por cuidador
+        await _db.payments.create_index([("caretaker_id", 1), ("status", 1)])
+        # Barrido de pagos pendientes de intento (procesamiento en segundo plano)
+        await _db.payments.create_index([("status", 1), ("next_attempt_at", 1)])
+        # Exportaciones por rango de fechas (y listados ordenados por fecha)
+        await _db.payments.create_index([("owner_id", 1), ("created_at", 1)])
+        await _db.payments.create_index([("caretaker_id", 1), ("created_at", 1)])
+        await _db.bookings.create_index([("owner_id", 1), ("start", 1)])
+        await _db.bookings.create_index([("caretaker_id", 1), ("start", 1)])
+        # Acumulados diarios de ganancias (también la clave de $merge del backfill)
+        await _db.caretaker_daily.create_index([("caretaker_id", 1), ("day", 1)], unique=True)
+        # Idempotency-Key: una respuesta por (usuario, ruta, clave); caducan por TTL
+        await _db.idempotency.create_index([("user_id", 1), ("route", 1), ("key", 1)], unique=True)
+        await _db.idempotency.create_index("expires_at", expireAfterSeconds=0)
         # Índice geoespacial 2dsphere para búsquedas por ubicación
         await _db.users.create_index([("lat", 1), ("lng", 1)])
-    return _db
\ No newline at end of file
+    return _db
+
+
+# ---------- Límites de tiempo por clase de consulta ----------
+
+# point: búsqueda por _id/clave única; list: listados paginados o acotados;
+# search: filtros libres (regex, geo); aggregate: pipelines; write: inserciones/updates
+QUERY_CLASSES = ("point", "list", "search", "aggregate", "write")
+
+DB_QUERY_TIMEOUTS = Counter(
+    "db_query_timeouts_total",
+    "Consultas abortadas por superar su presupuesto, por ruta y clase",
+    ["route", "query_class"],
+)
+
+
+class QueryTimeout(Exception):
+    """Una consulta superó el presupuesto de su clase (se responde 503)."""
+
+    def __init__(self, query_class: str):
+        super().__init__(f"Consulta '{query_class}' fuera de tiempo")
+        self.query_class = query_class
+
+
+@asynccontextmanager
+async def query_deadline(query_class: str) -> AsyncIterator[None]:
+    """
+    Acota el tiempo de las consultas del bloque:
+
+        async with query_deadline("search"):
+            users = await db.users.find(match).to_list(1000)
+
+    Dentro del bloque pymongo envía `maxTimeMS` con el tiempo que quede (el
+    servidor aborta la consulta) y además hay un deadline asyncio un poco
+    mayor por si el servidor no responde. Ambos se convierten en QueryTimeout.
+    """
+    seconds = _settings.query_timeouts_ms[query_class] / 1000
+    try:
+        with pymongo.timeout(seconds):
+            async with asyncio.timeout(seconds + _settings.query_deadline_grace):
+                yield
+    except TimeoutError as e:
+        raise QueryTimeout(query_class) from e
+    except PyMongoError as e:
+        if getattr(e, "timeout", False):
+            raise QueryTimeout(query_class) from e
+        raise
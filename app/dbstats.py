@@ -0,0 +1,98 @@
+# app/dbstats.py
+"""
+Contabilidad de comandos MongoDB por petición.
+
+Un CommandListener de pymongo suma número de comandos y tiempo en la
+estadística de la petición en curso (un ContextVar). Motor ejecuta pymongo en
+un pool de hilos copiando el contexto, así que el listener ve la misma
+estadística que el handler. Como el listener corre en esos hilos, varios
+comandos simultáneos de una petición (asyncio.gather) actualizan la misma
+estadística a la vez: `record` va protegido por un lock. Los comandos fuera
+de una petición (bucles de fondo) no se cuentan.
+"""
+import threading
+from contextvars import ContextVar, Token
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+
+class RequestDbStats:
+    __slots__ = ("commands", "seconds", "by_command", "_lock")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.seconds = 0.0
+        # comando -> [número, segundos]
+        self.by_command: Dict[str, List[float]] = {}
+
+    def record(self, command: str, seconds: float) -> None:
+        # Llamado desde los hilos de Motor, no desde el event loop
+        with self._lock:
+            self.commands += 1
+            self.seconds += seconds
+            entry = self.by_command.get(command)
+            if entry is None:
+                self.by_command[command] = [1, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+
+
+_current: ContextVar[Optional[RequestDbStats]] = ContextVar("request_db_stats", default=None)
+
+
+# Funciones llamadas al terminar cada petición con (método, ruta, estadística).
+# Las usan los tests para acotar el número de consultas por endpoint.
+_observers: List[Callable[[str, str, RequestDbStats], None]] = []
+
+
+def add_observer(fn: Callable[[str, str, RequestDbStats], None]) -> Callable[[], None]:
+    """Registra un observador y devuelve la función que lo quita."""
+    _observers.append(fn)
+    return lambda: _observers.remove(fn)
+
+
+def notify(method: str, route: str, stats: RequestDbStats) -> None:
+    for fn in list(_observers):
+        fn(method, route, stats)
+
+
+def server_timing(stats: RequestDbStats, total_seconds: float) -> str:
+    """Cabecera Server-Timing con el tiempo en MongoDB y el total de la app."""
+    return (
+        f'db;dur={stats.seconds * 1000:.1f};desc="{stats.commands} comandos", '
+        f"app;dur={total_seconds * 1000:.1f}"
+    )
+
+
+def begin() -> Tuple[RequestDbStats, Token]:
+    stats = RequestDbStats()
+    return stats, _current.set(stats)
+
+
+def end(token: Token) -> None:
+    _current.reset(token)
+
+
+def current() -> Optional[RequestDbStats]:
+    return _current.get()
+
+
+class DbCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        stats = _current.get()
+        if stats is not None:
+            stats.record(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        stats = _current.get()
+        if stats is not None:
+            stats.record(event.command_name, event.duration_micros / 1e6)
+
+
+listener = DbCommandListener()
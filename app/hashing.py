@@ -0,0 +1,103 @@
+# app/hashing.py
+"""
+Hash y verificación de contraseñas fuera del event loop.
+
+bcrypt tarda cientos de milisegundos por llamada; ejecutarlo dentro de un
+handler async congela el resto de peticiones y WebSockets del worker. Aquí se
+ejecuta en un pool de hilos acotado (bcrypt libera el GIL) con un límite de
+trabajos pendientes: si se supera, se responde 503 con Retry-After en lugar de
+encolar sin fin durante una avalancha de logins.
+"""
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+
+from .config import get_settings
+from .metrics import Counter, Gauge, Histogram
+from .security import hash_password, verify_password
+
+settings = get_settings()
+
+_HASH_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+HASH_QUEUE_WAIT = Histogram(
+    "password_hash_queue_wait_seconds",
+    "Tiempo de espera en cola antes de empezar a hashear",
+    ["op"],
+    buckets=_HASH_BUCKETS,
+)
+HASH_DURATION = Histogram(
+    "password_hash_duration_seconds",
+    "Tiempo de CPU de cada hash/verificación",
+    ["op"],
+    buckets=_HASH_BUCKETS,
+)
+HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "Operaciones rechazadas con 503 por tener la cola llena",
+    ["op"],
+)
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = 2, max_pending: int = 32, retry_after: int = 1):
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.retry_after = retry_after
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Trabajos enviados al pool que aún no han terminado (en cola o ejecutándose)
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def hash(self, plain: str) -> str:
+        return await self._run("hash", hash_password, plain)
+
+    async def verify(self, plain: str, hashed: str) -> bool:
+        return await self._run("verify", verify_password, plain, hashed)
+
+    async def _run(self, op: str, fn: Callable[..., Any], *args) -> Any:
+        if self._pending >= self.max_pending:
+            HASH_REJECTED.inc(op=op)
+            raise HTTPException(
+                status_code=503,
+                detail="Servidor ocupado, inténtalo de nuevo en unos segundos",
+                headers={"Retry-After": str(math.ceil(self.retry_after))},
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hash")
+
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            result = fn(*args)
+            return started, time.perf_counter(), result
+
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        future = self._executor.submit(job)
+        # Se descuenta cuando el hilo termina de verdad, aunque el cliente se haya ido
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._done))
+        started, finished, result = await asyncio.wrap_future(future)
+        HASH_QUEUE_WAIT.observe(started - submitted, op=op)
+        HASH_DURATION.observe(finished - started, op=op)
+        return result
+
+    def _done(self) -> None:
+        self._pending -= 1
+
+
+hasher = PasswordHasher(
+    workers=settings.hash_workers,
+    max_pending=settings.hash_max_pending,
+    retry_after=settings.hash_retry_after,
+)
+
+Gauge("password_hash_pending", "Hashes en cola o en ejecución", function=lambda: hasher.pending)
@@ -0,0 +1,229 @@
+# app/idempotency.py
+"""
+Claves de idempotencia (cabecera `Idempotency-Key`) para los POST que crean
+recursos. Un cliente que reintenta tras un timeout manda la misma clave y
+recibe la respuesta guardada de la primera petición sin volver a ejecutarla.
+
+1. Caché LRU en proceso con las respuestas ya completadas (reintentos seguidos).
+2. Colección `idempotency`: la clave se reclama con un insert sobre el índice
+   único (user_id, route, key). Si ya existe y está completada, se reproduce
+   la respuesta; si sigue en curso, 409; si el cuerpo es distinto, 422.
+3. Se ejecuta el handler y se guarda su respuesta. Si lo rechaza con un 4xx
+   no se escribió nada: se libera la clave y el reintento vuelve a ejecutarse.
+
+El handler se ejecuta como mucho una vez por clave. Cuando no se sabe si su
+efecto llegó a escribirse (5xx, timeout, cancelación, o un worker que murió y
+dejó la clave en curso más de `lock_timeout`), la clave pasa a `unknown` y los
+reintentos reciben 409: el cliente debe consultar el recurso y, si no existe,
+repetir con otra clave. Si lo que falla es guardar la respuesta, el recurso ya
+está creado y se responde igual. Los documentos caducan por TTL (`expires_at`).
+Sin cabecera la petición se ejecuta como siempre.
+"""
+import hashlib
+import logging
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from .cache import TTLCache
+from .config import get_settings
+from .db import QueryTimeout, query_deadline
+from .metrics import Counter
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "idempotency_requests_total",
+    "Peticiones con Idempotency-Key por ruta y resultado",
+    ["route", "result"],  # executed|replayed|in_progress|unknown|mismatch
+)
+
+_settings = get_settings()
+# (user_id, route, key) -> (fingerprint, status_code, body) de respuestas completadas
+_completed = TTLCache(
+    "idempotency",
+    maxsize=_settings.idempotency_cache_size,
+    ttl=_settings.idempotency_cache_ttl,
+)
+
+
+def fingerprint(payload: Any) -> str:
+    """Huella del cuerpo: la misma clave con otro cuerpo es un error del cliente."""
+    if isinstance(payload, BaseModel):
+        raw = payload.model_dump_json()
+    else:
+        raw = TypeAdapter(Any).dump_json(payload).decode()
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _route_of(request: Request) -> str:
+    route = request.scope.get("route")
+    return f"{request.method} {getattr(route, 'path', request.url.path)}"
+
+
+def _serialize(request: Request, result: Any) -> Any:
+    """La respuesta tal como la serializa FastAPI (filtrada por el response_model)."""
+    model = getattr(request.scope.get("route"), "response_model", None)
+    if model is not None:
+        result = TypeAdapter(model).validate_python(result)
+    return jsonable_encoder(result)
+
+
+def _replay(route: str, status_code: int, body: Any) -> JSONResponse:
+    IDEMPOTENCY_REQUESTS.inc(route=route, result="replayed")
+    return JSONResponse(body, status_code=status_code, headers={"Idempotent-Replayed": "true"})
+
+
+def _check_fingerprint(route: str, stored: str, current: str) -> None:
+    if stored != current:
+        IDEMPOTENCY_REQUESTS.inc(route=route, result="mismatch")
+        raise HTTPException(422, f"La {HEADER} ya se usó con otro cuerpo de petición")
+
+
+async def _claim(db, ident: dict, fp: str, now: datetime, retry: bool = True) -> Optional[dict]:
+    """
+    Reclama la clave. Devuelve None si esta petición debe ejecutar el handler,
+    o el documento existente si otra ya la reclamó (completada, en curso o unknown).
+    """
+    ttl = timedelta(seconds=_settings.idempotency_ttl)
+    lock = timedelta(seconds=_settings.idempotency_lock_timeout)
+    try:
+        async with query_deadline("write"):
+            await db.idempotency.insert_one({
+                **ident,
+                "fingerprint": fp,
+                "state": "processing",
+                "locked_until": now + lock,
+                "created_at": now,
+                "expires_at": now + ttl,
+            })
+        return None
+    except DuplicateKeyError:
+        pass
+
+    async with query_deadline("point"):
+        existing = await db.idempotency.find_one(ident)
+    if existing is None and retry:
+        # Caducó o se liberó entre el insert y la lectura: se reintenta una vez
+        return await _claim(db, ident, fp, now, retry=False)
+    if existing is None:
+        raise HTTPException(409, f"{HEADER} en conflicto, vuelve a intentarlo", headers={"Retry-After": "1"})
+    if existing["state"] == "processing" and existing["locked_until"] <= now:
+        # El worker que la reclamó no terminó (murió o no pudo guardar la respuesta):
+        # no se sabe si el recurso se creó, así que no se vuelve a ejecutar
+        async with query_deadline("write"):
+            await db.idempotency.update_one(
+                {**ident, "state": "processing", "locked_until": existing["locked_until"]},
+                {"$set": {"state": "unknown"}, "$unset": {"locked_until": ""}},
+            )
+        existing["state"] = "unknown"
+    return existing
+
+
+async def _release(db, ident: dict) -> None:
+    # Si esto falla, la clave pasa a unknown al caducar el lock
+    with suppress(PyMongoError):
+        await db.idempotency.delete_one({**ident, "state": "processing"})
+
+
+async def _mark_unknown(db, ident: dict) -> None:
+    with suppress(PyMongoError):
+        await db.idempotency.update_one(
+            {**ident, "state": "processing"},
+            {"$set": {"state": "unknown"}, "$unset": {"locked_until": ""}},
+        )
+
+
+async def execute(
+    request: Request,
+    db,
+    user_id: str,
+    payload: Any,
+    handler: Callable[[], Awaitable[Any]],
+    status_code: int = 200,
+) -> Any:
+    """
+    Ejecuta `handler` como mucho una vez por (usuario, ruta, Idempotency-Key):
+
+        return await idempotency.execute(request, db, current["id"], payload,
+                                         lambda: _create(...), status_code=201)
+
+    Devuelve el resultado del handler o, si es un reintento, un JSONResponse
+    con la respuesta guardada y la cabecera `Idempotent-Replayed: true`.
+    """
+    key = request.headers.get(HEADER)
+    if key is None:
+        return await handler()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(400, f"{HEADER} debe tener entre 1 y {MAX_KEY_LENGTH} caracteres")
+
+    route = _route_of(request)
+    fp = fingerprint(payload)
+    cache_key: Tuple[str, str, str] = (user_id, route, key)
+    cached = _completed.get(cache_key)
+    if cached is not None:
+        stored_fp, stored_status, body = cached
+        _check_fingerprint(route, stored_fp, fp)
+        return _replay(route, stored_status, body)
+
+    ident = {"user_id": user_id, "route": route, "key": key}
+    existing = await _claim(db, ident, fp, datetime.utcnow())
+    if existing is not None:
+        _check_fingerprint(route, existing["fingerprint"], fp)
+        if existing["state"] == "completed":
+            _completed.set(cache_key, (fp, existing["status_code"], existing["response"]))
+            return _replay(route, existing["status_code"], existing["response"])
+        if existing["state"] == "unknown":
+            IDEMPOTENCY_REQUESTS.inc(route=route, result="unknown")
+            raise HTTPException(
+                409,
+                f"No se sabe si la petición con esta {HEADER} llegó a completarse: "
+                "consulta el recurso y, si no existe, repítela con otra clave",
+            )
+        IDEMPOTENCY_REQUESTS.inc(route=route, result="in_progress")
+        raise HTTPException(
+            409,
+            "Hay una petición con la misma Idempotency-Key en curso",
+            headers={"Retry-After": "1"},
+        )
+
+    try:
+        result = await handler()
+        body = _serialize(request, result)
+    except HTTPException as e:
+        if e.status_code < 500:
+            # Rechazo del handler antes de escribir: el reintento puede ejecutarse
+            await _release(db, ident)
+        else:
+            await _mark_unknown(db, ident)
+        raise
+    except BaseException:
+        # Timeout, error de la base de datos, cancelación: el efecto puede estar ya escrito
+        await _mark_unknown(db, ident)
+        raise
+
+    _completed.set(cache_key, (fp, status_code, body))
+    IDEMPOTENCY_REQUESTS.inc(route=route, result="executed")
+    try:
+        async with query_deadline("write"):
+            await db.idempotency.update_one(
+                ident,
+                {
+                    "$set": {"state": "completed", "status_code": status_code, "response": body},
+                    "$unset": {"locked_until": ""},
+                },
+            )
+    except (PyMongoError, QueryTimeout) as e:
+        # El recurso ya existe: se responde igual. Los reintentos los sirve la caché de
+        # este worker; en otro, la clave queda en curso y después en unknown, nunca se repite
+        logger.warning(f"No se pudo guardar la respuesta de {HEADER} en {route}: {e}")
+    return result
@@ -0,0 +1,413 @@
+# app/ledger.py
+"""
+Libro de ganancias por cuidador (colección `caretaker_ledger`).
+
+Un documento por cuidador con totales acumulados en céntimos (enteros, para
+que las sumas sean exactas):
+
+    {_id: caretaker_id, earned_cents, platform_fee_cents, completed_count,
+     pending_cents, pending_count, refunded_cents, refunded_count, updated_at}
+
+Cada cambio de estado de un pago mueve su importe de un "cubo" a otro con un
+único `$inc` atómico (pending/processing -> pendiente, completed -> ganado,
+refunded -> reembolsado). Así las estadísticas del cuidador son la lectura
+de un documento en lugar de sumar todos sus pagos.
+
+Para las gráficas se mantiene además un acumulado diario por cuidador
+(colección `caretaker_daily`, un documento por cuidador y día de cobro):
+
+    {caretaker_id, day: "AAAA-MM-DD", gross_cents, payout_cents, fee_cents, bookings}
+
+Sólo cuentan los pagos completados, en el día de `completed_at`; un
+reembolso lo descuenta de ese mismo día. Las vistas semanal y mensual se
+obtienen sumando días, así que cada respuesta lee como mucho
+MAX_TIMESERIES_DAYS documentos (más el resto del primer mes), con
+independencia del historial.
+
+El pago y el libro se escriben por separado (sin transacción), así que un
+fallo entre ambas escrituras deja el libro desfasado: `reconcile` recalcula
+los totales con una agregación sobre `payments` y corrige las diferencias.
+"""
+import asyncio
+import logging
+import random
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+LEDGER_MISMATCHES = Counter(
+    "caretaker_ledger_mismatches_total",
+    "Cuidadores cuyo libro no cuadraba con sus pagos al reconciliar",
+    ["fixed"],
+)
+
+FIELDS = (
+    "earned_cents", "platform_fee_cents", "completed_count",
+    "pending_cents", "pending_count", "refunded_cents", "refunded_count",
+)
+
+# Estado del pago -> cubo del libro (failed no cuenta en ninguno)
+BUCKETS = {
+    "pending": "pending",
+    "processing": "pending",
+    "completed": "completed",
+    "refunded": "refunded",
+}
+
+
+def cents(value: Any) -> int:
+    return int(round(float(value or 0) * 100))
+
+
+def _bucket_inc(payment: Dict[str, Any], bucket: Optional[str], sign: int) -> Dict[str, int]:
+    payout = cents(payment.get("caretaker_payout"))
+    if bucket == "pending":
+        return {"pending_cents": sign * payout, "pending_count": sign}
+    if bucket == "completed":
+        return {
+            "earned_cents": sign * payout,
+            "platform_fee_cents": sign * cents(payment.get("platform_fee")),
+            "completed_count": sign,
+        }
+    if bucket == "refunded":
+        return {"refunded_cents": sign * payout, "refunded_count": sign}
+    return {}
+
+
+def delta(payment: Dict[str, Any], old_status: Optional[str], new_status: Optional[str]) -> Dict[str, int]:
+    """Incrementos del libro cuando un pago pasa de `old_status` a `new_status` (None = no existía)."""
+    inc: Dict[str, int] = {}
+    for bucket, sign in ((BUCKETS.get(old_status), -1), (BUCKETS.get(new_status), 1)):
+        for field, value in _bucket_inc(payment, bucket, sign).items():
+            inc[field] = inc.get(field, 0) + value
+    return {k: v for k, v in inc.items() if v}
+
+
+async def record(
+    db: AsyncIOMotorDatabase,
+    payment: Dict[str, Any],
+    old_status: Optional[str],
+    new_status: Optional[str],
+) -> None:
+    """Aplica al libro del cuidador el cambio de estado de un pago."""
+    inc = delta(payment, old_status, new_status)
+    if not inc:
+        return
+    await db.caretaker_ledger.update_one(
+        {"_id": payment["caretaker_id"]},
+        {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    if "completed_count" in inc:
+        await db.caretaker_daily.update_one(
+            {"caretaker_id": payment["caretaker_id"], "day": _day_of(payment)},
+            {"$inc": _daily_inc(payment, inc["completed_count"])},
+            upsert=True,
+        )
+
+
+def to_stats(entry: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Respuesta de /payments/caretaker/stats a partir del documento del libro."""
+    entry = entry or {}
+    return {
+        "total_earnings": entry.get("earned_cents", 0) / 100,
+        "total_payments": entry.get("completed_count", 0),
+        "total_platform_fee": entry.get("platform_fee_cents", 0) / 100,
+        "pending_earnings": entry.get("pending_cents", 0) / 100,
+        "pending_count": entry.get("pending_count", 0),
+    }
+
+
+async def get_stats(db: AsyncIOMotorDatabase, caretaker_id: ObjectId) -> Dict[str, Any]:
+    return to_stats(await db.caretaker_ledger.find_one({"_id": caretaker_id}))
+
+
+# ---------- acumulados diarios ----------
+
+GRANULARITIES = ("day", "week", "month")
+MAX_TIMESERIES_DAYS = 731
+DAILY_FIELDS = ("gross_cents", "payout_cents", "fee_cents", "bookings")
+
+
+def _day_of(payment: Dict[str, Any]) -> str:
+    moment = payment.get("completed_at") or payment.get("created_at") or datetime.utcnow()
+    return moment.strftime("%Y-%m-%d")
+
+
+def _daily_inc(payment: Dict[str, Any], sign: int) -> Dict[str, int]:
+    return {
+        "gross_cents": sign * cents(payment.get("amount")),
+        "payout_cents": sign * cents(payment.get("caretaker_payout")),
+        "fee_cents": sign * cents(payment.get("platform_fee")),
+        "bookings": sign,
+    }
+
+
+def bucket_start(day: date, granularity: str) -> date:
+    """Primer día del periodo (las semanas empiezan en lunes)."""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def merge_buckets(
+    daily: Iterable[Dict[str, Any]],
+    granularity: str,
+    start: date,
+    end: date,
+) -> List[Dict[str, Any]]:
+    """Suma los documentos diarios por periodo, con los periodos vacíos a cero."""
+    totals: Dict[date, Dict[str, int]] = {}
+    day = bucket_start(start, granularity)
+    while day <= end:
+        totals[day] = {k: 0 for k in DAILY_FIELDS}
+        day = bucket_start(day + timedelta(days=31 if granularity == "month" else 7 if granularity == "week" else 1), granularity)
+    for doc in daily:
+        bucket = totals.get(bucket_start(date.fromisoformat(doc["day"]), granularity))
+        if bucket is not None:
+            for k in DAILY_FIELDS:
+                bucket[k] += int(doc.get(k, 0))
+    return [
+        {
+            "start": day.isoformat(),
+            "gross": v["gross_cents"] / 100,
+            "payout": v["payout_cents"] / 100,
+            "fee": v["fee_cents"] / 100,
+            "bookings": v["bookings"],
+        }
+        for day, v in totals.items()
+    ]
+
+
+async def timeseries(
+    db: AsyncIOMotorDatabase,
+    caretaker_id: ObjectId,
+    granularity: str,
+    start: date,
+    end: date,
+) -> Dict[str, Any]:
+    """
+    Serie de ganancias entre `start` y `end` (incluidos) desde los acumulados
+    diarios. `start` se lleva al inicio de su periodo (lunes o día 1): cada
+    punto suma su periodo completo, y `from` en la respuesta es ese inicio.
+    """
+    start = bucket_start(start, granularity)
+    daily = await db.caretaker_daily.find(
+        {"caretaker_id": caretaker_id, "day": {"$gte": start.isoformat(), "$lte": end.isoformat()}},
+        {"_id": 0, "day": 1, **{k: 1 for k in DAILY_FIELDS}},
+    ).to_list(MAX_TIMESERIES_DAYS + 31)
+    points = merge_buckets(daily, granularity, start, end)
+    return {
+        "granularity": granularity,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "points": points,
+        "totals": {
+            "gross": round(sum(p["gross"] for p in points), 2),
+            "payout": round(sum(p["payout"] for p in points), 2),
+            "fee": round(sum(p["fee"] for p in points), 2),
+            "bookings": sum(p["bookings"] for p in points),
+        },
+    }
+
+
+async def backfill_daily(db: AsyncIOMotorDatabase, caretaker_ids: Optional[List[ObjectId]] = None) -> int:
+    """
+    Reconstruye `caretaker_daily` desde `payments` con una agregación que
+    escribe directamente en la colección ($merge). Pensado para el primer
+    despliegue o tras una corrección manual, fuera de horas punta: sustituye
+    los días recalculados y borra los que ya no tienen pagos completados.
+    Devuelve el número de días escritos.
+    """
+    started = datetime.utcnow()
+    match: Dict[str, Any] = {"status": "completed"}
+    scope: Dict[str, Any] = {}
+    if caretaker_ids is not None:
+        match["caretaker_id"] = scope["caretaker_id"] = {"$in": caretaker_ids}
+    moment = {"$ifNull": ["$completed_at", "$created_at"]}
+
+    def total(field: str) -> Dict[str, Any]:
+        return {"$sum": {"$round": [{"$multiply": [{"$ifNull": [f"${field}", 0]}, 100]}, 0]}}
+
+    await db.payments.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"c": "$caretaker_id", "d": {"$dateToString": {"format": "%Y-%m-%d", "date": moment}}},
+            "gross_cents": total("amount"),
+            "payout_cents": total("caretaker_payout"),
+            "fee_cents": total("platform_fee"),
+            "bookings": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": 0,
+            "caretaker_id": "$_id.c",
+            "day": "$_id.d",
+            "gross_cents": {"$toLong": "$gross_cents"},
+            "payout_cents": {"$toLong": "$payout_cents"},
+            "fee_cents": {"$toLong": "$fee_cents"},
+            "bookings": 1,
+            "rebuilt_at": started,
+        }},
+        {"$merge": {
+            "into": "caretaker_daily",
+            "on": ["caretaker_id", "day"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert",
+        }},
+    ], allowDiskUse=True).to_list(None)
+    # Días reconstruidos antes y que esta pasada ya no ha generado
+    await db.caretaker_daily.delete_many({**scope, "rebuilt_at": {"$lt": started}})
+    return await db.caretaker_daily.count_documents({**scope, "rebuilt_at": started})
+
+
+# ---------- reconciliación ----------
+
+def _cents_sum(field: str, status: Iterable[str]) -> Dict[str, Any]:
+    return {"$sum": {"$cond": [
+        {"$in": ["$status", list(status)]},
+        {"$round": [{"$multiply": [{"$ifNull": [f"${field}", 0]}, 100]}, 0]},
+        0,
+    ]}}
+
+
+def _count(status: Iterable[str]) -> Dict[str, Any]:
+    return {"$sum": {"$cond": [{"$in": ["$status", list(status)]}, 1, 0]}}
+
+
+def _statuses(bucket: str) -> List[str]:
+    return [s for s, b in BUCKETS.items() if b == bucket]
+
+
+async def expected_totals(
+    db: AsyncIOMotorDatabase,
+    caretaker_ids: Optional[List[ObjectId]] = None,
+) -> Dict[ObjectId, Dict[str, int]]:
+    """Totales del libro recalculados desde `payments` con una agregación."""
+    pipeline: List[Dict[str, Any]] = []
+    if caretaker_ids is not None:
+        pipeline.append({"$match": {"caretaker_id": {"$in": caretaker_ids}}})
+    pending, completed, refunded = _statuses("pending"), _statuses("completed"), _statuses("refunded")
+    pipeline.append({"$group": {
+        "_id": "$caretaker_id",
+        "earned_cents": _cents_sum("caretaker_payout", completed),
+        "platform_fee_cents": _cents_sum("platform_fee", completed),
+        "completed_count": _count(completed),
+        "pending_cents": _cents_sum("caretaker_payout", pending),
+        "pending_count": _count(pending),
+        "refunded_cents": _cents_sum("caretaker_payout", refunded),
+        "refunded_count": _count(refunded),
+    }})
+    totals = {}
+    async for row in db.payments.aggregate(pipeline, allowDiskUse=True):
+        totals[row.pop("_id")] = {k: int(row[k]) for k in FIELDS}
+    return totals
+
+
+async def _diff(db: AsyncIOMotorDatabase, caretaker_ids: Optional[List[ObjectId]]) -> Dict[ObjectId, tuple]:
+    """{caretaker_id: (libro leído, totales esperados)} de los que no cuadran."""
+    # El libro se lee antes que los pagos: un pago que cambie entre ambas
+    # lecturas aparece como diferencia y se descarta al repetir la comprobación
+    query = {"_id": {"$in": caretaker_ids}} if caretaker_ids is not None else {}
+    ledgers = {d["_id"]: d async for d in db.caretaker_ledger.find(query)}
+    expected = await expected_totals(db, caretaker_ids)
+    zero = {k: 0 for k in FIELDS}
+    mismatched = {}
+    for cid in set(ledgers) | set(expected):
+        entry = ledgers.get(cid, {})
+        current = {k: int(entry.get(k, 0)) for k in FIELDS}
+        want = expected.get(cid, zero)
+        if current != want:
+            mismatched[cid] = (entry, want)
+    return mismatched
+
+
+async def reconcile(db: AsyncIOMotorDatabase, fix: bool = True, settle: float = 2.0) -> List[Dict[str, Any]]:
+    """
+    Compara el libro con los pagos y, con `fix`, corrige los que no cuadran.
+    Sólo se corrige lo que sigue sin cuadrar `settle` segundos después y con
+    el libro intacto (la escritura es condicional a los valores leídos), para
+    no pisar un $inc que esté en curso.
+    """
+    suspects = await _diff(db, None)
+    if suspects and settle:
+        await asyncio.sleep(settle)
+        suspects = await _diff(db, list(suspects))
+
+    report = []
+    for cid, (entry, want) in suspects.items():
+        current = {k: int(entry.get(k, 0)) for k in FIELDS}
+        fixed = False
+        if fix:
+            if entry:
+                guard = {"_id": cid, **{k: entry.get(k) for k in FIELDS if k in entry}}
+                res = await db.caretaker_ledger.update_one(guard, {"$set": {**want, "updated_at": datetime.utcnow()}})
+                fixed = res.modified_count == 1
+            else:
+                res = await db.caretaker_ledger.update_one(
+                    {"_id": cid},
+                    {"$setOnInsert": {**want, "updated_at": datetime.utcnow()}},
+                    upsert=True,
+                )
+                fixed = res.upserted_id is not None
+        LEDGER_MISMATCHES.inc(fixed=str(fixed).lower())
+        report.append({"caretaker_id": str(cid), "ledger": current, "expected": want, "fixed": fixed})
+        logger.warning(f"Libro del cuidador {cid} descuadrado (corregido={fixed}): {current} != {want}")
+    return report
+
+
+class LedgerReconciler:
+    """Reconciliación periódica en segundo plano (con jitter para no coincidir entre workers)."""
+
+    def __init__(self, get_db, interval: float = 3600.0, fix: bool = True):
+        self._get_db = get_db
+        self.interval = interval
+        self.fix = fix
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        # La primera pasada pronto: crea los libros de pagos anteriores al libro
+        delay = random.uniform(5, 30)
+        while True:
+            await asyncio.sleep(delay)
+            delay = self.interval * random.uniform(0.5, 1.0)
+            try:
+                await reconcile(await self._get_db(), fix=self.fix)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error reconciliando el libro de ganancias: {e}", exc_info=True)
+
+
+async def _main(command: str) -> None:
+    from .db import get_db
+
+    db = await get_db()
+    if command == "backfill":
+        print(f"{await backfill_daily(db)} días reconstruidos")
+    else:
+        report = await reconcile(db, fix=command == "fix")
+        print(f"{len(report)} cuidadores descuadrados")
+
+
+if __name__ == "__main__":
+    # python -m app.ledger check|fix|backfill
+    import sys
+
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "check"))
@@ -1,12 +1,23 @@
 from fastapi import FastAPI, Request
 from .config import get_settings
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import users, pets, services, bookings, messages, auth, sitters, reviews, payments, websocket, reports
+from .routers import users, pets, services, bookings, messages, auth, sitters, reviews, payments, websocket, reports, presence, metrics, diagnostics
 from .config import get_settings
 from starlette.staticfiles import StaticFiles
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+from fastapi.responses import JSONResponse
+from .db import DB_QUERY_TIMEOUTS, QueryTimeout, get_db
+from .metrics import Gauge, SnapshotStore
+from .ratelimit import MemoryBackend, MongoBackend, RateLimiter
+from .middleware.rate_limit import RouteRateLimitMiddleware
+from .middleware.admission import AdmissionMiddleware
+from .middleware.instrumentation import InstrumentationMiddleware
+from .profiling import LoopLagMonitor
+from .ledger import LedgerReconciler
+from .payment_processor import processor as payment_processor
+from .realtime.presence import presence as presence_service
+from contextlib import asynccontextmanager
+import os
+import socket
 import logging
 
 # Configurar logging
@@ -18,8 +29,14 @@ logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
-# Configurar rate limiting
-limiter = Limiter(key_func=get_remote_address)
+# Configurar rate limiting: contadores compartidos en MongoDB (o sólo en memoria por worker)
+_memory_backend = MemoryBackend(max_keys=settings.rate_limit_max_keys)
+if settings.rate_limit_backend == "mongo":
+    limiter = RateLimiter(MongoBackend(get_db), fallback=_memory_backend)
+else:
+    limiter = RateLimiter(_memory_backend)
+Gauge("rate_limit_limited_keys", "Claves bloqueadas ahora mismo por rate limiting", function=limiter.limited_keys)
+Gauge("rate_limit_tracked_keys", "Claves con contadores en memoria de este worker", function=limiter.tracked_keys)
 
 # --- importa el router de billing según proveedor ---
 if settings.billing_provider == "stripe":
@@ -28,9 +45,47 @@ else:
     from .routers import billing_mock as billing
 # ----------------------------------------------------
 
-app = FastAPI(title=settings.app_name)
+# Monitor del lag del event loop (uno por worker)
+loop_monitor = LoopLagMonitor(interval=settings.loop_lag_interval, threshold=settings.loop_lag_threshold)
+# Reconciliación periódica del libro de ganancias con los pagos
+ledger_reconciler = LedgerReconciler(
+    get_db,
+    interval=settings.ledger_reconcile_interval,
+    fix=settings.ledger_reconcile_fix,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.loop_monitor_enabled:
+        loop_monitor.start()
+    ledger_reconciler.start()
+    payment_processor.start()
+    presence_service.start(get_db)
+    try:
+        yield
+    finally:
+        presence_service.stop()
+        payment_processor.stop()
+        ledger_reconciler.stop()
+        loop_monitor.stop()
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
 app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    # Plantilla de la ruta (no la URL con ids) para no disparar la cardinalidad
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    DB_QUERY_TIMEOUTS.inc(route=route, query_class=exc.query_class)
+    logger.warning(f"Consulta '{exc.query_class}' fuera de tiempo en {request.method} {route}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "La consulta ha tardado demasiado, inténtalo de nuevo"},
+        headers={"Retry-After": "1"},
+    )
+
 app.mount("/media", StaticFiles(directory=get_settings().media_dir), name="media")
 
 # Configuración de CORS según entorno
@@ -42,14 +97,26 @@ if settings.env == "dev":
     ]
     cors_regex = r"https?://(localhost|127\.0\.0\.1)(:\d+)?"
     cors_methods = ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
-    cors_headers = ["Authorization", "Content-Type", "Accept", "Origin", "X-Requested-With"]
+    cors_headers = ["Authorization", "Content-Type", "Accept", "Origin", "X-Requested-With", "Idempotency-Key"]
 else:
     # Producción: restrictivo - solo orígenes específicos
     frontend_url = settings.frontend_base_url
     cors_origins = [frontend_url] if frontend_url else []
     cors_regex = None
     cors_methods = ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
-    cors_headers = ["Authorization", "Content-Type", "Accept"]
+    cors_headers = ["Authorization", "Content-Type", "Accept", "Idempotency-Key"]
+
+# Control de admisión por grupo de rutas (después del rate limiting: no gasta huecos en peticiones rechazadas)
+app.add_middleware(
+    AdmissionMiddleware,
+    concurrency=settings.admission_concurrency,
+    queue_size=settings.admission_queue_size,
+    queue_timeout=settings.admission_queue_timeout,
+    retry_after=settings.admission_retry_after,
+)
+
+# Rate limiting por ruta antes del enrutado (dentro de CORS para que los 429 lleven sus cabeceras)
+app.add_middleware(RouteRateLimitMiddleware, limits=settings.route_rate_limits)
 
 app.add_middleware(
     CORSMiddleware,
@@ -58,9 +125,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=cors_methods,
     allow_headers=cors_headers,
-    expose_headers=["Content-Type"],
+    expose_headers=["Content-Type", "Idempotent-Replayed"],
 )
 
+# Instrumentación: la más externa, para medir también los 429/503 de los middlewares
+if settings.metrics_dir:
+    metrics.snapshots = SnapshotStore(
+        settings.metrics_dir,
+        worker_id=f"{socket.gethostname()}:{os.getpid()}",
+        interval=settings.metrics_flush_interval,
+    )
+app.add_middleware(InstrumentationMiddleware, snapshots=metrics.snapshots, server_timing=settings.env == "dev")
+
 @app.get("/health")
 async def health():
     return {"status": "ok", "env": settings.env, "billing_provider": settings.billing_provider}
@@ -78,6 +154,9 @@ app.include_router(reviews.router, prefix="/reviews", tags=["reviews"])
 app.include_router(payments.router, prefix="/payments", tags=["payments"])
 app.include_router(websocket.router, tags=["websocket"])
 app.include_router(reports.router, prefix="/reports", tags=["reports"])
+app.include_router(presence.router, prefix="/presence", tags=["presence"])
+app.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
+app.include_router(diagnostics.router, prefix="/diagnostics", tags=["diagnostics"])
 
 # Endpoint de desarrollo (solo en dev)
 if settings.env == "dev":
@@ -0,0 +1,337 @@
+# app/metrics.py
+"""
+Métricas en proceso (contadores, gauges e histogramas) sin dependencias externas.
+Cada worker mantiene sus propios valores en memoria. Las métricas sólo se
+actualizan desde el event loop, por eso no llevan lock; lo que se actualice
+desde otros hilos (p. ej. el CommandListener de pymongo, que Motor ejecuta en
+su pool, ver `dbstats`) necesita su propia sincronización. Con varios workers, los
+valores se combinan al leerlos (ver `SnapshotStore` y `merge`).
+"""
+import asyncio
+import bisect
+import json
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+
+class Registry:
+    """Registro de métricas del proceso, indexado por nombre."""
+
+    def __init__(self):
+        self._metrics: Dict[str, "_Metric"] = {}
+
+    def register(self, metric: "_Metric") -> None:
+        # Re-registrar con el mismo nombre reemplaza (útil al recargar módulos)
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional["_Metric"]:
+        return self._metrics.get(name)
+
+    def collect(self) -> List["_Metric"]:
+        return list(self._metrics.values())
+
+    def snapshot(self) -> Dict[str, Dict[LabelValues, float]]:
+        """Devuelve {nombre: {labels: valor}} con los valores actuales."""
+        return {m.name: dict(m.samples()) for m in self.collect()}
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames: LabelValues = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterable[Tuple[LabelValues, float]]:
+        return list(self._values.items())
+
+
+class Counter(_Metric):
+    """Contador monótono, opcionalmente con labels."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Valor instantáneo. Si se pasa `function`, el valor se calcula al leerlo
+    (útil para tamaños de colas o número de conexiones).
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return super().value(**labels)
+
+    def samples(self) -> Iterable[Tuple[LabelValues, float]]:
+        if self._function is not None:
+            return [((), float(self._function()))]
+        return super().samples()
+
+
+# Buckets por defecto en segundos (de 1 ms a 10 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(_Metric):
+    """
+    Distribución de valores (normalmente duraciones en segundos) en buckets
+    acumulables, más suma y número de observaciones por combinación de labels.
+    `samples()` devuelve el número de observaciones.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._bucket_counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        counts = self._bucket_counts.get(key)
+        if counts is None:
+            # Un hueco extra al final para +Inf
+            counts = self._bucket_counts[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] = self._sums.get(key, 0.0) + value
+        self._values[key] = self._values.get(key, 0.0) + 1
+
+    def count(self, **labels) -> float:
+        return self.value(**labels)
+
+    def sum(self, **labels) -> float:
+        return self._sums.get(self._key(labels), 0.0)
+
+    def cumulative(self, **labels) -> List[Tuple[float, int]]:
+        """[(límite superior, observaciones <= límite)], terminando en +Inf."""
+        counts = self._bucket_counts.get(self._key(labels), [0] * (len(self.buckets) + 1))
+        out, total = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            total += n
+            out.append((bound, total))
+        return out
+
+    def label_sets(self) -> List[LabelValues]:
+        return list(self._bucket_counts)
+
+    def quantile(self, q: float, **labels) -> float:
+        """Estimación del cuantil `q` (0-1) interpolando dentro del bucket."""
+        cumulative = self.cumulative(**labels)
+        total = cumulative[-1][1]
+        if not total:
+            return 0.0
+        rank = q * total
+        lower, prev = 0.0, 0
+        for bound, n in cumulative:
+            if n >= rank:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * ((rank - prev) / max(n - prev, 1))
+            lower, prev = bound, n
+        return lower
+
+
+# ---------- Exportación (formato de texto de Prometheus) ----------
+
+def export(registry: Registry = REGISTRY) -> List[dict]:
+    """Valores actuales como estructuras simples (serializables a JSON)."""
+    families = []
+    for metric in registry.collect():
+        family = {
+            "name": metric.name,
+            "kind": metric.kind,
+            "documentation": metric.documentation,
+            "labelnames": list(metric.labelnames),
+        }
+        if isinstance(metric, Histogram):
+            family["buckets"] = list(metric.buckets)
+            family["series"] = [
+                [list(key), list(counts), metric._sums.get(key, 0.0)]
+                for key, counts in metric._bucket_counts.items()
+            ]
+        else:
+            family["series"] = [[list(key), value] for key, value in metric.samples()]
+        families.append(family)
+    return families
+
+
+def merge(exports: Dict[str, List[dict]]) -> List[dict]:
+    """
+    Combina lo exportado por varios workers ({worker: export()}).
+    Contadores e histogramas se suman; los gauges se mantienen por worker
+    (label `worker`), porque sumar p. ej. una profundidad máxima no tiene sentido.
+    """
+    merged: Dict[str, dict] = {}
+    for worker, families in exports.items():
+        for family in families:
+            target = merged.get(family["name"])
+            if target is None:
+                target = merged[family["name"]] = {**family, "series": {}}
+                if family["kind"] == "gauge":
+                    target["labelnames"] = family["labelnames"] + ["worker"]
+            series = target["series"]
+            for entry in family["series"]:
+                key = tuple(entry[0])
+                if family["kind"] == "gauge":
+                    series[key + (worker,)] = entry[1]
+                elif family["kind"] == "histogram":
+                    prev = series.get(key)
+                    if prev is None:
+                        series[key] = [list(entry[1]), entry[2]]
+                    else:
+                        prev[0] = [a + b for a, b in zip(prev[0], entry[1])]
+                        prev[1] += entry[2]
+                else:
+                    series[key] = series.get(key, 0.0) + entry[1]
+    for family in merged.values():
+        if family["kind"] == "histogram":
+            family["series"] = [[list(k), v[0], v[1]] for k, v in family["series"].items()]
+        else:
+            family["series"] = [[list(k), v] for k, v in family["series"].items()]
+    return list(merged.values())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_prometheus(families: List[dict]) -> str:
+    """Formato de exposición de texto 0.0.4 de Prometheus."""
+    lines: List[str] = []
+    for family in sorted(families, key=lambda f: f["name"]):
+        name, names = family["name"], family["labelnames"]
+        lines.append(f"# HELP {name} {_escape(family['documentation'])}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        for entry in family["series"]:
+            values = entry[0]
+            if family["kind"] == "histogram":
+                counts, total = entry[1], entry[2]
+                cumulative = 0
+                for bound, n in zip(list(family["buckets"]) + [float("inf")], counts):
+                    cumulative += n
+                    le = 'le="' + _number(bound) + '"'
+                    lines.append(f"{name}_bucket{_labels(names, values, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(names, values)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(names, values)} {cumulative}")
+            else:
+                lines.append(f"{name}{_labels(names, values)} {_number(entry[1])}")
+    return "\n".join(lines) + "\n"
+
+
+class SnapshotStore:
+    """
+    Comparte métricas entre los workers de un host: cada worker vuelca
+    periódicamente su `export()` a un fichero JSON en `directory` y el que
+    atiende /metrics combina los de todos. Nada se bloquea: cada worker sólo
+    escribe su propio fichero (con rename atómico).
+    """
+
+    def __init__(self, directory: str, worker_id: str, interval: float = 5.0):
+        self.directory = directory
+        self.worker_id = worker_id
+        self.interval = interval
+        self._task: Optional["asyncio.Task"] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, worker_id: str) -> str:
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in worker_id)
+        return os.path.join(self.directory, f"{safe}.json")
+
+    def write(self) -> None:
+        path = self._path(self.worker_id)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"worker": self.worker_id, "ts": time.time(), "families": export()}, f)
+        os.replace(tmp, path)
+
+    def read_all(self) -> Dict[str, List[dict]]:
+        """{worker: familias}; los valores propios se leen en vivo."""
+        out = {self.worker_id: export()}
+        limit = time.time() - 3 * self.interval  # workers caídos o colgados
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data.get("worker") != self.worker_id and data.get("ts", 0) >= limit:
+                out[data["worker"]] = data["families"]
+        return out
+
+    def ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                self.write()
+            except OSError:
+                pass  # Se reintenta en el siguiente ciclo
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,169 @@
+"""
+Control de admisión por grupo de rutas (load shedding).
+
+Cada grupo (search, writes, auth, media, exports) tiene un máximo de peticiones en
+curso y una cola corta. Si la cola está llena, o la espera supera el timeout,
+se responde 503 con Retry-After al instante en lugar de dejar que una ráfaga
+ocupe todas las conexiones a MongoDB. Las rutas sin grupo (/health, lecturas
+baratas, WebSocket) no se limitan.
+"""
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Pattern, Tuple
+
+from ..metrics import Counter, Gauge, Histogram
+from .responses import send_json
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Peticiones en curso por grupo de rutas",
+    ["group"],
+)
+ADMISSION_QUEUED = Gauge(
+    "admission_queued",
+    "Peticiones esperando turno por grupo de rutas",
+    ["group"],
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Peticiones rechazadas con 503 por grupo y motivo",
+    ["group", "reason"],
+)
+ADMISSION_WAIT = Histogram(
+    "admission_queue_wait_seconds",
+    "Tiempo en cola antes de ser admitida",
+    ["group"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+_WRITE_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+
+# (métodos, ruta, grupo); gana la primera regla que encaje
+ROUTE_GROUPS: List[Tuple[Optional[frozenset], str, str]] = [
+    (frozenset({"POST"}), r"^/pets/[^/]+/photos/?$", "media"),
+    (frozenset({"POST"}), r"^/reports/[^/]+/photo/?$", "media"),
+    (frozenset({"POST"}), r"^/users/me/gallery/?$", "media"),
+    (None, r"^/auth/", "auth"),
+    (frozenset({"GET"}), r"^/sitters/search/?$", "search"),
+    (frozenset({"GET"}), r"^/services/?$", "search"),
+    # Las exportaciones ocupan su hueco mientras dura la descarga
+    (frozenset({"GET"}), r"^/(payments|bookings)/export/?$", "exports"),
+    # El chat (mensajes y presencia) es barato y no debe quedarse sin servicio
+    (None, r"^/(messages|presence)(/|$)", ""),
+    (_WRITE_METHODS, r"^/", "writes"),
+]
+
+
+class AdmissionGroup:
+    def __init__(self, name: str, concurrency: int, queue_size: int, timeout: float):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> Optional[str]:
+        """Ocupa un hueco. Devuelve None si se admite o el motivo del rechazo."""
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            self._update()
+            return None
+        if len(self._waiters) >= self.queue_size:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._update()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait({waiter}, timeout=self.timeout)
+        except BaseException:
+            # Cancelada mientras esperaba: si ya se le cedió un hueco, devolverlo
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        if waiter.done() and not waiter.cancelled():
+            # release() nos cedió su hueco: in_flight ya lo cuenta
+            ADMISSION_WAIT.observe(time.perf_counter() - started, group=self.name)
+            return None
+        self._discard(waiter)
+        return "timeout"
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)  # El hueco pasa directamente al siguiente
+                self._update()
+                return
+        self.in_flight -= 1
+        self._update()
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        self._update()
+
+    def _update(self) -> None:
+        ADMISSION_IN_FLIGHT.set(self.in_flight, group=self.name)
+        ADMISSION_QUEUED.set(len(self._waiters), group=self.name)
+
+
+class AdmissionMiddleware:
+    def __init__(
+        self,
+        app,
+        concurrency: Dict[str, int],
+        queue_size: Dict[str, int],
+        queue_timeout: float = 0.5,
+        retry_after: int = 1,
+        rules: Iterable[Tuple[Optional[frozenset], str, str]] = ROUTE_GROUPS,
+    ):
+        self.app = app
+        self.retry_after = retry_after
+        self.groups: Dict[str, AdmissionGroup] = {
+            name: AdmissionGroup(name, limit, queue_size.get(name, limit), queue_timeout)
+            for name, limit in concurrency.items()
+        }
+        self._rules: List[Tuple[Optional[frozenset], Pattern, str]] = [
+            (methods, re.compile(path), group) for methods, path, group in rules
+        ]
+
+    def classify(self, method: str, path: str) -> Optional[AdmissionGroup]:
+        for methods, regex, group in self._rules:
+            if (methods is None or method in methods) and regex.match(path):
+                return self.groups.get(group)
+        return None
+
+    async def __call__(self, scope, receive, send):
+        group = self.classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if group is None:
+            await self.app(scope, receive, send)
+            return
+
+        reason = await group.acquire()
+        if reason is not None:
+            ADMISSION_REJECTED.inc(group=group.name, reason=reason)
+            await send_json(
+                send,
+                503,
+                {"detail": "Servidor ocupado, inténtalo de nuevo en unos segundos"},
+                headers=[("Retry-After", str(self.retry_after))],
+            )
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            group.release()
@@ -0,0 +1,106 @@
+"""
+Middleware ASGI de instrumentación: peticiones, latencia y tiempo en MongoDB
+por plantilla de ruta, método y status, más peticiones en curso.
+
+Las labels usan la plantilla (`/bookings/{booking_id}`), nunca la URL real,
+para que el número de series no dependa de los ids.
+
+Con `server_timing=True` (en dev) cada respuesta lleva una cabecera
+Server-Timing con los comandos MongoDB y su tiempo, visible en las DevTools.
+"""
+import time
+
+from .. import dbstats
+from ..metrics import Counter, Gauge, Histogram
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "Peticiones HTTP por ruta, método y status",
+    ["method", "route", "status"],
+)
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latencia de las peticiones HTTP",
+    ["method", "route", "status"],
+)
+HTTP_DB_TIME = Histogram(
+    "http_request_db_seconds",
+    "Tiempo total en MongoDB por petición",
+    ["method", "route"],
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Peticiones HTTP en curso",
+    ["method"],
+)
+DB_COMMANDS = Counter(
+    "db_commands_total",
+    "Comandos MongoDB ejecutados durante peticiones HTTP",
+    ["command"],
+)
+DB_COMMAND_SECONDS = Counter(
+    "db_command_seconds_total",
+    "Tiempo acumulado en comandos MongoDB durante peticiones HTTP",
+    ["command"],
+)
+
+UNMATCHED = "<unmatched>"
+
+
+def route_template(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope and scope.get("root_path"):
+        return scope["root_path"]  # Mount (p. ej. /media)
+    return UNMATCHED
+
+
+class InstrumentationMiddleware:
+    def __init__(self, app, snapshots=None, server_timing: bool = False):
+        self.app = app
+        self.snapshots = snapshots
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.snapshots is not None:
+            self.snapshots.ensure_started()
+
+        method = scope["method"]
+        status = 500
+
+        stats, token = dbstats.begin()
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    # Lo que lleve la petición hasta empezar a responder
+                    header = dbstats.server_timing(stats, time.perf_counter() - start)
+                    message = {**message, "headers": [
+                        *message.get("headers", []),
+                        (b"server-timing", header.encode()),
+                        (b"timing-allow-origin", b"*"),  # Visible también desde el front (otro origen)
+                    ]}
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method=method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            dbstats.end(token)
+            HTTP_IN_FLIGHT.dec(method=method)
+            route = route_template(scope)
+            HTTP_REQUESTS.inc(method=method, route=route, status=status)
+            HTTP_DURATION.observe(elapsed, method=method, route=route, status=status)
+            HTTP_DB_TIME.observe(stats.seconds, method=method, route=route)
+            for command, (count, seconds) in stats.by_command.items():
+                DB_COMMANDS.inc(count, command=command)
+                DB_COMMAND_SECONDS.inc(seconds, command=command)
+            dbstats.notify(method, route, stats)
@@ -1,33 +1,76 @@
 """
-Middleware para aplicar rate limiting a endpoints específicos usando slowapi
+Middleware ASGI de rate limiting por ruta.
+
+Se ejecuta antes del enrutado: una petición por encima del límite se rechaza
+sin leer el body, sin validar y sin resolver dependencias (ni get_current_user
+ni la DB). Los límites vienen de `Settings.route_rate_limits`
+({"MÉTODO /ruta/{param}": "N/unidad"}) y se compilan una vez al arrancar.
 """
-from fastapi import Request, HTTPException
-from slowapi import Limiter
-from slowapi.errors import RateLimitExceeded
-from slowapi.util import get_remote_address
+import re
+from typing import Dict, List, Optional, Tuple
+
+from ..ratelimit import parse_limit, retry_after_header
+from .responses import send_json
+
+_PARAM_RE = re.compile(r"\{[^/}]+\}")
 
-def apply_rate_limit(request: Request, limit: str):
+
+def compile_route_limits(limits: Dict[str, str]) -> Tuple[Dict[Tuple[str, str], Tuple[str, str]], List]:
     """
-    Aplica rate limiting a un endpoint específico.
-    Uso: apply_rate_limit(request, "5/minute")
-    
-    Si el limiter no está configurado (por ejemplo, en tests), la función no hace nada.
+    {"POST /auth/login": "10/minute"} -> (rutas exactas, rutas con parámetros).
+    Valida todos los límites al arrancar para no descubrir errores en producción.
     """
-    # Obtener el limiter del state usando getattr para evitar errores si no existe
-    limiter = getattr(request.app.state, "limiter", None)
-    
-    # Si no hay limiter configurado (por ejemplo, en tests), saltar rate limiting
-    if limiter is None:
-        return
-    
-    key = get_remote_address(request)
-    
-    # Usar el método hit() que incrementa el contador y lanza excepción si se excede
-    try:
-        limiter.hit(limit, key)
-    except RateLimitExceeded:
-        raise HTTPException(
-            status_code=429,
-            detail=f"Demasiadas solicitudes. Límite: {limit}. Intenta más tarde."
-        )
+    exact: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    patterns: List[Tuple[str, "re.Pattern", str, str]] = []
+    for spec, limit in limits.items():
+        method, path = spec.split(None, 1)
+        method, path = method.upper(), path.rstrip("/") or "/"
+        parse_limit(limit)
+        if _PARAM_RE.search(path):
+            regex = "^" + "[^/]+".join(re.escape(part) for part in _PARAM_RE.split(path)) + "/?$"
+            patterns.append((method, re.compile(regex), path, limit))
+        else:
+            exact[(method, path)] = (path, limit)
+    return exact, patterns
+
 
+class RouteRateLimitMiddleware:
+    def __init__(self, app, limits: Dict[str, str]):
+        self.app = app
+        self._exact, self._patterns = compile_route_limits(limits)
+
+    def match(self, method: str, path: str) -> Optional[Tuple[str, str]]:
+        """(plantilla de ruta, límite) o None si la ruta no está limitada."""
+        found = self._exact.get((method, path.rstrip("/") or "/"))
+        if found is not None:
+            return found
+        for p_method, regex, template, limit in self._patterns:
+            if p_method == method and regex.match(path):
+                return template, limit
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        found = self.match(scope["method"], scope["path"])
+        # Sin limiter configurado (por ejemplo, en tests) no se limita nada
+        limiter = getattr(scope["app"].state, "limiter", None) if found and "app" in scope else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        template, limit = found
+        client = scope.get("client")
+        ip = client[0] if client else "127.0.0.1"
+        retry_after = await limiter.hit(f"{scope['method']} {template}:{ip}", limit)
+        if retry_after is None:
+            await self.app(scope, receive, send)
+            return
+
+        await send_json(
+            send,
+            429,
+            {"detail": f"Demasiadas solicitudes. Límite: {limit}. Intenta más tarde."},
+            headers=[("Retry-After", retry_after_header(retry_after))],
+        )
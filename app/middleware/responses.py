@@ -0,0 +1,17 @@
+"""
+Respuestas mínimas para middlewares ASGI que rechazan peticiones antes de
+llegar a FastAPI (sin construir Request ni Response).
+"""
+import json
+from typing import Any, Dict, Iterable, Tuple
+
+
+async def send_json(send, status: int, payload: Dict[str, Any], headers: Iterable[Tuple[str, str]] = ()) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    raw_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    raw_headers += [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,352 @@
+# app/payment_processor.py
+"""
+Procesamiento asíncrono de pagos.
+
+`POST /payments/{id}/process` sólo pasa el pago a `processing` y lo encola;
+la latencia de la petición ya no depende de la del proveedor.
+
+- La cola durable es la propia colección: un pago en `processing` con
+  `next_attempt_at` vencido está pendiente de intento. La cola en memoria sólo
+  acelera; un barrido periódico recoge lo que se perdió (reinicios, cola llena)
+  y los reintentos de otros workers.
+- Cada intento reserva el pago adelantando `next_attempt_at` (lease) con una
+  actualización condicionada: dos workers no cobran el mismo pago a la vez.
+- Los errores transitorios del proveedor se reintentan con backoff exponencial
+  (con jitter) hasta `max_attempts`; después el pago pasa a `failed`.
+- El resultado llega como un evento tipo webhook (`payment.succeeded` /
+  `payment.failed`) que aplica `apply_event`, el mismo camino que usa
+  `POST /payments/webhook` para un proveedor externo. Aplicar un evento es
+  idempotente: sólo cambia pagos que siguen en `processing`.
+- Cada cambio de estado actualiza el libro de ganancias y se notifica por
+  WebSocket al dueño y al cuidador (`payment_status`).
+
+Sin workers arrancados (PAYMENT_WORKERS=0 o fuera del lifespan, como en los
+tests) el pago se procesa en la propia petición, reintentos incluidos: no hay
+barrido que lo recoja después, así que la petición no vuelve hasta que el pago
+queda en `completed` o `failed`.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from . import ledger
+from .cache import TTLCache
+from .config import get_settings
+from .db import get_db
+from .metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+PROCESSING = "processing"
+
+PAYMENT_ATTEMPTS = Counter(
+    "payment_attempts_total",
+    "Intentos de cobro por resultado",
+    ["result"],  # succeeded|declined|retry|exhausted
+)
+PAYMENT_PROVIDER_LATENCY = Histogram(
+    "payment_provider_latency_seconds",
+    "Duración de las llamadas al proveedor de pagos",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+PAYMENT_EVENTS = Counter(
+    "payment_events_total",
+    "Eventos de pago recibidos por tipo y si cambiaron el pago",
+    ["type", "applied"],
+)
+
+
+class ProviderUnavailable(Exception):
+    """Error transitorio del proveedor (timeout, 5xx): el intento se reintenta."""
+
+
+def _event(kind: str, payment_id: str, **data) -> Dict[str, Any]:
+    return {
+        "id": f"evt_{uuid.uuid4().hex[:16]}",
+        "type": kind,
+        "created": int(time.time()),
+        "data": {"payment_id": payment_id, **data},
+    }
+
+
+class MockProvider:
+    """
+    Proveedor local: tarda `latency` segundos de media (±50%), falla de forma
+    transitoria con probabilidad `failure_rate` y rechaza la tarjeta con
+    probabilidad `decline_rate`. Recuerda los cobros por clave de idempotencia,
+    como un proveedor real: reintentar un cobro ya hecho no cobra dos veces.
+    Esa memoria está acotada (LRU con TTL): basta con que cubra los reintentos.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        decline_rate: float = 0.0,
+        rng: Optional[random.Random] = None,
+        max_charges: int = 10000,
+        charges_ttl: float = 3600.0,
+    ):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self._rng = rng or random.Random()
+        # clave de idempotencia -> transaction_id
+        self._charges = TTLCache("payment_provider_charges", maxsize=max_charges, ttl=charges_ttl)
+
+    async def charge(self, payment: Dict[str, Any], idempotency_key: str) -> Dict[str, Any]:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * self._rng.uniform(0.5, 1.5))
+        payment_id = str(payment["_id"])
+        transaction_id = self._charges.get(idempotency_key)
+        if transaction_id is not None:
+            return _event("payment.succeeded", payment_id, transaction_id=transaction_id)
+        if self._rng.random() < self.failure_rate:
+            raise ProviderUnavailable("proveedor no disponible (simulado)")
+        if self._rng.random() < self.decline_rate:
+            return _event("payment.failed", payment_id, reason="card_declined")
+        transaction_id = f"mock_txn_{uuid.uuid4().hex[:16]}"
+        self._charges.set(idempotency_key, transaction_id)
+        return _event("payment.succeeded", payment_id, transaction_id=transaction_id)
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: Callable[[float, float], float] = random.uniform) -> float:
+    """Backoff exponencial con jitter: entre la mitad y el total de base·2^(intento-1), acotado."""
+    ceiling = min(cap, base * 2 ** max(0, attempt - 1))
+    return ceiling / 2 + rng(0, ceiling / 2)
+
+
+def sign(body: bytes, secret: str) -> str:
+    """Firma de un webhook: `sha256=<hmac hex del cuerpo>`."""
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify(body: bytes, signature: str, secret: str) -> bool:
+    return bool(secret) and hmac.compare_digest(sign(body, secret), signature or "")
+
+
+async def _notify(payment: Dict[str, Any]) -> None:
+    from .realtime.manager import manager
+
+    message = {
+        "type": "payment_status",
+        "payment_id": str(payment["_id"]),
+        "booking_id": str(payment.get("booking_id")),
+        "status": payment["status"],
+        "transaction_id": payment.get("transaction_id"),
+        "failure_reason": payment.get("failure_reason"),
+    }
+    for user_id in {str(payment.get("owner_id")), str(payment.get("caretaker_id"))}:
+        try:
+            await manager.send_personal_message(message, user_id)
+        except Exception:
+            pass  # Sin conexión WebSocket no pasa nada: el estado está en /payments
+
+
+async def apply_event(db, event: Dict[str, Any]) -> bool:
+    """
+    Aplica un evento del proveedor. Devuelve False si no cambió nada (pago
+    inexistente, ya resuelto o evento repetido).
+    """
+    kind = event.get("type")
+    data = event.get("data") or {}
+    if kind == "payment.succeeded":
+        new_status = "completed"
+        update = {"transaction_id": data.get("transaction_id"), "completed_at": datetime.utcnow()}
+    elif kind == "payment.failed":
+        new_status = "failed"
+        update = {"failure_reason": data.get("reason", "unknown"), "failed_at": datetime.utcnow()}
+    else:
+        raise ValueError(f"Evento de pago desconocido: {kind}")
+    payment_id = data.get("payment_id")
+    if not payment_id or not ObjectId.is_valid(payment_id):
+        raise ValueError("Evento sin payment_id válido")
+
+    # Condicionado a processing: un evento repetido o tardío no cuenta dos veces en el libro
+    payment = await db.payments.find_one_and_update(
+        {"_id": ObjectId(payment_id), "status": PROCESSING},
+        {"$set": {"status": new_status, **update}, "$unset": {"next_attempt_at": ""}},
+        return_document=ReturnDocument.AFTER,
+    )
+    PAYMENT_EVENTS.inc(type=kind, applied=str(payment is not None).lower())
+    if payment is None:
+        return False
+    await ledger.record(db, payment, PROCESSING, new_status)
+    await _notify(payment)
+    return True
+
+
+class PaymentProcessor:
+    def __init__(
+        self,
+        get_db,
+        provider: MockProvider,
+        workers: int = 4,
+        max_attempts: int = 5,
+        retry_base: float = 1.0,
+        retry_max: float = 60.0,
+        lease: float = 60.0,
+        sweep_interval: float = 5.0,
+        queue_size: int = 1000,
+    ):
+        self._get_db = get_db
+        self.provider = provider
+        self.workers = workers
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease = lease
+        self.sweep_interval = sweep_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # Ids en la cola o en curso en este worker (el barrido no los duplica)
+        self._queued: Set[ObjectId] = set()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def queued(self) -> int:
+        return len(self._queued)
+
+    def start(self) -> None:
+        if self.workers <= 0 or self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(loop.create_task(self._sweep()))
+
+    def stop(self) -> None:
+        # Los pagos en curso quedan en processing; el barrido de otro worker (o del siguiente arranque) los retoma
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queued.clear()
+        self._queue = asyncio.Queue(maxsize=self._queue.maxsize)
+
+    async def submit(self, db, payment_id: ObjectId) -> None:
+        """
+        Encola un pago ya en processing. Sin workers lo procesa en la propia
+        petición, con los mismos reintentos y backoff, hasta resolverlo.
+        """
+        if self.running:
+            self._enqueue(payment_id)
+            return
+        retry_at = await self.attempt(db, payment_id)
+        while retry_at is not None:
+            wait = (retry_at - datetime.utcnow()).total_seconds()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            retry_at = await self.attempt(db, payment_id)
+
+    def _enqueue(self, payment_id: ObjectId) -> None:
+        if payment_id in self._queued:
+            return
+        try:
+            self._queue.put_nowait(payment_id)
+        except asyncio.QueueFull:
+            return  # Lo recogerá el barrido
+        self._queued.add(payment_id)
+
+    async def _work(self) -> None:
+        while True:
+            payment_id = await self._queue.get()
+            try:
+                await self.attempt(await self._get_db(), payment_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error procesando el pago {payment_id}: {e}", exc_info=True)
+            finally:
+                self._queued.discard(payment_id)
+
+    async def _sweep(self) -> None:
+        while True:
+            try:
+                db = await self._get_db()
+                docs = await db.payments.find(
+                    {"status": PROCESSING, "next_attempt_at": {"$lte": datetime.utcnow()}},
+                    {"_id": 1},
+                ).limit(self._queue.maxsize).to_list(self._queue.maxsize)
+                for doc in docs:
+                    self._enqueue(doc["_id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error buscando pagos pendientes de procesar: {e}", exc_info=True)
+            await asyncio.sleep(self.sweep_interval * random.uniform(0.8, 1.2))
+
+    async def attempt(self, db, payment_id: ObjectId) -> Optional[datetime]:
+        """
+        Un intento de cobro, si el pago sigue en processing y nadie lo tiene
+        reservado. Devuelve cuándo reintentarlo si hay que repetirlo.
+        """
+        now = datetime.utcnow()
+        payment = await db.payments.find_one_and_update(
+            {"_id": payment_id, "status": PROCESSING, "next_attempt_at": {"$lte": now}},
+            {"$set": {"next_attempt_at": now + timedelta(seconds=self.lease)}, "$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if payment is None:
+            return None
+
+        started = time.perf_counter()
+        try:
+            # El id del pago es la clave de idempotencia: un reintento no cobra dos veces
+            event = await asyncio.wait_for(
+                self.provider.charge(payment, idempotency_key=str(payment_id)),
+                timeout=self.lease / 2,
+            )
+        except (ProviderUnavailable, TimeoutError) as e:
+            PAYMENT_PROVIDER_LATENCY.observe(time.perf_counter() - started)
+            error = str(e) or type(e).__name__
+            if payment["attempts"] >= self.max_attempts:
+                PAYMENT_ATTEMPTS.inc(result="exhausted")
+                event = _event("payment.failed", str(payment_id), reason="provider_unavailable")
+            else:
+                PAYMENT_ATTEMPTS.inc(result="retry")
+                delay = backoff_delay(payment["attempts"], self.retry_base, self.retry_max)
+                retry_at = datetime.utcnow() + timedelta(seconds=delay)
+                await db.payments.update_one(
+                    {"_id": payment_id, "status": PROCESSING},
+                    {"$set": {"next_attempt_at": retry_at, "last_error": error}},
+                )
+                if self.running:
+                    asyncio.get_running_loop().call_later(delay, self._enqueue, payment_id)
+                return retry_at
+        else:
+            PAYMENT_PROVIDER_LATENCY.observe(time.perf_counter() - started)
+            PAYMENT_ATTEMPTS.inc(result="succeeded" if event["type"] == "payment.succeeded" else "declined")
+        await apply_event(db, event)
+        return None
+
+
+processor = PaymentProcessor(
+    get_db,
+    MockProvider(
+        latency=settings.payment_provider_latency,
+        failure_rate=settings.payment_provider_failure_rate,
+        decline_rate=settings.payment_provider_decline_rate,
+    ),
+    workers=settings.payment_workers,
+    max_attempts=settings.payment_max_attempts,
+    retry_base=settings.payment_retry_base,
+    retry_max=settings.payment_retry_max,
+    lease=settings.payment_lease,
+    sweep_interval=settings.payment_sweep_interval,
+)
+
+Gauge("payment_queue_depth", "Pagos en cola o en curso en este worker", function=lambda: processor.queued)
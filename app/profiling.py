@@ -0,0 +1,274 @@
+# app/profiling.py
+"""
+Diagnóstico de rendimiento en producción.
+
+- `SamplingProfiler`: un hilo muestrea cada pocos ms la pila del hilo del
+  event loop (sys._current_frames) durante N segundos. Coste casi nulo para
+  el loop; el resultado se exporta en formato speedscope.
+- `profile_pstats`: cProfile sobre el hilo del loop durante N segundos
+  (más preciso, más caro) con salida de pstats en texto.
+- `MemoryTracker`: tracemalloc bajo demanda. Sólo traza entre `start()` y
+  `stop()`; mientras no se arranca no añade ningún coste. Compara snapshots
+  con una línea base agrupando por lugar de asignación.
+- `LoopLagMonitor`: siempre activo. Mide cuánto se retrasa un latido
+  periódico del loop (lag) y un hilo vigilante captura la pila del loop
+  cuando un callback lo bloquea más de `threshold` segundos (bcrypt,
+  bucles grandes de `to_id`...) y la registra en el log.
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Retraso del latido del event loop respecto a lo programado",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_LAG_RECENT = Gauge(
+    "event_loop_lag_recent_seconds",
+    "Percentiles del lag del event loop en la ventana reciente",
+    ["quantile"],
+)
+LOOP_STALLS = Counter(
+    "event_loop_stalls_total",
+    "Bloqueos del event loop por encima del umbral",
+)
+
+Frame = Tuple[str, str, int]  # (función, fichero, línea)
+
+
+def _stack_of(thread_id: int) -> List[Frame]:
+    """Pila actual de otro hilo, de la raíz a la hoja."""
+    frame = sys._current_frames().get(thread_id)
+    stack: List[Frame] = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, frame.f_lineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self._stacks: Dict[Tuple[Frame, ...], int] = {}
+        self._samples = 0
+
+    def _run(self, seconds: float) -> None:
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            stack = tuple(_stack_of(self.thread_id))
+            if stack:
+                self._stacks[stack] = self._stacks.get(stack, 0) + 1
+                self._samples += 1
+            time.sleep(self.interval)
+
+    async def run(self, seconds: float) -> None:
+        """Muestrea durante `seconds` sin bloquear el loop (el muestreo va en otro hilo)."""
+        await asyncio.to_thread(self._run, seconds)
+
+    def speedscope(self, name: str = "petconnect") -> Dict[str, Any]:
+        """Perfil en formato speedscope (https://www.speedscope.app), tipo 'sampled'."""
+        frames: List[Dict[str, Any]] = []
+        index: Dict[Frame, int] = {}
+        samples, weights = [], []
+        for stack, count in self._stacks.items():
+            ids = []
+            for frame in stack:
+                i = index.get(frame)
+                if i is None:
+                    i = index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                ids.append(i)
+            samples.append(ids)
+            weights.append(count * self.interval)
+        total = sum(weights)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "exporter": "petconnect",
+        }
+
+
+async def profile_pstats(seconds: float, sort: str = "cumulative", limit: int = 60) -> str:
+    """
+    Activa cProfile en el hilo del loop durante `seconds` y devuelve el informe
+    de pstats. Perfila todo lo que ejecute el loop en ese tiempo.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class MemoryTracker:
+    # Asignaciones del propio tracemalloc y de la importación de módulos: ruido
+    FILTERS = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    )
+
+    def __init__(self):
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._baseline_at: Optional[float] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    async def start(self, frames: int = 10) -> None:
+        """Arranca tracemalloc (coste en CPU y memoria hasta `stop()`) y fija la línea base."""
+        if not self.tracing:
+            tracemalloc.start(frames)
+        await self.reset_baseline()
+
+    async def reset_baseline(self) -> None:
+        self._baseline = await self._snapshot()
+        self._baseline_at = time.time()
+
+    def stop(self) -> None:
+        self._baseline = None
+        self._baseline_at = None
+        if self.tracing:
+            tracemalloc.stop()
+
+    async def diff(self, group_by: str = "lineno", limit: int = 25) -> Dict[str, Any]:
+        """Crecimiento desde la línea base, de mayor a menor, agrupado por `group_by`."""
+        snapshot = await self._snapshot()
+        baseline = self._baseline or snapshot
+        stats = await asyncio.to_thread(snapshot.compare_to, baseline, group_by)
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "baseline_age_seconds": round(time.time() - self._baseline_at, 1) if self._baseline_at else 0.0,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "top": [
+                {
+                    "where": [f"{f.filename}:{f.lineno}" for f in stat.traceback],
+                    "size_diff": stat.size_diff,
+                    "size": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count,
+                }
+                for stat in stats[:limit]
+            ],
+        }
+
+    async def _snapshot(self) -> tracemalloc.Snapshot:
+        snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+        return snapshot.filter_traces(self.FILTERS)
+
+
+class LoopLagMonitor:
+    def __init__(
+        self,
+        interval: float = 0.1,
+        threshold: float = 0.25,
+        window: int = 600,
+        log_every: float = 10.0,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.log_every = log_every
+        self._recent: Deque[float] = deque(maxlen=window)
+        self._last_beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_log = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def percentile(self, q: float) -> float:
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    async def _beat(self) -> None:
+        n = 0
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+            lag = max(0.0, now - expected)
+            LOOP_LAG.observe(lag)
+            self._recent.append(lag)
+            if lag >= self.threshold:
+                LOOP_STALLS.inc()
+            n += 1
+            if n % 10 == 0:
+                for q in (0.5, 0.9, 0.99):
+                    LOOP_LAG_RECENT.set(self.percentile(q), quantile=q)
+
+    def _watch(self) -> None:
+        """Hilo vigilante: si el latido se retrasa, captura qué está ejecutando el loop."""
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            beat = self._last_beat
+            # Lo que excede el latido programado es bloqueo
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+            reported_beat = beat  # Una sola captura por bloqueo
+            now = time.monotonic()
+            if now - self._last_log < self.log_every:
+                continue
+            self._last_log = now
+            stack = "".join(traceback.format_list([
+                traceback.FrameSummary(filename, lineno, name)
+                for name, filename, lineno in _stack_of(self._loop_thread)
+            ]))
+            logger.warning(f"Event loop bloqueado {stalled * 1000:.0f} ms. Pila del loop:\n{stack}")
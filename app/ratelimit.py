@@ -0,0 +1,205 @@
+# app/ratelimit.py
+"""
+Rate limiting con contador de ventana deslizante.
+
+Cada clave guarda sólo dos contadores (ventana actual y anterior); la ventana
+deslizante se estima ponderando la anterior por la fracción que aún se solapa.
+Comprobar un límite es O(1) en tiempo y memoria por clave.
+
+Backends:
+- `MemoryBackend`: por worker, acotado en número de claves (LRU).
+- `MongoBackend`: colección `rate_limits` con TTL, compartida por todos los
+  workers (y hosts). Una sola operación atómica por comprobación.
+
+`RateLimiter` cuenta además cada petición en memoria antes de ir al backend
+compartido. Lo contado por este worker es una cota inferior del total: si ya
+supera el límite, la petición se rechaza sin consultar MongoDB. Las claves
+bloqueadas se recuerdan con TTL y se rechazan igual mientras dure el bloqueo.
+Así una avalancha sólo llega a MongoDB con las peticiones que aún caben en el
+límite (como mucho `amount` por worker y ventana), nunca con las rechazadas.
+"""
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from .cache import TTLCache
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_REJECTED = Counter(
+    "rate_limit_rejected_total",
+    "Peticiones rechazadas por rate limiting",
+    ["limit"],
+)
+RATE_LIMIT_BACKEND_ERRORS = Counter(
+    "rate_limit_backend_errors_total",
+    "Errores del backend compartido (se usa el de memoria como respaldo)",
+)
+
+_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_LIMIT_RE = re.compile(r"^\s*(\d+)\s*(?:/|per)\s*(\d+)?\s*(second|minute|hour|day)s?\s*$")
+
+
+class RateLimit(NamedTuple):
+    amount: int
+    seconds: int
+    text: str
+
+
+@lru_cache(maxsize=256)
+def parse_limit(text: str) -> RateLimit:
+    """'5/minute', '100/hour', '10 per 30 seconds' -> RateLimit."""
+    match = _LIMIT_RE.match(text.lower())
+    if not match:
+        raise ValueError(f"Límite inválido: {text!r}")
+    amount, multiplier, unit = match.groups()
+    return RateLimit(int(amount), int(multiplier or 1) * _UNITS[unit], text)
+
+
+def _estimate(prev: int, curr: int, elapsed_fraction: float) -> float:
+    return prev * (1.0 - elapsed_fraction) + curr
+
+
+def _retry_after(prev: int, curr: int, amount: int, window: int, elapsed: float) -> float:
+    """Segundos hasta que la estimación vuelve a bajar del límite."""
+    if curr >= amount:
+        # Hay que esperar a que la ventana actual pase a ser la anterior
+        return window - elapsed + window * (1 - (amount - 1) / curr)
+    # Basta con que la ventana anterior pese menos
+    return max(0.0, window * (1 - (amount - 1 - curr) / prev) - elapsed) if prev else 0.0
+
+
+class MemoryBackend:
+    """Contadores por worker, con un máximo de claves (se olvidan las menos usadas)."""
+
+    def __init__(self, max_keys: int = 100_000, clock: Callable[[], float] = time.time):
+        self.max_keys = max(1, max_keys)
+        self._clock = clock
+        # key -> [índice de ventana, contador actual, contador anterior]
+        self._data: "OrderedDict[str, list]" = OrderedDict()
+
+    async def hit(self, key: str, limit: RateLimit) -> Tuple[int, int, float]:
+        """Cuenta una petición y devuelve (anterior, actual, fracción transcurrida)."""
+        now = self._clock()
+        window = int(now // limit.seconds)
+        entry = self._data.get(key)
+        if entry is None:
+            entry = self._data[key] = [window, 0, 0]
+            if len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+        else:
+            self._data.move_to_end(key)
+            if entry[0] != window:
+                entry[2] = entry[1] if entry[0] == window - 1 else 0
+                entry[1] = 0
+                entry[0] = window
+        entry[1] += 1
+        return entry[2], entry[1], (now % limit.seconds) / limit.seconds
+
+    def key_count(self) -> int:
+        return len(self._data)
+
+
+class MongoBackend:
+    """
+    Un documento por clave: {_id, w (índice de ventana), c (actual), p (anterior),
+    expires_at}. El cambio de ventana y el incremento se hacen en la misma
+    actualización con pipeline, así que es atómico entre workers.
+    """
+
+    def __init__(self, get_db, collection: str = "rate_limits", clock: Callable[[], float] = time.time):
+        self._get_db = get_db
+        self.collection = collection
+        self._clock = clock
+        self._indexed = False
+
+    async def hit(self, key: str, limit: RateLimit) -> Tuple[int, int, float]:
+        db = await self._get_db()
+        coll = db[self.collection]
+        if not self._indexed:
+            await coll.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+
+        now = self._clock()
+        window = int(now // limit.seconds)
+        # Tras dos ventanas sin peticiones el documento ya no aporta nada
+        expires_at = datetime.utcfromtimestamp((window + 2) * limit.seconds)
+        doc = await coll.find_one_and_update(
+            {"_id": key},
+            [{"$set": {
+                "p": {"$cond": [
+                    {"$eq": ["$w", window]}, "$p",
+                    {"$cond": [{"$eq": ["$w", window - 1]}, "$c", 0]},
+                ]},
+                "c": {"$cond": [{"$eq": ["$w", window]}, {"$add": ["$c", 1]}, 1]},
+                "w": window,
+                "expires_at": expires_at,
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return int(doc.get("p") or 0), int(doc["c"]), (now % limit.seconds) / limit.seconds
+
+    def key_count(self) -> int:
+        return 0  # Viven en MongoDB; se acotan con el índice TTL
+
+
+class RateLimiter:
+    def __init__(self, backend, fallback: Optional[MemoryBackend] = None, max_blocked: int = 10_000):
+        self.backend = backend
+        # Contadores locales: pre-comprobación y respaldo si el backend compartido falla
+        if fallback is None:
+            fallback = backend if isinstance(backend, MemoryBackend) else MemoryBackend()
+        self.fallback = fallback
+        # Claves bloqueadas -> se rechazan sin ir al backend hasta que caduquen
+        self._blocked = TTLCache("rate_limit_blocked", maxsize=max_blocked, ttl=60)
+
+    async def hit(self, key: str, limit: str) -> Optional[float]:
+        """
+        Cuenta una petición para `key`. Devuelve None si está permitida o los
+        segundos a esperar si supera el límite.
+        """
+        rule = parse_limit(limit)
+        key = f"{rule.amount}/{rule.seconds}:{key}"
+
+        blocked_until = self._blocked.get(key)
+        if blocked_until is not None:
+            RATE_LIMIT_REJECTED.inc(limit=rule.text)
+            return max(1.0, blocked_until - time.time())
+
+        prev, curr, fraction = await self.fallback.hit(key, rule)
+        if self.backend is not self.fallback and _estimate(prev, curr, fraction) <= rule.amount:
+            # Sólo lo que cabe según este worker se comprueba contra el total compartido
+            try:
+                prev, curr, fraction = await self.backend.hit(key, rule)
+            except Exception as e:
+                RATE_LIMIT_BACKEND_ERRORS.inc()
+                logger.warning(f"Rate limit: backend no disponible ({e}), usando memoria")
+
+        if _estimate(prev, curr, fraction) <= rule.amount:
+            return None
+
+        retry_after = max(1.0, _retry_after(prev, curr, rule.amount, rule.seconds, fraction * rule.seconds))
+        self._blocked.set(key, time.time() + retry_after, ttl=retry_after)
+        RATE_LIMIT_REJECTED.inc(limit=rule.text)
+        return retry_after
+
+    def limited_keys(self) -> int:
+        """Claves bloqueadas ahora mismo en este worker."""
+        self._blocked.expire()
+        return len(self._blocked)
+
+    def tracked_keys(self) -> int:
+        return self.backend.key_count() + (self.fallback.key_count() if self.fallback is not self.backend else 0)
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1 @@
+# Mensajería en tiempo real (WebSocket)
@@ -0,0 +1,157 @@
+# app/realtime/codec.py
+"""
+Codificación de frames WebSocket.
+
+JSON es el formato por defecto. Si el cliente ofrece el subprotocolo
+`petconnect.msgpack.v1` (y msgpack está instalado), los frames se envían como
+MessagePack binario con nombres de campo cortos y timestamps enteros
+(milisegundos desde epoch, UTC).
+
+Cada evento se codifica una sola vez por formato: `Frame` guarda el resultado
+y todas las conexiones que reciben el mismo evento reutilizan los bytes.
+"""
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # Dependencia opcional: sin ella sólo se ofrece JSON
+    msgpack = None
+
+SUBPROTOCOL_JSON = "petconnect.json.v1"
+SUBPROTOCOL_MSGPACK = "petconnect.msgpack.v1"
+
+# Nombre de campo -> código corto (sólo MessagePack). Los campos que no están
+# en la tabla se envían con su nombre completo.
+FIELD_CODES: Dict[str, str] = {
+    "type": "t",
+    "id": "i",
+    "message": "m",
+    "thread_id": "th",
+    "sender_id": "s",
+    "receiver_id": "r",
+    "user_id": "u",
+    "body": "b",
+    "read": "rd",
+    "created_at": "ca",
+    "read_at": "ra",
+    "edited_at": "ea",
+    "is_typing": "ty",
+    "event_id": "e",
+    "epoch": "ep",
+    "last_event_id": "le",
+    "last_message_id": "lm",
+    "report": "rp",
+    "booking_id": "bk",
+    "caretaker_id": "ct",
+    "photo_url": "ph",
+    "activity_type": "ac",
+    "code": "cd",
+    "retry_after": "rta",
+    "replayed": "n",
+    "source": "src",
+    "missing": "mi",
+    "ts": "ts",
+}
+FIELD_NAMES: Dict[str, str] = {code: name for name, code in FIELD_CODES.items()}
+
+# Campos que se convierten a milisegundos desde epoch en MessagePack
+TIMESTAMP_FIELDS = {"created_at", "read_at", "edited_at", "completed_at"}
+
+
+def _epoch_ms(value: Any) -> Any:
+    """ISO (de to_id) o datetime -> ms desde epoch. Lo demás se deja igual."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)  # Guardamos con utcnow()
+        return int(value.timestamp() * 1000)
+    return value
+
+
+def _compact(value: Any) -> Any:
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            if key in TIMESTAMP_FIELDS:
+                item = _epoch_ms(item)
+            out[FIELD_CODES.get(key, key)] = _compact(item)
+        return out
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    if isinstance(value, datetime):
+        return _epoch_ms(value)
+    return value
+
+
+def _expand(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {FIELD_NAMES.get(key, key): _expand(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand(item) for item in value]
+    return value
+
+
+class JsonCodec:
+    name = SUBPROTOCOL_JSON
+    binary = False
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=str)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    name = SUBPROTOCOL_MSGPACK
+    binary = True
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        return msgpack.packb(_compact(message), use_bin_type=True, default=str)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            return json.loads(data)  # Tolerar frames de texto en una conexión binaria
+        return _expand(msgpack.unpackb(data, raw=False))
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec() if msgpack is not None else None
+
+Codec = Union[JsonCodec, MsgpackCodec]
+
+
+def negotiate(offered: Iterable[str]) -> Tuple[Codec, Optional[str]]:
+    """
+    Elige el codec según los subprotocolos ofrecidos por el cliente.
+    Devuelve (codec, subprotocolo a aceptar o None si el cliente no ofreció ninguno conocido).
+    """
+    offered = list(offered or [])
+    if MSGPACK is not None and SUBPROTOCOL_MSGPACK in offered:
+        return MSGPACK, SUBPROTOCOL_MSGPACK
+    if SUBPROTOCOL_JSON in offered:
+        return JSON, SUBPROTOCOL_JSON
+    return JSON, None
+
+
+class Frame:
+    """Un evento saliente con su codificación cacheada por formato."""
+
+    __slots__ = ("message", "_encoded")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    def encoded(self, codec: Codec) -> Union[str, bytes]:
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = codec.encode(self.message)
+            self._encoded[codec.name] = data
+        return data
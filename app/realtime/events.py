@@ -0,0 +1,114 @@
+# app/realtime/events.py
+"""
+Buffer de eventos recientes por usuario para reanudar conexiones.
+
+Cada evento reproducible (new_message, messages_read, new_report, payment_status) recibe un
+`event_id` creciente dentro de este proceso. El cliente guarda el último que
+vio y, al reconectar, envía un frame `resume` para recibir sólo lo que se perdió.
+`epoch` identifica el proceso: si el worker se reinició, los ids no valen.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from ..metrics import Counter
+
+REPLAYABLE_TYPES = {"new_message", "messages_read", "new_report", "payment_status"}
+
+WS_EVENTS_RECORDED = Counter(
+    "ws_events_recorded_total",
+    "Eventos guardados en el buffer de reanudación",
+)
+
+# (event_id, instante de registro, mensaje)
+_Entry = Tuple[int, float, Dict[str, Any]]
+
+
+class _UserRing:
+    __slots__ = ("events", "evicted_upto")
+
+    def __init__(self, size: int):
+        self.events: Deque[_Entry] = deque(maxlen=size)
+        # Mayor event_id descartado de este usuario (0 = ninguno)
+        self.evicted_upto = 0
+
+
+class EventRing:
+    """
+    Últimos eventos por usuario, acotados en número por usuario, en antigüedad
+    y en número de usuarios (LRU). Si falta algún evento del hueco pedido,
+    `since()` devuelve None y el cliente debe resincronizar.
+    """
+
+    def __init__(
+        self,
+        size_per_user: int = 200,
+        max_age: float = 600.0,
+        max_users: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.epoch = uuid4().hex[:12]
+        self.size_per_user = size_per_user
+        self.max_age = max_age
+        self.max_users = max_users
+        self._clock = clock
+        self._seq = 0
+        self._rings: "OrderedDict[str, _UserRing]" = OrderedDict()
+        # Mayor event_id perdido al expulsar usuarios completos del LRU
+        self._floor = 0
+
+    @property
+    def last_event_id(self) -> int:
+        return self._seq
+
+    def record(self, user_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Asigna event_id al mensaje, lo guarda y devuelve la copia sellada."""
+        self._seq += 1
+        stamped = {**message, "event_id": self._seq}
+
+        ring = self._rings.get(user_id)
+        if ring is None:
+            ring = _UserRing(self.size_per_user)
+            self._rings[user_id] = ring
+            if len(self._rings) > self.max_users:
+                _, dropped = self._rings.popitem(last=False)
+                if dropped.events:
+                    self._floor = max(self._floor, dropped.events[-1][0])
+        else:
+            self._rings.move_to_end(user_id)
+
+        if len(ring.events) == ring.events.maxlen:
+            ring.evicted_upto = ring.events[0][0]
+        ring.events.append((self._seq, self._clock(), stamped))
+        self._prune(ring)
+        WS_EVENTS_RECORDED.inc()
+        return stamped
+
+    def since(self, user_id: str, last_event_id: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Eventos del usuario posteriores a `last_event_id`.
+        None si el hueco ya no está completo en memoria.
+        """
+        if last_event_id > self._seq:
+            return None  # id de otro proceso o inventado
+        if last_event_id < self._floor:
+            return None
+        ring = self._rings.get(user_id)
+        if ring is None:
+            return []
+        self._prune(ring)
+        if last_event_id < ring.evicted_upto:
+            return None
+        return [msg for seq, _, msg in ring.events if seq > last_event_id]
+
+    def user_count(self) -> int:
+        return len(self._rings)
+
+    def event_count(self) -> int:
+        return sum(len(r.events) for r in self._rings.values())
+
+    def _prune(self, ring: _UserRing) -> None:
+        limit = self._clock() - self.max_age
+        while ring.events and ring.events[0][1] < limit:
+            ring.evicted_upto = ring.events.popleft()[0]
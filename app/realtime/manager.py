@@ -0,0 +1,397 @@
+# app/realtime/manager.py
+"""
+Gestor de conexiones WebSocket.
+
+Cada usuario puede tener varias conexiones abiertas (móvil, portátil...).
+Cada conexión tiene una cola de salida acotada y su propia tarea escritora,
+así que enviar un mensaje sólo lo encola y un cliente lento no bloquea al resto.
+
+Un reaper envía pings periódicos y cierra las conexiones que llevan más de
+`ws_idle_timeout` segundos sin enviar nada (conexiones móviles medio abiertas).
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, Set, Tuple, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from ..config import get_settings
+from ..metrics import Counter, Gauge
+from .codec import JSON, Codec, Frame, negotiate
+from .events import EventRing, REPLAYABLE_TYPES
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Códigos de cierre
+CLOSE_IDLE_TIMEOUT = 1001      # Going Away: sin actividad del cliente
+CLOSE_USER_LIMIT = 1008        # Policy Violation: demasiadas conexiones del usuario
+CLOSE_SERVER_BUSY = 1013       # Try Again Later: límite global alcanzado
+CLOSE_SLOW_CONSUMER = 1013     # Try Again Later: la cola de salida no se vacía
+
+# Tiempo máximo esperando a que se envíe el frame de cierre
+CLOSE_TIMEOUT_SECONDS = 5.0
+
+POLICY_DROP = "drop"    # descarta el mensaje más antiguo de la cola
+POLICY_CLOSE = "close"  # cierra la conexión; el cliente debe reconectar
+
+WS_DROPPED = Counter(
+    "ws_dropped_messages_total",
+    "Mensajes descartados por cola de salida llena",
+)
+WS_SLOW_CLOSED = Counter(
+    "ws_slow_consumer_closed_total",
+    "Conexiones cerradas por consumidor lento",
+)
+WS_SEND_ERRORS = Counter(
+    "ws_send_errors_total",
+    "Errores al escribir en un WebSocket",
+)
+WS_IDLE_CLOSED = Counter(
+    "ws_idle_closed_total",
+    "Conexiones cerradas por inactividad",
+)
+WS_FRAMES_SENT = Counter(
+    "ws_frames_sent_total",
+    "Frames enviados por tipo de evento y codec",
+    ["type", "codec"],
+)
+WS_BYTES_SENT = Counter(
+    "ws_bytes_sent_total",
+    "Tamaño de los frames enviados (bytes en binario, caracteres en texto)",
+    ["codec"],
+)
+WS_FRAMES_RECEIVED = Counter(
+    "ws_frames_received_total",
+    "Frames recibidos de los clientes por tipo",
+    ["type"],
+)
+WS_BYTES_RECEIVED = Counter(
+    "ws_bytes_received_total",
+    "Tamaño de los frames recibidos (bytes en binario, caracteres en texto)",
+)
+# Tipos de frame que envía el cliente; el resto se cuenta como "other" para
+# que un cliente no pueda crear series arbitrarias
+CLIENT_FRAME_TYPES = {"ping", "pong", "send_message", "typing", "mark_read", "resume"}
+
+WS_REJECTED = Counter(
+    "ws_rejected_connections_total",
+    "Conexiones rechazadas por límite",
+    ["reason"],
+)
+
+# Cierres en curso: el loop sólo guarda referencias débiles a las tareas
+_close_tasks: Set[asyncio.Task] = set()
+
+
+class Connection:
+    """Una conexión WebSocket con su cola de salida y su tarea escritora."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        queue_size: int,
+        policy: str = POLICY_DROP,
+        on_close: Optional[Callable[["Connection"], None]] = None,
+        closing: Optional[Set["Connection"]] = None,
+        codec: Codec = JSON,
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.codec = codec
+        self.policy = policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.dropped = 0
+        self.closed = False
+        self.close_scheduled = False
+        self.last_seen = time.monotonic()
+        self._on_close = on_close
+        # Conjunto compartido con el gestor para el gauge de conexiones en cierre
+        self._closing = closing if closing is not None else set()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def touch(self) -> None:
+        """Marca actividad del cliente (cualquier frame recibido)."""
+        self.last_seen = time.monotonic()
+
+    def idle_for(self, now: Optional[float] = None) -> float:
+        return (now if now is not None else time.monotonic()) - self.last_seen
+
+    def send(self, message: Union[Dict[str, Any], Frame]) -> bool:
+        """
+        Encola un mensaje sin bloquear.
+        Devuelve False si la conexión está cerrada o se ha cerrado por lenta.
+        """
+        if self.closed or self.close_scheduled:
+            return False
+        frame = message if isinstance(message, Frame) else Frame(message)
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == POLICY_CLOSE:
+            WS_SLOW_CLOSED.inc()
+            logger.warning(f"Cerrando WebSocket lento de {self.user_id}")
+            self.close_soon(CLOSE_SLOW_CONSUMER, "Slow consumer")
+            return False
+
+        # Política drop: hacer hueco descartando el mensaje más antiguo
+        try:
+            self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        self.queue.put_nowait(frame)
+        self.dropped += 1
+        WS_DROPPED.inc()
+        return True
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                frame = await self.queue.get()
+                data = frame.encoded(self.codec)
+                codec = "msgpack" if self.codec.binary else "json"
+                if self.codec.binary:
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+                WS_BYTES_SENT.inc(len(data), codec=codec)
+                WS_FRAMES_SENT.inc(type=frame.message.get("type", "unknown"), codec=codec)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            WS_SEND_ERRORS.inc()
+            logger.info(f"Error enviando a {self.user_id}: {e}")
+            self.stop()
+
+    async def receive(self) -> Any:
+        """Recibe y decodifica el siguiente frame del cliente (texto o binario)."""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        self.touch()
+        raw = message.get("bytes")
+        if raw is None:
+            raw = message["text"]
+        WS_BYTES_RECEIVED.inc(len(raw))
+        data = self.codec.decode(raw)
+        frame_type = data.get("type") if isinstance(data, dict) else None
+        WS_FRAMES_RECEIVED.inc(type=frame_type if frame_type in CLIENT_FRAME_TYPES else "other")
+        return data
+
+    def stop(self) -> None:
+        """Detiene el escritor y avisa al gestor. Idempotente."""
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if not self.closed:
+            self.closed = True
+        if self._on_close:
+            on_close, self._on_close = self._on_close, None
+            on_close(self)
+
+    def close_soon(self, code: int, reason: str) -> bool:
+        """
+        Programa el cierre desde código síncrono, una sola vez por conexión.
+        Devuelve False si ya estaba cerrada o con el cierre programado.
+        """
+        if self.closed or self.close_scheduled:
+            return False
+        self.close_scheduled = True
+        task = asyncio.create_task(self.close(code, reason))
+        _close_tasks.add(task)
+        task.add_done_callback(_close_tasks.discard)
+        return True
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        """Cierra el socket y libera la conexión."""
+        already_closed = self.closed
+        self.stop()
+        if already_closed:
+            return
+        self._closing.add(self)
+        try:
+            await asyncio.wait_for(
+                self.websocket.close(code=code, reason=reason),
+                timeout=CLOSE_TIMEOUT_SECONDS,
+            )
+        except Exception:
+            pass  # El socket puede estar ya cerrado o medio abierto
+        finally:
+            self._closing.discard(self)
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        queue_size: Optional[int] = None,
+        policy: Optional[str] = None,
+        ping_interval: Optional[float] = None,
+        idle_timeout: Optional[float] = None,
+        max_per_user: Optional[int] = None,
+        max_total: Optional[int] = None,
+        events: Optional[EventRing] = None,
+    ):
+        # {user_id: {Connection, ...}}
+        self.active_connections: Dict[str, Set[Connection]] = {}
+        # Conexiones cerradas por el servidor cuyo frame de cierre aún no ha salido
+        self.closing_connections: Set[Connection] = set()
+        self.queue_size = queue_size or settings.ws_send_queue_size
+        self.policy = policy or settings.ws_slow_consumer_policy
+        self.ping_interval = ping_interval or settings.ws_ping_interval
+        self.idle_timeout = idle_timeout or settings.ws_idle_timeout
+        self.max_per_user = max_per_user or settings.ws_max_connections_per_user
+        self.max_total = max_total or settings.ws_max_connections
+        self._reaper: Optional[asyncio.Task] = None
+        # Buffer de reanudación; si es None no se sellan eventos
+        self.events = events
+        # Objetos con on_connect(user_id) / on_disconnect(user_id, remaining), p. ej. presencia
+        self.listeners: list = []
+
+    def add_listener(self, listener) -> None:
+        self.listeners.append(listener)
+
+    def _check_limits(self, user_id: str) -> Optional[Tuple[int, str]]:
+        """Devuelve (código, motivo) si la nueva conexión excede algún límite."""
+        if self.connection_count() >= self.max_total:
+            WS_REJECTED.inc(reason="global")
+            return CLOSE_SERVER_BUSY, "Server busy"
+        if len(self.active_connections.get(user_id, ())) >= self.max_per_user:
+            WS_REJECTED.inc(reason="user")
+            return CLOSE_USER_LIMIT, "Too many connections"
+        return None
+
+    async def connect(self, websocket: WebSocket, user_id: str) -> Optional[Connection]:
+        """
+        Acepta el socket y registra la conexión.
+        Si se supera algún límite lo cierra con un código explícito y devuelve None.
+        """
+        codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        rejected = self._check_limits(user_id)
+        if rejected:
+            code, reason = rejected
+            await websocket.close(code=code, reason=reason)
+            return None
+        conn = Connection(
+            websocket,
+            user_id,
+            queue_size=self.queue_size,
+            policy=self.policy,
+            on_close=self._forget,
+            closing=self.closing_connections,
+            codec=codec,
+        )
+        self.active_connections.setdefault(user_id, set()).add(conn)
+        conn.start()
+        self._ensure_reaper()
+        for listener in self.listeners:
+            listener.on_connect(user_id)
+        return conn
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def _reap_loop(self) -> None:
+        """Envía pings y cierra conexiones inactivas. Termina cuando no quedan conexiones."""
+        while self.active_connections:
+            await asyncio.sleep(self.ping_interval)
+            await self.reap_idle()
+
+    async def reap_idle(self) -> int:
+        """Un ciclo del reaper. Devuelve cuántas conexiones se cerraron."""
+        now = time.monotonic()
+        idle = []
+        ping = Frame({"type": "ping", "ts": int(time.time())})
+        for conns in list(self.active_connections.values()):
+            for conn in list(conns):
+                if conn.idle_for(now) > self.idle_timeout:
+                    idle.append(conn)
+                else:
+                    conn.send(ping)
+        closed = 0
+        for conn in idle:
+            if conn.close_soon(CLOSE_IDLE_TIMEOUT, "Idle timeout"):
+                WS_IDLE_CLOSED.inc()
+                logger.info(f"Cerrando WebSocket inactivo de {conn.user_id}")
+                closed += 1
+        return closed
+
+    def disconnect(self, conn: Connection) -> None:
+        conn.stop()
+
+    def _forget(self, conn: Connection) -> None:
+        conns = self.active_connections.get(conn.user_id)
+        if conns is None:
+            return
+        conns.discard(conn)
+        if not conns:
+            del self.active_connections[conn.user_id]
+        for listener in self.listeners:
+            listener.on_disconnect(conn.user_id, len(conns))
+        if not self.active_connections and self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+            self._reaper = None
+
+    def is_online(self, user_id: str) -> bool:
+        return bool(self.active_connections.get(user_id))
+
+    async def send_personal_message(self, message: dict, user_id: str) -> int:
+        """
+        Encola el mensaje en todas las conexiones del usuario. Devuelve cuántas lo aceptaron.
+        Los eventos reproducibles se guardan aunque el usuario no esté conectado.
+        """
+        if self.events is not None and message.get("type") in REPLAYABLE_TYPES:
+            message = self.events.record(user_id, message)
+        frame = Frame(message)  # se codifica una vez por formato
+        delivered = 0
+        for conn in list(self.active_connections.get(user_id, ())):
+            if conn.send(frame):
+                delivered += 1
+        return delivered
+
+    async def broadcast(self, message: dict, exclude_user_id: str = None):
+        frame = Frame(message)
+        for user_id, conns in list(self.active_connections.items()):
+            if user_id == exclude_user_id:
+                continue
+            for conn in list(conns):
+                conn.send(frame)
+
+    def connection_count(self) -> int:
+        return sum(len(conns) for conns in self.active_connections.values())
+
+    def queued_count(self) -> int:
+        return sum(c.queue.qsize() for conns in self.active_connections.values() for c in conns)
+
+    def max_queue_depth(self) -> int:
+        return max(
+            (c.queue.qsize() for conns in self.active_connections.values() for c in conns),
+            default=0,
+        )
+
+
+manager = ConnectionManager(
+    events=EventRing(
+        size_per_user=settings.ws_resume_buffer_size,
+        max_age=settings.ws_resume_max_age,
+        max_users=settings.ws_resume_max_users,
+    ),
+)
+
+Gauge("ws_connections_open", "Conexiones WebSocket abiertas", function=manager.connection_count)
+Gauge(
+    "ws_connections_closing",
+    "Conexiones WebSocket en cierre iniciado por el servidor",
+    function=lambda: len(manager.closing_connections),
+)
+Gauge("ws_queued_messages", "Mensajes pendientes en colas de salida", function=manager.queued_count)
+Gauge("ws_max_queue_depth", "Profundidad de la cola de salida más llena", function=manager.max_queue_depth)
@@ -0,0 +1,317 @@
+# app/realtime/presence.py
+"""
+Presencia de usuarios (online / away / offline + last_seen).
+
+Cada worker calcula la presencia de sus propias conexiones WebSocket y la
+publica en la colección `presence` (un documento por usuario y worker, con TTL).
+Un bucle de sincronización trae los cambios del resto de workers, de modo que
+las consultas se responden siempre desde memoria, sin ir a la base de datos.
+
+Sólo viajan los cambios de estado (marca `updated_at`). Que un worker siga vivo
+lo dice su latido en `presence_workers` (un documento por worker): mientras se
+renueve, sus usuarios online lo siguen estando sin volver a leerlos. El TTL de
+los documentos de usuario se renueva cerca de caducar y sin tocar `updated_at`,
+sólo para que MongoDB los borre si el worker muere.
+
+Las transiciones se suavizan: un usuario pasa a offline sólo si sigue sin
+conexiones pasado `offline_grace` (evita parpadeos al recargar o reconectar) y
+pasa a away tras `away_after` segundos sin actividad propia.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from ..config import get_settings
+from ..metrics import Counter, Gauge
+from .manager import manager
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+ONLINE = "online"
+AWAY = "away"
+OFFLINE = "offline"
+_RANK = {OFFLINE: 0, AWAY: 1, ONLINE: 2}
+
+PRESENCE_TRANSITIONS = Counter(
+    "presence_transitions_total",
+    "Cambios de estado de presencia publicados por este worker",
+    ["status"],
+)
+PRESENCE_SYNC_ERRORS = Counter(
+    "presence_sync_errors_total",
+    "Errores sincronizando la presencia con MongoDB",
+)
+
+
+class _LocalState:
+    __slots__ = ("status", "last_seen", "last_active", "offline_timer")
+
+    def __init__(self, now: datetime):
+        self.status = OFFLINE
+        self.last_seen = now
+        self.last_active = now
+        self.offline_timer: Optional[asyncio.TimerHandle] = None
+
+
+class PresenceService:
+    def __init__(
+        self,
+        manager,
+        away_after: float = 300.0,
+        offline_grace: float = 15.0,
+        sync_interval: float = 5.0,
+        entry_ttl: float = 60.0,
+        offline_ttl: float = 7 * 24 * 3600.0,
+        watermark_lag: float = 2.0,
+        worker_id: Optional[str] = None,
+    ):
+        self.manager = manager
+        self.away_after = away_after
+        self.offline_grace = offline_grace
+        self.sync_interval = sync_interval
+        self.entry_ttl = entry_ttl
+        self.offline_ttl = offline_ttl
+        # Solape de la marca: un cambio con updated_at anterior puede hacerse visible tras la lectura
+        self.watermark_lag = timedelta(seconds=watermark_lag)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        # Estado de las conexiones de este worker
+        self._local: Dict[str, _LocalState] = {}
+        # Estado publicado por otros workers: {user_id: {worker: (status, last_seen, expires_at)}}
+        self._remote: Dict[str, Dict[str, Tuple[str, datetime, datetime]]] = {}
+        # Latidos de los workers: {worker: expires_at}
+        self._workers: Dict[str, datetime] = {}
+        self._dirty: set = set()
+        self._watermark: Optional[datetime] = None
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- ciclo de vida (lifespan) ----------
+
+    def start(self, get_db) -> None:
+        """Arranca la sincronización en segundo plano, fuera de las peticiones."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(get_db))
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, get_db) -> None:
+        while True:
+            try:
+                if self._db is None:
+                    db = await get_db()
+                    await db.presence.create_index("expires_at", expireAfterSeconds=0)
+                    await db.presence.create_index("updated_at")
+                    await db.presence_workers.create_index("expires_at", expireAfterSeconds=0)
+                    self._db = db
+                self._check_away()
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                PRESENCE_SYNC_ERRORS.inc()
+                logger.warning(f"Error sincronizando presencia: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    # ---------- eventos locales (llamados por el ConnectionManager) ----------
+
+    def on_connect(self, user_id: str) -> None:
+        state = self._local.get(user_id)
+        now = datetime.utcnow()
+        if state is None:
+            state = _LocalState(now)
+            self._local[user_id] = state
+        if state.offline_timer:
+            state.offline_timer.cancel()
+            state.offline_timer = None
+        state.last_active = now
+        self._transition(user_id, state, ONLINE)
+
+    def on_disconnect(self, user_id: str, remaining: int) -> None:
+        state = self._local.get(user_id)
+        if state is None or remaining > 0:
+            return
+        if state.offline_timer:
+            state.offline_timer.cancel()
+        loop = asyncio.get_running_loop()
+        state.offline_timer = loop.call_later(self.offline_grace, self._go_offline, user_id)
+
+    def touch(self, user_id: str) -> None:
+        """Actividad real del usuario (no heartbeats): vuelve de away a online."""
+        state = self._local.get(user_id)
+        if state is None:
+            return
+        state.last_active = datetime.utcnow()
+        if state.status == AWAY:
+            self._transition(user_id, state, ONLINE)
+
+    def _go_offline(self, user_id: str) -> None:
+        state = self._local.get(user_id)
+        if state is None or self.manager.is_online(user_id):
+            return
+        state.offline_timer = None
+        self._transition(user_id, state, OFFLINE)
+
+    def _check_away(self) -> None:
+        limit = datetime.utcnow() - timedelta(seconds=self.away_after)
+        for user_id, state in self._local.items():
+            if state.status == ONLINE and state.last_active < limit:
+                self._transition(user_id, state, AWAY)
+
+    def _transition(self, user_id: str, state: _LocalState, status: str) -> None:
+        if state.status == status:
+            return
+        state.status = status
+        state.last_seen = datetime.utcnow()
+        self._dirty.add(user_id)
+        PRESENCE_TRANSITIONS.inc(status=status)
+
+    # ---------- sincronización entre workers ----------
+
+    async def sync(self) -> None:
+        """Publica los cambios locales, renueva el TTL y trae los de otros workers."""
+        db = self._db
+        if db is None:
+            return
+        now = datetime.utcnow()
+
+        if self._dirty:
+            dirty, self._dirty = self._dirty, set()
+            ops, went_offline = [], []
+            for user_id in dirty:
+                state = self._local.get(user_id)
+                if state is None:
+                    continue
+                ttl = self.offline_ttl if state.status == OFFLINE else self.entry_ttl
+                ops.append(UpdateOne(
+                    {"_id": f"{self.worker_id}:{user_id}"},
+                    {
+                        "$set": {
+                            "user_id": user_id,
+                            "worker": self.worker_id,
+                            "status": state.status,
+                            "last_seen": state.last_seen,
+                            "expires_at": now + timedelta(seconds=ttl),
+                        },
+                        "$currentDate": {"updated_at": True},
+                    },
+                    upsert=True,
+                ))
+                if state.status == OFFLINE:
+                    went_offline.append((user_id, state.last_seen, now + timedelta(seconds=ttl)))
+            if ops:
+                try:
+                    await db.presence.bulk_write(ops, ordered=False)
+                except Exception:
+                    self._dirty |= dirty  # reintentar en el siguiente ciclo
+                    raise
+            # Ya publicados: se conservan sólo como entrada "remota" (para last_seen)
+            for user_id, last_seen, expires_at in went_offline:
+                state = self._local.get(user_id)
+                if state is not None and state.status == OFFLINE:
+                    del self._local[user_id]
+                    self._remote.setdefault(user_id, {})[self.worker_id] = (OFFLINE, last_seen, expires_at)
+
+        # Latido de este worker: mantiene online a sus usuarios en los demás
+        expires_at = now + timedelta(seconds=self.entry_ttl)
+        await db.presence_workers.update_one(
+            {"_id": self.worker_id}, {"$set": {"expires_at": expires_at}}, upsert=True,
+        )
+        # TTL de los documentos de usuario: sólo los que van a caducar y sin
+        # updated_at, para que los demás workers no vuelvan a leerlos
+        await db.presence.update_many(
+            {
+                "worker": self.worker_id,
+                "status": {"$ne": OFFLINE},
+                "expires_at": {"$lt": now + timedelta(seconds=self.entry_ttl / 2)},
+            },
+            {"$set": {"expires_at": expires_at}},
+        )
+
+        self._workers = {
+            doc["_id"]: doc["expires_at"]
+            async for doc in db.presence_workers.find({}, {"expires_at": 1})
+        }
+        self._prune(now)
+
+        query: Dict = {"worker": {"$ne": self.worker_id}}
+        if self._watermark is not None:
+            query["updated_at"] = {"$gte": self._watermark - self.watermark_lag}
+        async for doc in db.presence.find(query, {"user_id": 1, "worker": 1, "status": 1,
+                                                   "last_seen": 1, "expires_at": 1, "updated_at": 1}):
+            workers = self._remote.setdefault(doc["user_id"], {})
+            workers[doc["worker"]] = (doc["status"], doc["last_seen"], doc["expires_at"])
+            updated_at = doc.get("updated_at")
+            if updated_at and (self._watermark is None or updated_at > self._watermark):
+                self._watermark = updated_at
+
+    def _alive(self, worker: str, status: str, expires_at: datetime, now: datetime) -> bool:
+        """Una entrada remota online/away vale mientras su worker siga latiendo."""
+        if status != OFFLINE:
+            expires_at = self._workers.get(worker, expires_at)
+        return expires_at >= now
+
+    def _prune(self, now: datetime) -> None:
+        """Olvida entradas caducadas para que la memoria no crezca sin límite."""
+        for user_id in list(self._remote):
+            workers = self._remote[user_id]
+            for worker in [w for w, (s, _, exp) in workers.items() if not self._alive(w, s, exp, now)]:
+                del workers[worker]
+            if not workers:
+                del self._remote[user_id]
+
+    # ---------- consultas (sólo memoria) ----------
+
+    def get(self, user_id: str) -> Dict[str, Optional[object]]:
+        status, last_seen = OFFLINE, None
+        now = datetime.utcnow()
+
+        state = self._local.get(user_id)
+        if state is not None:
+            status, last_seen = state.status, state.last_seen
+
+        for worker, (r_status, r_last_seen, expires_at) in self._remote.get(user_id, {}).items():
+            if not self._alive(worker, r_status, expires_at, now):
+                r_status = OFFLINE  # worker caído: dejó de latir
+            if _RANK[r_status] > _RANK[status]:
+                status = r_status
+            if last_seen is None or (r_last_seen and r_last_seen > last_seen):
+                last_seen = r_last_seen
+
+        return {"status": status, "last_seen": last_seen}
+
+    def bulk(self, user_ids: Iterable[str]) -> Dict[str, Dict[str, Optional[object]]]:
+        return {user_id: self.get(user_id) for user_id in user_ids}
+
+    def online_count(self) -> int:
+        return sum(1 for s in self._local.values() if s.status != OFFLINE)
+
+    def local_count(self) -> int:
+        """Usuarios con estado en este worker (incluidos los que esperan la gracia de offline)."""
+        return len(self._local)
+
+    def remote_count(self) -> int:
+        """Usuarios con entradas publicadas por otros workers (o ya offline) en memoria."""
+        return len(self._remote)
+
+
+presence = PresenceService(
+    manager,
+    away_after=settings.presence_away_after,
+    offline_grace=settings.presence_offline_grace,
+    sync_interval=settings.presence_sync_interval,
+    entry_ttl=settings.presence_entry_ttl,
+)
+manager.add_listener(presence)
+
+Gauge("presence_local_users", "Usuarios online/away en este worker", function=presence.online_count)
@@ -0,0 +1,146 @@
+# app/realtime/throttle.py
+"""
+Control de tráfico en el WebSocket: token bucket para limitar frames por
+conexión y agrupación (coalescing) de los indicadores de "escribiendo".
+"""
+import asyncio
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from ..metrics import Counter
+
+WS_TYPING_FORWARDED = Counter(
+    "ws_typing_forwarded_total",
+    "Eventos de escritura reenviados al receptor",
+)
+WS_TYPING_SUPPRESSED = Counter(
+    "ws_typing_suppressed_total",
+    "Eventos de escritura absorbidos por el coalescing",
+)
+
+
+class TokenBucket:
+    """
+    Token bucket en memoria: `rate` tokens por segundo con ráfagas de hasta `burst`.
+    No es thread-safe; está pensado para usarse por conexión dentro del event loop.
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+    def allow(self, cost: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def retry_after(self, cost: float = 1.0) -> float:
+        """Segundos hasta que haya tokens suficientes."""
+        self._refill()
+        missing = cost - self.tokens
+        if missing <= 0 or self.rate <= 0:
+            return 0.0
+        return missing / self.rate
+
+
+class _TypingState:
+    __slots__ = ("receiver_id", "last_sent", "timer")
+
+    def __init__(self, receiver_id: str, last_sent: float):
+        self.receiver_id = receiver_id
+        self.last_sent = last_sent
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class TypingCoalescer:
+    """
+    Reduce los eventos "typing" que llegan por cada pulsación de tecla.
+
+    - Los cambios de estado (empieza/deja de escribir) se reenvían en el acto.
+    - Mientras se sigue escribiendo, como mucho un evento por thread cada `interval` s.
+    - Si no llega nada en `timeout` s, se envía automáticamente "dejó de escribir".
+    """
+
+    def __init__(self, manager, interval: float = 1.0, timeout: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.manager = manager
+        self.interval = interval
+        self.timeout = timeout
+        self._clock = clock
+        # {(sender_id, thread_id): _TypingState}
+        self._state: Dict[Tuple[str, str], _TypingState] = {}
+
+    async def update(self, sender_id: str, receiver_id: str, thread_id: str, is_typing: bool) -> bool:
+        """Procesa un frame typing. Devuelve True si se reenvió al receptor."""
+        key = (sender_id, thread_id)
+        state = self._state.get(key)
+
+        if not is_typing:
+            if state is None:
+                WS_TYPING_SUPPRESSED.inc()
+                return False
+            return await self.stop(sender_id, thread_id)
+
+        now = self._clock()
+        forward = state is None or now - state.last_sent >= self.interval
+        if state is None:
+            state = _TypingState(receiver_id, now)
+            self._state[key] = state
+        state.receiver_id = receiver_id
+        self._arm_timer(key, state)
+
+        if not forward:
+            WS_TYPING_SUPPRESSED.inc()
+            return False
+        state.last_sent = now
+        await self._send(sender_id, receiver_id, thread_id, True)
+        return True
+
+    async def stop(self, sender_id: str, thread_id: str) -> bool:
+        """Termina el estado de escritura (p. ej. al enviar un mensaje)."""
+        state = self._state.pop((sender_id, thread_id), None)
+        if state is None:
+            return False
+        if state.timer:
+            state.timer.cancel()
+        await self._send(sender_id, state.receiver_id, thread_id, False)
+        return True
+
+    async def stop_sender(self, sender_id: str) -> None:
+        """Cierra todos los indicadores de un usuario (al desconectarse)."""
+        for s_id, thread_id in [k for k in self._state if k[0] == sender_id]:
+            await self.stop(s_id, thread_id)
+
+    def active_count(self) -> int:
+        return len(self._state)
+
+    def _arm_timer(self, key: Tuple[str, str], state: _TypingState) -> None:
+        if state.timer:
+            state.timer.cancel()
+        loop = asyncio.get_running_loop()
+        state.timer = loop.call_later(self.timeout, self._expire, key)
+
+    def _expire(self, key: Tuple[str, str]) -> None:
+        if key in self._state:
+            asyncio.create_task(self.stop(*key))
+
+    async def _send(self, sender_id: str, receiver_id: str, thread_id: str, is_typing: bool) -> None:
+        WS_TYPING_FORWARDED.inc()
+        await self.manager.send_personal_message({
+            "type": "typing",
+            "thread_id": thread_id,
+            "sender_id": sender_id,
+            "is_typing": is_typing,
+        }, receiver_id)
@@ -2,9 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException, status, Request
 from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from ..db import get_db
-from ..security import hash_password, verify_password, create_access_token
+from ..security import create_access_token
+from ..hashing import hasher
 from ..utils import to_id, geocode_city
-from ..middleware.rate_limit import apply_rate_limit
 import re
 import logging
 
@@ -88,16 +88,13 @@ class Login(BaseModel):
 
 @router.post("/signup", status_code=status.HTTP_201_CREATED)
 async def signup(request: Request, payload: Signup, db: AsyncIOMotorDatabase = Depends(get_db)):
-    # Rate limiting: máximo 5 registros por minuto por IP
-    apply_rate_limit(request, "5/minute")
-    
     exists = await db.users.find_one({"email": payload.email})
     if exists:
         raise HTTPException(409, "Email ya registrado")
 
     doc = payload.model_dump()
     # password hash
-    doc["password_hash"] = hash_password(doc.pop("password"))
+    doc["password_hash"] = await hasher.hash(doc.pop("password"))
 
     # —— defaults que espera el front/dashboard/perfil ——
     doc.setdefault("plan", "free")
@@ -137,17 +134,14 @@ async def signup(request: Request, payload: Signup, db: AsyncIOMotorDatabase = D
     # Limpiar campos que no van a la BD
     doc.pop("image", None)
 
-    res = await db.users.insert_one(doc)
+    await db.users.insert_one(doc)  # insert_one añade _id a doc
     # solemos devolver 201 con el usuario (no imprescindible para el front actual)
-    return to_id(await db.users.find_one({"_id": res.inserted_id}))
+    return to_id(doc)
 
 @router.post("/login")
 async def login(request: Request, payload: Login, db: AsyncIOMotorDatabase = Depends(get_db)):
-    # Rate limiting: máximo 10 intentos de login por minuto por IP
-    apply_rate_limit(request, "10/minute")
-    
     user = await db.users.find_one({"email": payload.email})
-    if not user or not verify_password(payload.password, user.get("password_hash", "")):
+    if not user or not await hasher.verify(payload.password, user.get("password_hash", "")):
         raise HTTPException(401, "Credenciales inválidas")
     token = create_access_token(str(user["_id"]))
     return {"access_token": token, "token_type": "bearer"}
@@ -4,7 +4,7 @@ from bson import ObjectId
 
 from ..db import get_db
 from ..config import get_settings
-from ..security import get_current_user
+from ..security import get_current_user, invalidate_user
 
 router = APIRouter()
 settings = get_settings()
@@ -24,6 +24,7 @@ async def create_checkout_session(
         {"_id": ObjectId(current["id"])},
         {"$set": {"plan": "pro", "subscription_status": "active (mock)"}},
     )
+    invalidate_user(current["id"])
     return {"url": f"{settings.frontend_base_url}/pricing?success=1&mock=1"}
 
 @router.post("/create-portal-session")
@@ -48,6 +49,7 @@ async def downgrade(
         {"_id": ObjectId(current["id"])},
         {"$set": {"plan": "free", "subscription_status": "canceled (mock)"}},
     )
+    invalidate_user(current["id"])
     return {"ok": True}
 
 @router.post("/webhook")
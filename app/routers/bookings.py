@@ -1,15 +1,17 @@
 # app/routers/bookings.py
-from fastapi import APIRouter, Depends, HTTPException, status, Path, Request
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query, Request
+from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
-from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from datetime import date, datetime, timedelta
 
-from ..db import get_db
+from .. import exports, idempotency
+from ..config import get_settings
+from ..db import get_db, query_deadline
 from ..schemas.booking import BookingCreate, BookingOut, StatusPatch, BookingStatus
 from ..utils import to_id, to_object_id
 from ..security import get_current_user
-from ..middleware.rate_limit import apply_rate_limit
 import logging
 
 logger = logging.getLogger(__name__)
@@ -55,11 +57,36 @@ async def list_my_bookings(
     db: AsyncIOMotorDatabase = Depends(get_db),
     current=Depends(get_current_user),
 ):
-    docs = await db.bookings.find({
-        "$or": [{"owner_id": current["id"]}, {"caretaker_id": current["id"]}]
-    }).sort("start", 1).to_list(500)
+    async with query_deadline("list"):
+        docs = await db.bookings.find({
+            "$or": [{"owner_id": current["id"]}, {"caretaker_id": current["id"]}]
+        }).sort("start", 1).to_list(500)
     return [_to_out(d) for d in docs]
 
+EXPORT_COLUMNS = (
+    "id", "owner_id", "caretaker_id", "service_id", "pet_id", "start", "end", "status", "total_price", "created_at",
+)
+
+# Antes de /{booking_id}: si no, "export" se tomaría por un id
+@router.get("/export")
+async def export_bookings(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    role: str = Query("any", pattern="^(any|owner|caretaker)$"),
+    from_: Optional[date] = Query(None, alias="from", description="AAAA-MM-DD (incluido, por fecha de inicio)"),
+    to: Optional[date] = Query(None, description="AAAA-MM-DD (incluido, por defecto hoy)"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    current=Depends(get_current_user),
+):
+    """Reservas del usuario en CSV o NDJSON, en streaming y ordenadas por inicio."""
+    settings = get_settings()
+    start, end = exports.date_range(from_, to, settings.export_max_days)
+    fields = ["owner_id", "caretaker_id"] if role == "any" else [f"{role}_id"]
+    cursor = db.bookings.find(
+        {"$or": [{field: current["id"], "start": {"$gte": start, "$lt": end}} for field in fields]},
+        exports.projection(EXPORT_COLUMNS),
+    ).sort("start", 1)
+    return exports.response(cursor, EXPORT_COLUMNS, format, "bookings", start, end, settings.export_batch_size)
+
 @router.get("/{booking_id}", response_model=BookingOut)
 async def get_booking(
     booking_id: str = Path(..., pattern=r"^[0-9a-fA-F]{24}$"),
@@ -80,8 +107,14 @@ async def create_booking(
     db: AsyncIOMotorDatabase = Depends(get_db),
     current=Depends(get_current_user),
 ):
-    # Rate limiting: máximo 15 reservas por minuto por IP
-    apply_rate_limit(request, "15/minute")
+    # Con cabecera Idempotency-Key un reintento devuelve la reserva ya creada
+    return await idempotency.execute(
+        request, db, current["id"], payload,
+        lambda: _create_booking(payload, db, current),
+        status_code=status.HTTP_201_CREATED,
+    )
+
+async def _create_booking(payload: BookingCreate, db: AsyncIOMotorDatabase, current: dict) -> dict:
     if payload.end <= payload.start:
         raise HTTPException(400, "end debe ser posterior a start")
 
@@ -131,9 +164,8 @@ async def create_booking(
         "total_price": total_price,
         "created_at": datetime.utcnow(),
     }
-    res = await db.bookings.insert_one(doc)
-    created = await db.bookings.find_one({"_id": res.inserted_id})
-    return _to_out(created)
+    await db.bookings.insert_one(doc)  # insert_one añade _id a doc
+    return _to_out(doc)
 
 @router.patch("/{booking_id}/status", response_model=BookingOut)
 async def patch_status(
@@ -190,6 +222,7 @@ async def patch_status(
         if overlapping >= max_pets:
             raise HTTPException(409, "Capacidad agotada; no se puede aceptar")
 
-    await db.bookings.update_one({"_id": doc["_id"]}, {"$set": {"status": new.value}})
-    updated = await db.bookings.find_one({"_id": doc["_id"]})
+    updated = await db.bookings.find_one_and_update(
+        {"_id": doc["_id"]}, {"$set": {"status": new.value}}, return_document=ReturnDocument.AFTER
+    )
     return _to_out(updated)
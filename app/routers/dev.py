@@ -5,7 +5,7 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
 from datetime import datetime, timedelta
 from ..db import get_db
-from ..security import hash_password
+from ..hashing import hasher
 from ..utils import geocode_city
 
 router = APIRouter()
@@ -16,12 +16,15 @@ async def seed_data(db: AsyncIOMotorDatabase = Depends(get_db)):
     Crea datos de prueba: cuidadores, servicios, etc.
     Solo para desarrollo.
     """
+    # Misma contraseña para todos: se hashea una sola vez, fuera del event loop
+    password_hash = await hasher.hash("abc12345")
+
     # Crear cuidadores de prueba
     caretakers_data = [
         {
             "name": "María García",
             "email": "maria@test.com",
-            "password_hash": hash_password("abc12345"),
+            "password_hash": password_hash,
             "city": "Madrid",
             "is_caretaker": True,
             "plan": "free",
@@ -41,7 +44,7 @@ async def seed_data(db: AsyncIOMotorDatabase = Depends(get_db)):
         {
             "name": "Juan Pérez",
             "email": "juan@test.com",
-            "password_hash": hash_password("abc12345"),
+            "password_hash": password_hash,
             "city": "Barcelona",
             "is_caretaker": True,
             "plan": "pro",
@@ -61,7 +64,7 @@ async def seed_data(db: AsyncIOMotorDatabase = Depends(get_db)):
         {
             "name": "Ana López",
             "email": "ana@test.com",
-            "password_hash": hash_password("abc12345"),
+            "password_hash": password_hash,
             "city": "Valencia",
             "is_caretaker": True,
             "plan": "free",
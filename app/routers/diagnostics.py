@@ -0,0 +1,140 @@
+# app/routers/diagnostics.py
+"""
+Endpoints de diagnóstico para producción. Deshabilitados (404) salvo que se
+configure DIAGNOSTICS_TOKEN; se llaman con `Authorization: Bearer <token>`.
+"""
+import asyncio
+import gc
+import hmac
+import os
+import resource
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from ..cache import CACHE_ENTRIES
+from ..config import get_settings
+from ..hashing import hasher
+from ..payment_processor import processor as payment_processor
+from ..profiling import MemoryTracker, SamplingProfiler, profile_pstats
+from ..realtime.manager import manager
+from ..realtime.presence import presence
+
+router = APIRouter()
+settings = get_settings()
+
+# Un solo perfilado a la vez por worker
+_profiling = asyncio.Lock()
+memory = MemoryTracker()
+
+
+def require_diagnostics(authorization: Optional[str] = Header(None)) -> None:
+    if not settings.diagnostics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {settings.diagnostics_token}"
+    if not authorization or not hmac.compare_digest(authorization, expected):
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+
+@router.post("/profile", dependencies=[Depends(require_diagnostics)])
+async def profile(
+    seconds: float = Query(10, gt=0, le=120),
+    format: str = Query("speedscope", pattern="^(speedscope|pstats)$"),
+    sort: str = Query("cumulative", pattern="^(cumulative|tottime|calls)$"),
+):
+    """
+    Perfila el worker durante `seconds`.
+    - speedscope: muestreo de pilas (bajo coste), abrir en https://www.speedscope.app
+    - pstats: cProfile del hilo del loop (más detalle, más coste)
+    """
+    if _profiling.locked():
+        raise HTTPException(status_code=409, detail="Ya hay un perfilado en curso")
+    async with _profiling:
+        if format == "pstats":
+            return PlainTextResponse(await profile_pstats(seconds, sort=sort))
+        profiler = SamplingProfiler(threading.get_ident())
+        await profiler.run(seconds)
+        return JSONResponse(
+            profiler.speedscope(),
+            headers={"Content-Disposition": 'attachment; filename="petconnect.speedscope.json"'},
+        )
+
+
+def _rss_bytes() -> int:
+    """RSS actual del proceso (Linux); en otros sistemas, el pico."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def live_counts(request: Request) -> Dict[str, Any]:
+    """Tamaño de las estructuras en memoria sospechosas de crecer."""
+    limiter = getattr(request.app.state, "limiter", None)
+    events = manager.events
+    return {
+        "rss_bytes": _rss_bytes(),
+        "ws_users": len(manager.active_connections),
+        "ws_connections": manager.connection_count(),
+        "ws_closing": len(manager.closing_connections),
+        "ws_queued_frames": manager.queued_count(),
+        "ws_event_ring_users": events.user_count() if events else 0,
+        "ws_event_ring_events": events.event_count() if events else 0,
+        "presence_local_users": presence.local_count(),
+        "presence_remote_users": presence.remote_count(),
+        "cache_entries": {labels[0]: int(value) for labels, value in CACHE_ENTRIES.samples()},
+        "rate_limit_tracked_keys": limiter.tracked_keys() if limiter else 0,
+        "rate_limit_limited_keys": limiter.limited_keys() if limiter else 0,
+        "password_hash_pending": hasher.pending,
+        "payment_queue": payment_processor.queued,
+    }
+
+
+@router.get("/memory", dependencies=[Depends(require_diagnostics)])
+async def memory_report(
+    request: Request,
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    limit: int = Query(25, ge=1, le=200),
+    types: int = Query(0, ge=0, le=100),
+):
+    """
+    Contadores de objetos vivos y, si tracemalloc está activo, el crecimiento
+    por lugar de asignación desde la línea base. `types=N` añade los N tipos
+    con más instancias (recorre todo el heap: usar con moderación).
+    """
+    report: Dict[str, Any] = {"tracing": memory.tracing, "live": live_counts(request)}
+    if memory.tracing:
+        report.update(await memory.diff(group_by=group_by, limit=limit))
+    if types:
+        counts = Counter(type(o).__name__ for o in gc.get_objects())
+        report["types"] = dict(counts.most_common(types))
+    return report
+
+
+@router.post("/memory/start", dependencies=[Depends(require_diagnostics)])
+async def memory_start(frames: int = Query(settings.tracemalloc_frames, ge=1, le=50)):
+    """Arranca tracemalloc y toma la línea base."""
+    if memory.tracing:
+        raise HTTPException(status_code=409, detail="tracemalloc ya está activo")
+    await memory.start(frames)
+    return {"tracing": True, "frames": frames}
+
+
+@router.post("/memory/baseline", dependencies=[Depends(require_diagnostics)])
+async def memory_baseline():
+    """Toma una nueva línea base (el siguiente informe compara contra ella)."""
+    if not memory.tracing:
+        raise HTTPException(status_code=409, detail="tracemalloc no está activo")
+    await memory.reset_baseline()
+    return {"tracing": True}
+
+
+@router.post("/memory/stop", dependencies=[Depends(require_diagnostics)])
+async def memory_stop():
+    """Detiene tracemalloc y libera las trazas."""
+    memory.stop()
+    return {"tracing": False}
@@ -3,16 +3,21 @@ from typing import List, Optional
 from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
-from ..db import get_db
-from ..security import get_current_user
+from pymongo import ReturnDocument
+from ..db import get_db, query_deadline
+from ..security import get_current_user_id
 from ..schemas.message import MessageCreate, MessageOut
 from ..utils import to_id, to_object_id
+from ..realtime.presence import presence
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Datos del otro participante en la lista de conversaciones
+THREAD_USER_PROJECTION = {"password_hash": 0, "gallery": 0, "profile.photos": 0}
+
 # Usar función centralizada (con alias para compatibilidad)
 def _oid(value: str, field_name: str = "id") -> ObjectId:
     return to_object_id(value, field_name)
@@ -21,24 +26,23 @@ def _oid(value: str, field_name: str = "id") -> ObjectId:
 async def create_message(
     payload: MessageCreate,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    current=Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Crear mensaje (también se puede hacer vía WebSocket)"""
-    if payload.sender_id != current["id"]:
+    if payload.sender_id != user_id:
         raise HTTPException(403, "No puedes enviar mensajes como otro usuario")
     
     data = payload.model_dump()
     data["created_at"] = datetime.utcnow()
     data["read"] = False
-    res = await db.messages.insert_one(data)
-    doc = await db.messages.find_one({"_id": res.inserted_id})
-    return to_id(doc)
+    await db.messages.insert_one(data)  # insert_one añade _id a data
+    return to_id(data)
 
 @router.get("", response_model=List[MessageOut])
 async def list_messages(
     thread_id: Optional[str] = Query(None),
     db: AsyncIOMotorDatabase = Depends(get_db),
-    current=Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Listar mensajes de un thread o todos los mensajes del usuario"""
     if thread_id:
@@ -47,57 +51,64 @@ async def list_messages(
         # Solo mensajes donde el usuario es sender o receiver
         query = {
             "$or": [
-                {"sender_id": current["id"]},
-                {"receiver_id": current["id"]}
+                {"sender_id": user_id},
+                {"receiver_id": user_id}
             ]
         }
     
     items = []
-    async for doc in db.messages.find(query).sort("created_at", 1):
-        items.append(to_id(doc))
+    async with query_deadline("list"):
+        async for doc in db.messages.find(query).sort("created_at", 1):
+            items.append(to_id(doc))
     return items
 
 @router.get("/threads", response_model=List[dict])
 async def list_threads(
     db: AsyncIOMotorDatabase = Depends(get_db),
-    current=Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Listar todas las conversaciones (threads) del usuario"""
-    # Obtener todos los mensajes del usuario
-    messages = []
-    async for doc in db.messages.find({
-        "$or": [
-            {"sender_id": current["id"]},
-            {"receiver_id": current["id"]}
-        ]
-    }).sort("created_at", -1):
-        messages.append(to_id(doc))
-    
-    # Agrupar por thread_id y obtener el último mensaje de cada thread
+    # Último mensaje y no leídos de cada thread, agrupados en MongoDB
+    pipeline = [
+        {"$match": {"$or": [{"sender_id": user_id}, {"receiver_id": user_id}]}},
+        {"$sort": {"created_at": -1}},
+        {"$group": {
+            "_id": "$thread_id",
+            "last_message": {"$first": "$$ROOT"},
+            "unread_count": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$receiver_id", user_id]}, {"$ne": ["$read", True]}]}, 1, 0,
+            ]}},
+        }},
+    ]
     threads_map = {}
-    for msg in messages:
-        thread_id = msg["thread_id"]
-        if thread_id not in threads_map:
-            threads_map[thread_id] = {
-                "thread_id": thread_id,
+    async with query_deadline("aggregate"):
+        async for row in db.messages.aggregate(pipeline):
+            msg = to_id(row["last_message"])
+            threads_map[row["_id"]] = {
+                "thread_id": row["_id"],
                 "last_message": msg,
-                "unread_count": 0,
-                "other_user_id": msg["receiver_id"] if msg["sender_id"] == current["id"] else msg["sender_id"],
+                "unread_count": row["unread_count"],
+                "other_user_id": msg["receiver_id"] if msg["sender_id"] == user_id else msg["sender_id"],
             }
-        # Contar no leídos
-        if msg.get("receiver_id") == current["id"] and not msg.get("read", False):
-            threads_map[thread_id]["unread_count"] += 1
     
-    # Obtener información del otro usuario
+        # Información de los otros usuarios en una sola consulta (sin hash ni galería)
+        other_ids = [ObjectId(t["other_user_id"]) for t in threads_map.values() if ObjectId.is_valid(t["other_user_id"])]
+        users_by_id = {
+            str(u["_id"]): u
+            async for u in db.users.find({"_id": {"$in": other_ids}}, THREAD_USER_PROJECTION)
+        }
+    
     threads = []
     for thread_data in threads_map.values():
-        other_user = await db.users.find_one({"_id": _oid(thread_data["other_user_id"])})
+        other_user = users_by_id.get(thread_data["other_user_id"])
         if other_user:
             threads.append({
                 "thread_id": thread_data["thread_id"],
                 "other_user": to_id(other_user),
                 "last_message": thread_data["last_message"],
                 "unread_count": thread_data["unread_count"],
+                # Presencia desde memoria: sin consultas extra
+                "presence": presence.get(thread_data["other_user_id"]),
             })
     
     return sorted(threads, key=lambda x: x["last_message"]["created_at"], reverse=True)
@@ -106,35 +117,34 @@ async def list_threads(
 async def mark_message_read(
     message_id: str,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    current=Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Marcar un mensaje como leído"""
     message = await db.messages.find_one({"_id": _oid(message_id)})
     if not message:
         raise HTTPException(404, "Mensaje no encontrado")
     
-    if str(message.get("receiver_id")) != current["id"]:
+    if str(message.get("receiver_id")) != user_id:
         raise HTTPException(403, "No puedes marcar este mensaje como leído")
     
-    await db.messages.update_one(
+    updated = await db.messages.find_one_and_update(
         {"_id": _oid(message_id)},
-        {"$set": {"read": True, "read_at": datetime.utcnow()}}
+        {"$set": {"read": True, "read_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER,
     )
-    
-    updated = await db.messages.find_one({"_id": _oid(message_id)})
     return to_id(updated)
 
 @router.patch("/thread/{thread_id}/read-all")
 async def mark_thread_read(
     thread_id: str,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    current=Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Marcar todos los mensajes de un thread como leídos"""
     result = await db.messages.update_many(
         {
             "thread_id": thread_id,
-            "receiver_id": current["id"],
+            "receiver_id": user_id,
             "read": False
         },
         {"$set": {"read": True, "read_at": datetime.utcnow()}}
@@ -146,14 +156,14 @@ async def update_message(
     message_id: str,
     payload: dict,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    current=Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Editar un mensaje (solo el autor y dentro de un tiempo límite)"""
     message = await db.messages.find_one({"_id": _oid(message_id)})
     if not message:
         raise HTTPException(404, "Mensaje no encontrado")
     
-    if str(message.get("sender_id")) != current["id"]:
+    if str(message.get("sender_id")) != user_id:
         raise HTTPException(403, "Solo puedes editar tus propios mensajes")
     
     # Opcional: limitar edición a mensajes recientes (ej: 15 minutos)
@@ -171,22 +181,23 @@ async def update_message(
     if not updates:
         return to_id(message)
     
-    await db.messages.update_one({"_id": _oid(message_id)}, {"$set": updates})
-    updated = await db.messages.find_one({"_id": _oid(message_id)})
+    updated = await db.messages.find_one_and_update(
+        {"_id": _oid(message_id)}, {"$set": updates}, return_document=ReturnDocument.AFTER
+    )
     return to_id(updated)
 
 @router.delete("/{message_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_message(
     message_id: str,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    current=Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Eliminar un mensaje (solo el autor)"""
     message = await db.messages.find_one({"_id": _oid(message_id)})
     if not message:
         raise HTTPException(404, "Mensaje no encontrado")
     
-    if str(message.get("sender_id")) != current["id"]:
+    if str(message.get("sender_id")) != user_id:
         raise HTTPException(403, "Solo puedes eliminar tus propios mensajes")
     
     await db.messages.delete_one({"_id": _oid(message_id)})
@@ -0,0 +1,25 @@
+# app/routers/metrics.py
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+
+from ..config import get_settings
+from ..metrics import export, merge, render_prometheus
+
+router = APIRouter()
+settings = get_settings()
+
+# Lo asigna main.py si METRICS_DIR está configurado (varios workers)
+snapshots = None
+
+
+@router.get("", response_class=PlainTextResponse)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """Métricas en formato de texto de Prometheus."""
+    if settings.metrics_token and authorization != f"Bearer {settings.metrics_token}":
+        raise HTTPException(status_code=401, detail="No autorizado")
+    if snapshots is not None:
+        families = merge(snapshots.read_all())
+    else:
+        families = export()
+    return PlainTextResponse(render_prometheus(families), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,16 +1,19 @@
 # app/routers/payments.py
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
 from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
-from datetime import datetime
-import uuid
+from datetime import date, datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import json
 
-from ..db import get_db
+from .. import exports, idempotency, ledger, payment_processor
+from ..config import get_settings
+from ..db import get_db, query_deadline, QueryTimeout
 from ..security import get_current_user
 from ..utils import to_id, to_object_id
 from ..schemas.payment import PaymentCreate, PaymentOut, PaymentStatus, PaymentMethod
-from ..middleware.rate_limit import apply_rate_limit
 import logging
 
 logger = logging.getLogger(__name__)
@@ -39,12 +42,18 @@ async def create_payment(
     db: AsyncIOMotorDatabase = Depends(get_db),
     current=Depends(get_current_user),
 ):
-    # Rate limiting: máximo 10 pagos por minuto por IP
-    apply_rate_limit(request, "10/minute")
     """
     Crea un pago mockeado para una reserva.
     En producción, esto se integraría con Stripe/PayPal.
+    Con cabecera `Idempotency-Key` un reintento devuelve el pago ya creado.
     """
+    return await idempotency.execute(
+        request, db, current["id"], payload,
+        lambda: _create_payment(payload, db, current),
+        status_code=status.HTTP_201_CREATED,
+    )
+
+async def _create_payment(payload: PaymentCreate, db: AsyncIOMotorDatabase, current: dict) -> dict:
     try:
         # Verificar que la reserva existe y pertenece al usuario
         booking_oid = _oid(payload.booking_id, "booking_id")
@@ -101,31 +110,33 @@ async def create_payment(
             "completed_at": None,
         }
         
-        res = await db.payments.insert_one(doc)
-        created = await db.payments.find_one({"_id": res.inserted_id})
-        if not created:
-            raise HTTPException(status_code=500, detail="Error al crear el pago")
+        async with query_deadline("write"):
+            try:
+                await db.payments.insert_one(doc)  # insert_one añade _id a doc
+            except DuplicateKeyError:
+                # Otra petición creó el pago entre la comprobación y el insert
+                raise HTTPException(409, "Ya existe un pago para esta reserva")
+            await ledger.record(db, doc, None, doc["status"])
         
-        return _to_payment_out(created)
-    except HTTPException:
+        return _to_payment_out(doc)
+    except (HTTPException, QueryTimeout):
         raise
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Error en create_payment: {error_msg}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error al crear el pago")
 
-@router.post("/{payment_id}/process", response_model=PaymentOut)
+@router.post("/{payment_id}/process", response_model=PaymentOut, status_code=status.HTTP_202_ACCEPTED)
 async def process_payment(
     request: Request,
     payment_id: str,
     db: AsyncIOMotorDatabase = Depends(get_db),
     current=Depends(get_current_user),
 ):
-    # Rate limiting: máximo 20 procesamientos por minuto
-    apply_rate_limit(request, "20/minute")
     """
-    Procesa un pago mockeado (simula el procesamiento de tarjeta).
-    En producción, esto llamaría a Stripe/PayPal.
+    Encola el cobro del pago y responde con el pago en `processing`. El
+    resultado llega después: el pago pasa a `completed` o `failed` y se
+    notifica por WebSocket (`payment_status`).
     """
     payment = await db.payments.find_one({"_id": _oid(payment_id)})
     if not payment:
@@ -137,23 +148,54 @@ async def process_payment(
     if payment.get("status") != PaymentStatus.pending.value:
         raise HTTPException(400, f"El pago ya está {payment.get('status')}")
     
-    # Simular procesamiento (en producción esto sería asíncrono con webhooks)
-    transaction_id = f"mock_txn_{uuid.uuid4().hex[:16]}"
+    # Condicionado al estado: dos peticiones simultáneas no encolan dos cobros
+    async with query_deadline("write"):
+        updated = await db.payments.find_one_and_update(
+            {"_id": payment["_id"], "status": PaymentStatus.pending.value},
+            {
+                "$set": {
+                    "status": PaymentStatus.processing.value,
+                    "attempts": 0,
+                    "next_attempt_at": datetime.utcnow(),
+                }
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if not updated:
+            raise HTTPException(409, "El pago ha cambiado de estado, vuelve a consultarlo")
+        await ledger.record(db, updated, PaymentStatus.pending.value, PaymentStatus.processing.value)
     
-    await db.payments.update_one(
-        {"_id": payment["_id"]},
-        {
-            "$set": {
-                "status": PaymentStatus.completed.value,
-                "transaction_id": transaction_id,
-                "completed_at": datetime.utcnow(),
-            }
-        }
-    )
-    
-    updated = await db.payments.find_one({"_id": payment["_id"]})
+    await payment_processor.processor.submit(db, updated["_id"])
+    if not payment_processor.processor.running:
+        # Procesado en la propia petición: se devuelve el resultado
+        updated = await db.payments.find_one({"_id": updated["_id"]}) or updated
     return _to_payment_out(updated)
 
+@router.post("/webhook")
+async def payment_webhook(
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """
+    Eventos del proveedor de pagos (`payment.succeeded` / `payment.failed`),
+    firmados con HMAC-SHA256 del cuerpo en `X-Webhook-Signature`.
+    Sin PAYMENT_WEBHOOK_SECRET el endpoint no existe (404).
+    """
+    secret = get_settings().payment_webhook_secret
+    if not secret:
+        raise HTTPException(404, "Not Found")
+    body = await request.body()
+    if not payment_processor.verify(body, request.headers.get("X-Webhook-Signature", ""), secret):
+        raise HTTPException(401, "Firma inválida")
+    try:
+        event = json.loads(body)
+        async with query_deadline("write"):
+            applied = await payment_processor.apply_event(db, event)
+    except (ValueError, AttributeError) as e:
+        raise HTTPException(400, f"Evento inválido: {e}")
+    # Un evento repetido responde 200: el proveedor deja de reenviarlo
+    return {"ok": True, "applied": applied}
+
 @router.get("/mine", response_model=List[PaymentOut])
 async def list_my_payments(
     db: AsyncIOMotorDatabase = Depends(get_db),
@@ -161,14 +203,45 @@ async def list_my_payments(
 ):
     """Lista todos los pagos del usuario (como dueño o cuidador)"""
     current_id = _oid(current["id"])
-    docs = await db.payments.find({
-        "$or": [
-            {"owner_id": current_id},
-            {"caretaker_id": current_id}
-        ]
-    }).sort("created_at", -1).to_list(100)
+    async with query_deadline("list"):
+        docs = await db.payments.find({
+            "$or": [
+                {"owner_id": current_id},
+                {"caretaker_id": current_id}
+            ]
+        }).sort("created_at", -1).to_list(100)
     return [_to_payment_out(d) for d in docs]
 
+EXPORT_COLUMNS = (
+    "id", "booking_id", "owner_id", "caretaker_id", "amount", "platform_fee", "caretaker_payout",
+    "status", "payment_method", "transaction_id", "created_at", "completed_at",
+)
+
+@router.get("/export")
+async def export_payments(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    role: str = Query("any", pattern="^(any|owner|caretaker)$"),
+    from_: Optional[date] = Query(None, alias="from", description="AAAA-MM-DD (incluido, por fecha de creación)"),
+    to: Optional[date] = Query(None, description="AAAA-MM-DD (incluido, por defecto hoy)"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    current=Depends(get_current_user),
+):
+    """
+    Historial de pagos del usuario (como dueño, cuidador o ambos) en CSV o
+    NDJSON, en streaming y ordenado por fecha de creación. Sin límite de filas;
+    el rango está acotado a EXPORT_MAX_DAYS días.
+    """
+    settings = get_settings()
+    start, end = exports.date_range(from_, to, settings.export_max_days)
+    current_id = _oid(current["id"])
+    fields = ["owner_id", "caretaker_id"] if role == "any" else [f"{role}_id"]
+    # El rango en cada rama del $or: cada una usa su índice (campo, created_at)
+    cursor = db.payments.find(
+        {"$or": [{field: current_id, "created_at": {"$gte": start, "$lt": end}} for field in fields]},
+        exports.projection(EXPORT_COLUMNS),
+    ).sort("created_at", 1)
+    return exports.response(cursor, EXPORT_COLUMNS, format, "payments", start, end, settings.export_batch_size)
+
 @router.get("/booking/{booking_id}", response_model=Optional[PaymentOut])
 async def get_payment_by_booking(
     booking_id: str,
@@ -200,31 +273,34 @@ async def get_caretaker_stats(
     if not current.get("is_caretaker"):
         raise HTTPException(403, "Solo cuidadores pueden ver estas estadísticas")
     
-    # Obtener todos los pagos completados del cuidador
-    payments = await db.payments.find({
-        "caretaker_id": _oid(current["id"]),
-        "status": "completed"
-    }).to_list(1000)
-    
-    total_earnings = sum(p.get("caretaker_payout", 0) for p in payments)
-    total_payments = len(payments)
-    total_platform_fee = sum(p.get("platform_fee", 0) for p in payments)
-    
-    # Pagos pendientes
-    pending_payments = await db.payments.find({
-        "caretaker_id": _oid(current["id"]),
-        "status": {"$in": ["pending", "processing"]}
-    }).to_list(100)
+    # Totales acumulados en el libro de ganancias: una sola lectura
+    async with query_deadline("point"):
+        return await ledger.get_stats(db, _oid(current["id"]))
+
+# Periodo por defecto de cada granularidad (en días)
+_DEFAULT_SPAN = {"day": 30, "week": 7 * 12, "month": 365}
+
+@router.get("/caretaker/timeseries")
+async def get_caretaker_timeseries(
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    from_: Optional[date] = Query(None, alias="from", description="AAAA-MM-DD (incluido)"),
+    to: Optional[date] = Query(None, description="AAAA-MM-DD (incluido, por defecto hoy)"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    current=Depends(get_current_user),
+):
+    """Ganancias del cuidador por día, semana o mes, a partir de los acumulados diarios."""
+    if not current.get("is_caretaker"):
+        raise HTTPException(403, "Solo cuidadores pueden ver estas estadísticas")
     
-    pending_total = sum(p.get("caretaker_payout", 0) for p in pending_payments)
+    end = to or datetime.utcnow().date()
+    start = from_ or ledger.bucket_start(end - timedelta(days=_DEFAULT_SPAN[granularity]), granularity)
+    if start > end:
+        raise HTTPException(400, "from debe ser anterior a to")
+    if (end - start).days >= ledger.MAX_TIMESERIES_DAYS:
+        raise HTTPException(400, f"El rango máximo es de {ledger.MAX_TIMESERIES_DAYS} días")
     
-    return {
-        "total_earnings": round(total_earnings, 2),
-        "total_payments": total_payments,
-        "total_platform_fee": round(total_platform_fee, 2),
-        "pending_earnings": round(pending_total, 2),
-        "pending_count": len(pending_payments),
-    }
+    async with query_deadline("list"):
+        return await ledger.timeseries(db, _oid(current["id"]), granularity, start, end)
 
 @router.post("/{payment_id}/refund", response_model=PaymentOut)
 async def refund_payment(
@@ -246,12 +322,15 @@ async def refund_payment(
     if payment.get("status") != PaymentStatus.completed.value:
         raise HTTPException(400, "Solo se pueden reembolsar pagos completados")
     
-    await db.payments.update_one(
-        {"_id": payment["_id"]},
-        {"$set": {"status": PaymentStatus.refunded.value}}
-    )
-    
-    updated = await db.payments.find_one({"_id": payment["_id"]})
+    async with query_deadline("write"):
+        updated = await db.payments.find_one_and_update(
+            {"_id": payment["_id"], "status": PaymentStatus.completed.value},
+            {"$set": {"status": PaymentStatus.refunded.value}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not updated:
+            raise HTTPException(409, "El pago ha cambiado de estado, vuelve a consultarlo")
+        await ledger.record(db, updated, PaymentStatus.completed.value, PaymentStatus.refunded.value)
     return _to_payment_out(updated)
 
 def _to_payment_out(doc: dict) -> dict:
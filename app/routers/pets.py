@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
+from pymongo import ReturnDocument
 from uuid import uuid4
 from pathlib import Path
-from ..db import get_db
+from ..db import get_db, query_deadline
 from ..config import get_settings
 from ..security import get_current_user
 from ..schemas.pet import PetCreate, PetOut
@@ -20,7 +21,8 @@ def to_out(doc: dict) -> dict:
 
 @router.get("", response_model=list[PetOut])
 async def list_pets(db: AsyncIOMotorDatabase = Depends(get_db)):
-    docs = await db.pets.find().to_list(500)
+    async with query_deadline("list"):
+        docs = await db.pets.find().to_list(500)
     return [to_out(d) for d in docs]
 
 @router.get("/my", response_model=list[PetOut])
@@ -28,7 +30,8 @@ async def my_pets(
     current=Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    docs = await db.pets.find({"owner_id": current["id"]}).to_list(200)
+    async with query_deadline("list"):
+        docs = await db.pets.find({"owner_id": current["id"]}).to_list(200)
     return [to_out(d) for d in docs]
 
 @router.post("", response_model=PetOut, status_code=status.HTTP_201_CREATED)
@@ -78,8 +81,9 @@ async def upload_pet_photo(
             await out.write(chunk)
 
     url = f"/media/{rel_path.as_posix()}"
-    await db.pets.update_one({"_id": oid}, {"$push": {"photos": url}})
-    pet = await db.pets.find_one({"_id": oid})
+    pet = await db.pets.find_one_and_update(
+        {"_id": oid}, {"$push": {"photos": url}}, return_document=ReturnDocument.AFTER
+    )
     return to_out(pet)
 
 @router.patch("/{pet_id}", response_model=PetOut)
@@ -109,8 +113,9 @@ async def update_pet(
     if not updates:
         return to_out(pet)
     
-    await db.pets.update_one({"_id": oid}, {"$set": updates})
-    updated = await db.pets.find_one({"_id": oid})
+    updated = await db.pets.find_one_and_update(
+        {"_id": oid}, {"$set": updates}, return_document=ReturnDocument.AFTER
+    )
     return to_out(updated)
 
 @router.delete("/{pet_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,23 @@
+# app/routers/presence.py
+from fastapi import APIRouter, Depends, HTTPException
+
+from ..config import get_settings
+from ..security import get_current_user_id
+from ..schemas.presence import PresenceQuery, PresenceQueryOut
+from ..realtime.presence import presence
+
+router = APIRouter()
+settings = get_settings()
+
+@router.post("/query", response_model=PresenceQueryOut)
+async def query_presence(
+    payload: PresenceQuery,
+    user_id: str = Depends(get_current_user_id),
+):
+    """
+    Estado online/away/offline y last_seen de varios usuarios en una sola llamada.
+    Se responde desde memoria (sin consultas a la base de datos).
+    """
+    if len(payload.user_ids) > settings.presence_query_max_ids:
+        raise HTTPException(400, f"Máximo {settings.presence_query_max_ids} usuarios por consulta")
+    return {"presence": presence.bulk(dict.fromkeys(payload.user_ids))}
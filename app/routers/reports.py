@@ -7,7 +7,7 @@ from datetime import datetime
 from uuid import uuid4
 from pathlib import Path
 
-from ..db import get_db
+from ..db import get_db, query_deadline
 from ..config import get_settings
 from ..security import get_current_user
 from ..utils import to_id, to_object_id
@@ -63,9 +63,8 @@ async def create_report(
         "created_at": datetime.utcnow(),
     }
     
-    res = await db.reports.insert_one(doc)
-    created = await db.reports.find_one({"_id": res.inserted_id})
-    report_out = _to_report_out(created)
+    await db.reports.insert_one(doc)  # insert_one añade _id a doc
+    report_out = _to_report_out(doc)
     
     # Notificar al dueño vía WebSocket si está conectado
     owner_id = booking.get("owner_id")
@@ -164,7 +163,8 @@ async def get_booking_reports(
     if current["id"] not in [owner_id, caretaker_id]:
         raise HTTPException(403, "No tienes acceso a estos reportes")
     
-    docs = await db.reports.find({"booking_id": booking_id}).sort("created_at", 1).to_list(100)
+    async with query_deadline("list"):
+        docs = await db.reports.find({"booking_id": booking_id}).sort("created_at", 1).to_list(100)
     return [_to_report_out(d) for d in docs]
 
 @router.get("/mine", response_model=List[ReportOut])
@@ -176,16 +176,17 @@ async def list_my_reports(
     Listar todos los reportes creados por el cuidador o recibidos como dueño.
     """
     # Obtener bookings donde el usuario es dueño o cuidador
-    bookings = await db.bookings.find({
-        "$or": [
-            {"owner_id": current["id"]},
-            {"caretaker_id": current["id"]}
-        ]
-    }).to_list(1000)
+    async with query_deadline("list"):
+        bookings = await db.bookings.find({
+            "$or": [
+                {"owner_id": current["id"]},
+                {"caretaker_id": current["id"]}
+            ]
+        }, {"_id": 1}).to_list(1000)
     
-    booking_ids = [str(b["_id"]) for b in bookings]
+        booking_ids = [str(b["_id"]) for b in bookings]
     
-    docs = await db.reports.find({"booking_id": {"$in": booking_ids}}).sort("created_at", -1).to_list(200)
+        docs = await db.reports.find({"booking_id": {"$in": booking_ids}}).sort("created_at", -1).to_list(200)
     return [_to_report_out(d) for d in docs]
 
 def _to_report_out(doc: dict) -> dict:
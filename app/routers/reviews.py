@@ -2,9 +2,10 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, Field
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
+from pymongo import ReturnDocument
 from typing import Optional, Dict, Any, List
 from datetime import datetime
-from ..db import get_db
+from ..db import get_db, query_deadline, QueryTimeout
 from ..security import get_current_user
 from ..utils import to_id, to_object_id
 import logging
@@ -71,26 +72,27 @@ async def list_reviews(
         
         out: List[Dict[str, Any]] = []
         cursor = db.reviews.find(q).sort("created_at", -1)
-        async for r in cursor:
-            try:
-                # Convertir ObjectId a string manualmente
-                review_dict = {}
-                for key, value in r.items():
-                    if key == "_id":
-                        review_dict["id"] = str(value)
-                    elif isinstance(value, ObjectId):
-                        review_dict[key] = str(value)
-                    elif isinstance(value, datetime):
-                        review_dict[key] = value.isoformat()
-                    else:
-                        review_dict[key] = value
-                out.append(review_dict)
-            except Exception as e:
-                logger.error(f"Error procesando reseña: {e}", exc_info=True)
-                continue
+        async with query_deadline("list"):
+            async for r in cursor:
+                try:
+                    # Convertir ObjectId a string manualmente
+                    review_dict = {}
+                    for key, value in r.items():
+                        if key == "_id":
+                            review_dict["id"] = str(value)
+                        elif isinstance(value, ObjectId):
+                            review_dict[key] = str(value)
+                        elif isinstance(value, datetime):
+                            review_dict[key] = value.isoformat()
+                        else:
+                            review_dict[key] = value
+                    out.append(review_dict)
+                except Exception as e:
+                    logger.error(f"Error procesando reseña: {e}", exc_info=True)
+                    continue
         
         return out
-    except HTTPException:
+    except (HTTPException, QueryTimeout):
         raise
     except Exception as e:
         logger.error(f"Error en list_reviews: {e}", exc_info=True)
@@ -210,12 +212,8 @@ async def create_review(payload: ReviewCreate,
         elif review_type == "pet":
             doc["pet_id"] = target_id
         
-        res = await db.reviews.insert_one(doc)
-        created = await db.reviews.find_one({"_id": res.inserted_id})
-        if not created:
-            raise HTTPException(status_code=500, detail="Error al crear la reseña")
-        
-        return to_id(created)
+        await db.reviews.insert_one(doc)  # insert_one añade _id a doc
+        return to_id(doc)
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -257,8 +255,9 @@ async def update_review(
             return to_id(review)
         
         updates["updated_at"] = datetime.utcnow()
-        await db.reviews.update_one({"_id": _oid(review_id)}, {"$set": updates})
-        updated = await db.reviews.find_one({"_id": _oid(review_id)})
+        updated = await db.reviews.find_one_and_update(
+            {"_id": _oid(review_id)}, {"$set": updates}, return_document=ReturnDocument.AFTER
+        )
         if not updated:
             raise HTTPException(status_code=404, detail="Reseña no encontrada después de actualizar")
         return to_id(updated)
@@ -3,8 +3,9 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from typing import Optional, List, Dict, Any
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
-from ..db import get_db
-from ..security import get_current_user, get_current_user_id
+from pymongo import ReturnDocument
+from ..db import get_db, query_deadline
+from ..security import get_current_user, get_current_user_id, user_id_from_token
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from ..utils import to_id, to_object_id
 import logging
@@ -19,19 +20,13 @@ async def get_current_user_optional(
     """Devuelve el usuario si hay token, None si no."""
     if not credentials:
         return None
+    user_id = user_id_from_token(credentials.credentials)
+    if not user_id:
+        return None
     try:
-        from jose import jwt, JWTError
-        from ..config import get_settings
-        settings = get_settings()
-        payload = jwt.decode(credentials.credentials, settings.jwt_secret, algorithms=["HS256"])
-        user_id = payload.get("sub")
-        if user_id:
-            doc = await db.users.find_one({"_id": ObjectId(user_id)})
-            if doc:
-                return to_id(doc)
+        return await get_current_user(db=db, user_id=user_id)
     except Exception:
-        pass
-    return None
+        return None
 
 router = APIRouter()
 
@@ -50,14 +45,16 @@ async def list_services(
     # Si hay sitter_id, es público (no requiere auth)
     if sitter_id:
         q: Dict[str, Any] = {"caretaker_id": sitter_id, "enabled": True}
-        docs = await db.services.find(q).sort("type", 1).to_list(200)
+        async with query_deadline("list"):
+            docs = await db.services.find(q).sort("type", 1).to_list(200)
         return [to_id(d) for d in docs]
     else:
         # Sin sitter_id requiere autenticación
         if not current:
             raise HTTPException(status_code=401, detail="Se requiere autenticación para ver tus servicios")
         q: Dict[str, Any] = {"caretaker_id": current["id"]}
-        docs = await db.services.find(q).sort("type", 1).to_list(200)
+        async with query_deadline("list"):
+            docs = await db.services.find(q).sort("type", 1).to_list(200)
         return [to_id(d) for d in docs]
 
 # POST /services
@@ -86,9 +83,8 @@ async def create_service(
         "description": payload.get("description") or "",
         "enabled": bool(payload.get("enabled", True)),
     }
-    res = await db.services.insert_one(doc)
-    created = await db.services.find_one({"_id": res.inserted_id})
-    return to_id(created)
+    await db.services.insert_one(doc)  # insert_one añade _id a doc
+    return to_id(doc)
 
 # PATCH /services/{service_id}  (editar precio/descripcion/enabled)
 @router.patch("/{service_id}")
@@ -117,8 +113,9 @@ async def patch_service(
     if not updates:
         return to_id(s)
 
-    await db.services.update_one({"_id": s["_id"]}, {"$set": updates})
-    s2 = await db.services.find_one({"_id": s["_id"]})
+    s2 = await db.services.find_one_and_update(
+        {"_id": s["_id"]}, {"$set": updates}, return_document=ReturnDocument.AFTER
+    )
     return to_id(s2)
 
 # POST /services/{service_id}/toggle   (activar/desactivar rápido)
@@ -136,8 +133,9 @@ async def toggle_service(
         raise HTTPException(403, "No eres el propietario")
 
     enabled = bool(body.get("enabled", True))
-    await db.services.update_one({"_id": s["_id"]}, {"$set": {"enabled": enabled}})
-    s2 = await db.services.find_one({"_id": s["_id"]})
+    s2 = await db.services.find_one_and_update(
+        {"_id": s["_id"]}, {"$set": {"enabled": enabled}}, return_document=ReturnDocument.AFTER
+    )
     return to_id(s2)
 
 # POST /services/me/enabled  (activar/desactivar todos los de un tipo)
@@ -5,12 +5,19 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-from ..db import get_db
+from ..db import get_db, query_deadline
 from ..utils import to_id, haversine_distance, geocode_city, is_within_radius
 from ..security import get_current_user_id
+from ..realtime.presence import presence
 
 router = APIRouter()
 
+# Campos del cuidador que usa la tarjeta de búsqueda (sin hash, galería ni disponibilidad)
+SEARCH_USER_PROJECTION = {
+    "name": 1, "city": 1, "photo": 1, "address": 1, "lat": 1, "lng": 1,
+    "profile.city": 1, "profile.bio": 1, "profile.photos": {"$slice": 1}, "profile.accepts_sizes": 1,
+}
+
 def _city_of(u: Dict[str, Any]) -> Optional[str]:
     return (u.get("profile") or {}).get("city") or u.get("city")
 
@@ -52,7 +59,8 @@ async def search_sitters(
             {"profile.city": {"$regex": q, "$options": "i"}},
         ])
 
-    users = await db.users.find(match).to_list(1000)
+    async with query_deadline("search"):
+        users = await db.users.find(match, SEARCH_USER_PROJECTION).to_list(1000)
 
     if not users:
         return []
@@ -60,10 +68,24 @@ async def search_sitters(
     sitter_ids = [str(u["_id"]) for u in users]
 
     # 2) servicios por cuidador (sólo habilitados)
-    svcs = await db.services.find({
-        "caretaker_id": {"$in": sitter_ids},
-        "enabled": True,
-    }).to_list(5000)
+    async with query_deadline("list"):
+        svcs = await db.services.find({
+            "caretaker_id": {"$in": sitter_ids},
+            "enabled": True,
+        }, {"caretaker_id": 1, "type": 1, "price": 1}).to_list(5000)
+
+    # 3) rating de todos los cuidadores en una sola agregación
+    async with query_deadline("aggregate"):
+        ratings_by_ct = {
+            str(row["_id"]): row
+            async for row in db.reviews.aggregate([
+                {"$match": {
+                    "sitter_id": {"$in": [u["_id"] for u in users]},
+                    "rating": {"$type": "number"},
+                }},
+                {"$group": {"_id": "$sitter_id", "avg": {"$avg": "$rating"}, "count": {"$sum": 1}}},
+            ])
+        }
 
     # indexamos servicios por cuidador
     by_ct: Dict[str, List[Dict[str, Any]]] = {}
@@ -118,15 +140,10 @@ async def search_sitters(
         minp = min((int(s.get("price", 0)) for s in services_ct), default=None)
         services_types = sorted({s.get("type") for s in services_ct if s.get("type")})
 
-        # Calcular rating promedio y conteo de reseñas
-        reviews = await db.reviews.find({"sitter_id": ObjectId(sid)}).to_list(100)
-        rating_avg = None
-        rating_count = 0
-        if reviews:
-            ratings = [r.get("rating", 0) for r in reviews if isinstance(r.get("rating"), (int, float))]
-            if ratings:
-                rating_avg = sum(ratings) / len(ratings)
-                rating_count = len(ratings)
+        # Rating promedio y conteo de reseñas (ya agregados)
+        rating = ratings_by_ct.get(sid)
+        rating_avg = rating["avg"] if rating else None
+        rating_count = rating["count"] if rating else 0
 
         sitter_data = {
             "id": sid,
@@ -140,6 +157,8 @@ async def search_sitters(
             "rating_avg": round(rating_avg, 1) if rating_avg is not None else None,
             "rating_count": rating_count,
             "accepts_sizes": (u.get("profile") or {}).get("accepts_sizes") or [],
+            # Presencia desde memoria: sin consultas extra
+            "presence": presence.get(sid),
         }
         
         # Agregar información geográfica
@@ -183,15 +202,17 @@ async def get_sitter(
     if not ObjectId.is_valid(sitter_id):
         raise HTTPException(status_code=400, detail="Invalid sitter id")
 
-    u = await db.users.find_one({"_id": ObjectId(sitter_id), "is_caretaker": True})
+    async with query_deadline("point"):
+        u = await db.users.find_one({"_id": ObjectId(sitter_id), "is_caretaker": True})
     if not u:
         raise HTTPException(status_code=404, detail="Cuidador no encontrado")
 
     # servicios habilitados del cuidador
-    svcs = await db.services.find({"caretaker_id": sitter_id, "enabled": True}).to_list(100)
+    async with query_deadline("list"):
+        svcs = await db.services.find({"caretaker_id": sitter_id, "enabled": True}).to_list(100)
     
-    # Calcular rating promedio y conteo de reseñas
-    reviews = await db.reviews.find({"sitter_id": ObjectId(sitter_id), "review_type": "sitter"}).to_list(100)
+        # Calcular rating promedio y conteo de reseñas
+        reviews = await db.reviews.find({"sitter_id": ObjectId(sitter_id), "review_type": "sitter"}).to_list(100)
     rating_avg = None
     rating_count = 0
     if reviews:
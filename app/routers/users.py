@@ -6,7 +6,7 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
 
 from ..db import get_db
-from ..security import get_current_user
+from ..security import get_current_user, invalidate_user
 from ..utils import to_id, to_object_id
 from ..schemas.user import UserOut, AvailabilityOut  # AvailabilityOut debe incluir weekly_open
 import logging
@@ -120,8 +120,7 @@ async def create_user(payload: dict, db: AsyncIOMotorDatabase = Depends(get_db))
     doc.setdefault("gallery", [])
     doc.setdefault("photo", doc.get("photo") or doc.get("image"))
 
-    res = await db.users.insert_one(doc)
-    doc = await db.users.find_one({"_id": res.inserted_id})
+    await db.users.insert_one(doc)  # insert_one añade _id a doc
     return _normalize_user(doc)
 
 @router.get("/me", response_model=UserOut)
@@ -173,6 +172,7 @@ async def patch_me(
 
     if updates:
         await db.users.update_one({"_id": u["_id"]}, {"$set": updates})
+        invalidate_user(u["_id"])
 
     u2 = await db.users.find_one({"_id": u["_id"]})
     return _normalize_user(u2)
@@ -225,6 +225,7 @@ async def patch_my_availability(
         av["weekly_open"] = wo
 
     await db.users.update_one({"_id": u["_id"]}, {"$set": {"availability": av}})
+    invalidate_user(u["_id"])
     u2 = await db.users.find_one({"_id": u["_id"]})
     return _normalize_user(u2)["availability"]
 
@@ -240,6 +241,7 @@ async def add_to_gallery(
         {"_id": _oid(current["id"])},
         {"$addToSet": {"gallery": {"$each": payload.images}}},
     )
+    invalidate_user(current["id"])
     u = await db.users.find_one({"_id": _oid(current["id"])})
     return _normalize_user(u)["gallery"]
 
@@ -250,5 +252,6 @@ async def remove_from_gallery(
     current=Depends(get_current_user),
 ):
     await db.users.update_one({"_id": _oid(current["id"])}, {"$pull": {"gallery": url}})
+    invalidate_user(current["id"])
     u = await db.users.find_one({"_id": _oid(current["id"])})
     return _normalize_user(u)["gallery"]
@@ -8,84 +8,112 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 import logging
 
 from ..db import get_db
-from ..security import get_current_user_id
+from ..security import user_id_from_token
 from ..utils import to_id
+from ..config import get_settings
+from ..realtime.manager import manager
+from ..realtime.throttle import TokenBucket, TypingCoalescer
+from ..realtime.presence import presence
+from ..metrics import Counter
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
+settings = get_settings()
 
-# Almacenar conexiones activas: {user_id: WebSocket}
-active_connections: Dict[str, WebSocket] = {}
+typing_coalescer = TypingCoalescer(
+    manager,
+    interval=settings.ws_typing_interval,
+    timeout=settings.ws_typing_timeout,
+)
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-
-    async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_json(message)
-            except Exception as e:
-                logger.error(f"Error sending to {user_id}: {e}", exc_info=True)
-                self.disconnect(user_id)
-
-    async def broadcast(self, message: dict, exclude_user_id: str = None):
-        for user_id, connection in list(self.active_connections.items()):
-            if user_id != exclude_user_id:
-                try:
-                    await connection.send_json(message)
-                except Exception:
-                    self.disconnect(user_id)
-
-manager = ConnectionManager()
+WS_RATE_LIMITED = Counter(
+    "ws_rate_limited_total",
+    "Frames send_message rechazados por el token bucket de la conexión",
+)
 
 async def get_user_from_token(websocket: WebSocket, token: str) -> str:
     """Extrae el user_id del token JWT"""
-    try:
-        from jose import jwt, JWTError
-        from ..config import get_settings
-        
-        settings = get_settings()
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=["HS256"])
-        user_id = payload.get("sub")
-        if not user_id:
-            await websocket.close(code=1008, reason="Invalid token")
-            return None
-        return str(user_id)
-    except JWTError:
-        await websocket.close(code=1008, reason="Invalid token")
-        return None
-    except Exception as e:
+    user_id = user_id_from_token(token)
+    if not user_id:
         await websocket.close(code=1008, reason="Invalid token")
         return None
+    return user_id
+
+async def _handle_resume(conn, db: AsyncIOMotorDatabase, user_id: str, data: dict) -> None:
+    """
+    Reproduce los eventos perdidos desde el último visto por el cliente.
+    1) Buffer en memoria si el epoch coincide y el hueco está completo.
+    2) Si no, mensajes recibidos posteriores a last_message_id (consulta indexada).
+    3) Si el hueco es demasiado grande, pide resincronización completa.
+    """
+    events = manager.events
+    last_event_id = data.get("last_event_id")
+    if events is not None and data.get("epoch") == events.epoch and isinstance(last_event_id, int):
+        missed = events.since(user_id, last_event_id)
+        if missed is not None:
+            for event in missed:
+                conn.send(event)
+            conn.send({
+                "type": "resume_ok",
+                "source": "buffer",
+                "replayed": len(missed),
+                "last_event_id": events.last_event_id,
+            })
+            return
+
+    last_message_id = data.get("last_message_id")
+    if last_message_id and ObjectId.is_valid(last_message_id):
+        limit = settings.ws_resume_max_messages
+        docs = await db.messages.find({
+            "receiver_id": user_id,
+            "_id": {"$gt": ObjectId(last_message_id)},
+        }).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+        if len(docs) <= limit:
+            for doc in docs:
+                conn.send({"type": "new_message", "message": to_id(doc)})
+            conn.send({
+                "type": "resume_ok",
+                "source": "db",
+                "replayed": len(docs),
+                # Desde DB sólo se recuperan mensajes; el resto debe pedirse por REST
+                "missing": ["messages_read", "new_report", "payment_status"],
+                "epoch": events.epoch if events is not None else None,
+                "last_event_id": events.last_event_id if events is not None else None,
+            })
+            return
+
+    conn.send({"type": "resync_required"})
 
 @router.websocket("/ws/{token}")
 async def websocket_endpoint(websocket: WebSocket, token: str):
     """
     Endpoint WebSocket para mensajería en tiempo real.
     El token se pasa como parámetro en la URL.
+    Formato negociado por subprotocolo: JSON por defecto o
+    `petconnect.msgpack.v1` (MessagePack con campos cortos).
     """
     user_id = await get_user_from_token(websocket, token)
     if not user_id:
         return
 
-    await manager.connect(websocket, user_id)
+    conn = await manager.connect(websocket, user_id)
+    if conn is None:
+        return  # Límite de conexiones alcanzado; el socket ya está cerrado
     
+    # Límite de mensajes por conexión (cada send_message es un insert en DB)
+    message_bucket = TokenBucket(settings.ws_message_rate, settings.ws_message_burst)
+
     try:
         # Enviar mensaje de bienvenida
-        await websocket.send_json({
+        events = manager.events
+        conn.send({
             "type": "connected",
             "message": "Conectado al chat",
-            "user_id": user_id
+            "user_id": user_id,
+            # Para reanudar: el cliente guarda epoch y el último event_id recibido
+            "epoch": events.epoch if events is not None else None,
+            "last_event_id": events.last_event_id if events is not None else None,
         })
 
         from ..db import get_db
@@ -93,17 +121,38 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
         
         while True:
             # Recibir mensaje del cliente
-            data = await websocket.receive_json()
+            data = await conn.receive()
             message_type = data.get("type")
 
+            if message_type == "pong":
+                # Respuesta al heartbeat del servidor; basta con touch()
+                continue
+
+            if message_type == "ping":
+                conn.send({"type": "pong"})
+                continue
+
+            # Cualquier otro frame es actividad real del usuario (away -> online)
+            presence.touch(user_id)
+
             if message_type == "send_message":
+                if not message_bucket.allow():
+                    WS_RATE_LIMITED.inc()
+                    conn.send({
+                        "type": "error",
+                        "code": "rate_limited",
+                        "message": "Demasiados mensajes. Espera un momento.",
+                        "retry_after": round(message_bucket.retry_after(), 2),
+                    })
+                    continue
+
                 # Crear mensaje en la base de datos
                 thread_id = data.get("thread_id")
                 receiver_id = data.get("receiver_id")
                 body = data.get("body")
 
                 if not all([thread_id, receiver_id, body]):
-                    await websocket.send_json({
+                    conn.send({
                         "type": "error",
                         "message": "Faltan campos requeridos"
                     })
@@ -122,17 +171,20 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                 message_doc["_id"] = res.inserted_id
                 message_out = to_id(message_doc)
 
+                # Al enviar un mensaje deja de estar "escribiendo" en ese thread
+                await typing_coalescer.stop(user_id, thread_id)
+
                 # Enviar al receptor si está conectado
                 await manager.send_personal_message({
                     "type": "new_message",
                     "message": message_out,
                 }, receiver_id)
 
-                # Confirmar al emisor
-                await websocket.send_json({
+                # Confirmar al emisor (en todas sus conexiones, para sincronizar dispositivos)
+                await manager.send_personal_message({
                     "type": "message_sent",
                     "message": message_out,
-                })
+                }, user_id)
 
             elif message_type == "mark_read":
                 # Marcar mensajes como leídos
@@ -146,27 +198,31 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                         },
                         {"$set": {"read": True, "read_at": datetime.utcnow()}}
                     )
-                    await websocket.send_json({
+                    # A todas las conexiones del usuario (otros dispositivos)
+                    await manager.send_personal_message({
                         "type": "messages_read",
                         "thread_id": thread_id
-                    })
+                    }, user_id)
+
+            elif message_type == "resume":
+                await _handle_resume(conn, db, user_id, data)
 
             elif message_type == "typing":
-                # Notificar que alguien está escribiendo
+                # Notificar que alguien está escribiendo (agrupado por thread)
                 thread_id = data.get("thread_id")
                 receiver_id = data.get("receiver_id")
-                is_typing = data.get("is_typing", False)
-                
-                await manager.send_personal_message({
-                    "type": "typing",
-                    "thread_id": thread_id,
-                    "sender_id": user_id,
-                    "is_typing": is_typing,
-                }, receiver_id)
+                is_typing = bool(data.get("is_typing", False))
+                if thread_id and receiver_id:
+                    await typing_coalescer.update(user_id, receiver_id, thread_id, is_typing)
 
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        manager.disconnect(conn)
     except Exception as e:
-        logger.error(f"Error en WebSocket: {e}", exc_info=True)
-        manager.disconnect(user_id)
+        # Si el servidor ya cerró la conexión (inactividad, cliente lento), no es un error
+        if not conn.closed:
+            logger.error(f"Error en WebSocket: {e}", exc_info=True)
+        manager.disconnect(conn)
+    finally:
+        if not manager.is_online(user_id):
+            await typing_coalescer.stop_sender(user_id)
 
@@ -0,0 +1,13 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+class PresenceQuery(BaseModel):
+    user_ids: List[str] = Field(..., min_length=1, description="IDs de usuario a consultar")
+
+class PresenceOut(BaseModel):
+    status: str = Field(..., description="online|away|offline")
+    last_seen: Optional[datetime] = None
+
+class PresenceQueryOut(BaseModel):
+    presence: Dict[str, PresenceOut]
@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, Optional
+import hashlib
+import time
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
@@ -7,6 +9,7 @@ from passlib.context import CryptContext
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
 
+from .cache import TTLCache
 from .config import get_settings
 from .db import get_db
 from .utils import to_id
@@ -16,6 +19,13 @@ ALGO = "HS256"
 pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# Vista "principal" del usuario autenticado: sin hash ni campos pesados (fotos en base64)
+PRINCIPAL_PROJECTION = {"password_hash": 0, "gallery": 0, "photo": 0, "profile.photos": 0}
+
+_user_cache = TTLCache("users", maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+# Claims de tokens ya verificados, indexados por el SHA-256 del token
+_token_cache = TTLCache("tokens", maxsize=settings.token_cache_size, ttl=settings.token_cache_ttl)
+
 
 def hash_password(plain: str) -> str:
     return pwd.hash(plain)
@@ -31,23 +41,66 @@ def create_access_token(user_id: str, expires_hours: Optional[int] = None) -> st
     return jwt.encode(payload, settings.jwt_secret, algorithm=ALGO)
 
 
-async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
+def verify_token(token: str) -> Dict[str, Any]:
+    """
+    Verifica firma y caducidad de un JWT y devuelve sus claims.
+    Los tokens válidos se cachean hasta su `exp` (como mucho TOKEN_CACHE_TTL),
+    así que las peticiones siguientes con el mismo token no repiten el HMAC.
+    Lanza JWTError si el token no es válido.
+    """
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    claims = _token_cache.get(key)
+    if claims is not None:
+        return claims
+    claims = jwt.decode(token, settings.jwt_secret, algorithms=[ALGO])
+    ttl = settings.token_cache_ttl
+    exp = claims.get("exp")
+    if isinstance(exp, (int, float)):
+        ttl = min(ttl, exp - time.time())
+    _token_cache.set(key, claims, ttl)
+    return claims
+
+
+def user_id_from_token(token: str) -> Optional[str]:
+    """`sub` de un token válido, o None si el token no es válido."""
     try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[ALGO])
-        sub = payload.get("sub")
-        if not sub:
-            raise HTTPException(status_code=401, detail="Token inválido")
-        return str(sub)
+        sub = verify_token(token).get("sub")
     except JWTError:
+        return None
+    return str(sub) if sub else None
+
+
+async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
+    """
+    Dependencia ligera: sólo valida el token y devuelve el id, sin ir a la DB.
+    Usar cuando la ruta no necesita más datos del usuario.
+    """
+    user_id = user_id_from_token(token)
+    if not user_id:
         raise HTTPException(status_code=401, detail="Token inválido")
+    return user_id
+
+
+def invalidate_user(user_id) -> None:
+    """Descarta el usuario de la caché tras modificarlo."""
+    _user_cache.pop(str(user_id))
 
 
 async def get_current_user(
     db: AsyncIOMotorDatabase = Depends(get_db),
     user_id: str = Depends(get_current_user_id),
 ):
-    doc = await db.users.find_one({"_id": ObjectId(user_id)})
+    """
+    Usuario autenticado (vista principal, sin password_hash ni galería).
+    Se cachea por worker durante USER_CACHE_TTL segundos.
+    """
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return dict(cached)  # copia: los handlers no deben alterar la caché
+    doc = await db.users.find_one({"_id": ObjectId(user_id)}, PRINCIPAL_PROJECTION)
     if not doc:
         raise HTTPException(status_code=401, detail="Usuario no encontrado")
-    return to_id(doc)
+    principal = to_id(doc)
+    _user_cache.set(user_id, principal)
+    return dict(principal)
 
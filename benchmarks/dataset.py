@@ -0,0 +1,468 @@
+# benchmarks/dataset.py
+"""
+Generador de datos sintéticos para pruebas de carga y de escala.
+
+Crea usuarios (dueños y cuidadores repartidos por ciudades), servicios,
+mascotas, reservas, pagos, reseñas y mensajes con distribuciones realistas:
+pocas ciudades grandes concentran la mayoría de usuarios, unos pocos
+cuidadores populares acumulan muchas reservas y unas pocas conversaciones
+muchos mensajes. Con la misma semilla y el mismo `--until` el resultado es
+idéntico (también los _id).
+
+Se inserta con `insert_many` en lotes, con varias escrituras en vuelo, y
+todas las cuentas comparten un hash de contraseña calculado una sola vez. Los
+índices de la app se crean al final (más rápido que mantenerlos durante la
+carga) y el libro de ganancias y sus acumulados diarios se calculan desde los
+pagos. Sólo acepta un mongod local.
+
+Uso:
+    python -m benchmarks.dataset --users 100000 --bookings 500000 --messages 10000000 --drop
+    DB_NAME=petconnect_bench uvicorn app.main:app    # la app contra esos datos
+
+Todas las cuentas usan la contraseña `bench12345` y el email `user<n>@bench.petconnect.test`.
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import random
+import struct
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.uri_parser import parse_uri
+
+from app import db as app_db
+from app import ledger
+from app.config import get_settings
+from app.routers.payments import _calculate_payment
+from app.security import hash_password
+from app.utils import geocode_city
+
+PASSWORD = "bench12345"
+EMAIL_DOMAIN = "bench.petconnect.test"
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+COLLECTIONS = ("users", "services", "pets", "bookings", "payments", "reviews", "messages")
+
+# (ciudad, peso ~ población)
+CITIES = [
+    ("Madrid", 33), ("Barcelona", 16), ("Valencia", 8), ("Sevilla", 7), ("Zaragoza", 7),
+    ("Málaga", 6), ("Murcia", 5), ("Palma", 4), ("Las Palmas", 4), ("Bilbao", 3),
+    ("Alicante", 3), ("Córdoba", 3), ("Vigo", 3), ("Granada", 2), ("Oviedo", 2),
+]
+FIRST_NAMES = [
+    "María", "Juan", "Ana", "Carlos", "Lucía", "Javier", "Laura", "David", "Marta", "Pablo",
+    "Sara", "Daniel", "Paula", "Alejandro", "Elena", "Sergio", "Carmen", "Jorge", "Irene", "Álvaro",
+]
+LAST_NAMES = [
+    "García", "Pérez", "López", "Martínez", "Sánchez", "González", "Rodríguez", "Fernández",
+    "Gómez", "Díaz", "Moreno", "Muñoz", "Álvarez", "Romero", "Ruiz", "Navarro",
+]
+BIOS = [
+    "Amante de los animales con años de experiencia cuidando perros y gatos.",
+    "Cuidador profesional especializado en perros grandes.",
+    "Veterinaria de profesión, cuido mascotas con mucho cariño.",
+    "Tengo jardín y tiempo libre para paseos largos.",
+    "Trabajo desde casa, tu mascota nunca estará sola.",
+]
+SIZES = ["small", "medium", "large", "giant"]
+# (tipo, precio medio, por noche)
+SERVICES = [
+    ("boarding", 25.0, True), ("house_sitting", 35.0, True), ("daycare", 15.0, False),
+    ("walking", 10.0, False), ("drop_in", 12.0, False),
+]
+PET_NAMES = ["Luna", "Max", "Coco", "Toby", "Kira", "Nala", "Rocky", "Lola", "Simba", "Bruno", "Mía", "Thor"]
+BREEDS = ["Mestizo", "Labrador", "Golden Retriever", "Pastor Alemán", "Bulldog Francés", "Beagle", "Chihuahua", "Gato Europeo"]
+MESSAGE_BODIES = [
+    "¡Hola! ¿Tienes disponibilidad para esas fechas?",
+    "Perfecto, te confirmo la reserva.",
+    "Luna ha comido bien y ya hemos salido a pasear por el parque.",
+    "¿A qué hora te viene bien la entrega?",
+    "Te mando una foto de la tarde 🐶",
+    "Muchas gracias por todo, ¡hasta la próxima!",
+    "Recuerda que toma la medicación por la mañana.",
+    "Sin problema, aquí estaremos.",
+]
+REVIEW_COMMENTS = [
+    "Todo perfecto, repetiremos.", "Muy atenta y puntual.", "Nos mandó fotos todos los días.",
+    "Bien, aunque la comunicación podría mejorar.", "", "Un cuidador excelente.",
+]
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def make_oid(moment: datetime, tag: int, n: int) -> ObjectId:
+    """ObjectId determinista: marca de tiempo real + colección + contador."""
+    seconds = int((moment - datetime(1970, 1, 1)).total_seconds())
+    return ObjectId(struct.pack(">IB", seconds, tag) + n.to_bytes(7, "big"))
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    it = iter(items)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
+
+
+class DatasetGenerator:
+    """
+    Genera los documentos colección a colección. El orden importa: cada
+    colección usa lo que las anteriores dejaron en memoria (ids, ciudades,
+    reservas), así que hay que consumir los generadores en el orden de
+    COLLECTIONS.
+    """
+
+    def __init__(
+        self,
+        users: int,
+        bookings: int,
+        messages: int,
+        caretaker_ratio: float = 0.2,
+        days: int = 365,
+        seed: int = 42,
+        until: Optional[date] = None,
+        password_hash: str = "",
+    ):
+        self.n_users = users
+        self.n_bookings = bookings
+        self.n_messages = messages
+        self.caretaker_ratio = caretaker_ratio
+        self.seed = seed
+        self.until = datetime.combine(until or date.today(), datetime.min.time())
+        self.since = self.until - timedelta(days=days)
+        self.password_hash = password_hash
+        self._city_centers = [geocode_city(name) for name, _ in CITIES]
+
+        # Estado compartido entre colecciones
+        self.caretakers: List[Tuple[ObjectId, str, int]] = []  # (_id, nombre, ciudad)
+        self.owners: List[Tuple[ObjectId, str, int]] = []
+        self.caretaker_services: List[List[Tuple[str, str, float, bool]]] = []
+        self.owner_pets: List[List[str]] = []
+        # (_id, dueño, cuidador, estado, total, creada, fin)
+        self.booking_rows: List[Tuple[ObjectId, int, int, str, float, datetime, datetime]] = []
+        self.threads: Dict[Tuple[int, int], datetime] = {}
+
+    def _rng(self, name: str) -> random.Random:
+        # Un generador por colección: cambiar el tamaño de una no altera las demás
+        return random.Random(f"{self.seed}:{name}")
+
+    def _moment(self, rng: random.Random, start: datetime, end: datetime) -> datetime:
+        span = max(0.0, (end - start).total_seconds())
+        return start + timedelta(seconds=int(rng.random() * span))
+
+    # ---------- usuarios ----------
+
+    def users(self) -> Iterator[Dict[str, Any]]:
+        rng = self._rng("users")
+        city_weights = list(itertools.accumulate(w for _, w in CITIES))
+        for n in range(self.n_users):
+            city_idx = bisect.bisect_left(city_weights, rng.random() * city_weights[-1])
+            city = CITIES[city_idx][0]
+            lat, lng = self._city_centers[city_idx]
+            is_caretaker = rng.random() < self.caretaker_ratio
+            created_at = self._moment(rng, self.since, self.until)
+            oid = make_oid(created_at, 1, n)
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            doc: Dict[str, Any] = {
+                "_id": oid,
+                "name": name,
+                "email": f"user{n}@{EMAIL_DOMAIN}",
+                "password_hash": self.password_hash,
+                "city": city,
+                "is_caretaker": is_caretaker,
+                "plan": "pro" if rng.random() < 0.1 else "free",
+                "subscription_status": "active (mock)",
+                "profile": {"city": city},
+                "availability": {
+                    "max_pets": rng.randint(1, 3) if is_caretaker else 1,
+                    "blocked_dates": [],
+                    "weekly_open": {k: rng.random() < 0.85 for k in WEEKDAYS},
+                },
+                "gallery": [],
+                "photo": None,
+                # Repartidos unos km alrededor del centro
+                "lat": round(lat + rng.gauss(0, 0.04), 6),
+                "lng": round(lng + rng.gauss(0, 0.04), 6),
+                "created_at": created_at,
+            }
+            if is_caretaker:
+                doc["profile"]["bio"] = rng.choice(BIOS)
+                doc["profile"]["accepts_sizes"] = sorted(rng.sample(SIZES, rng.randint(1, 4)), key=SIZES.index)
+                doc["profile"]["has_yard"] = rng.random() < 0.4
+                self.caretakers.append((oid, name, city_idx))
+            else:
+                self.owners.append((oid, name, city_idx))
+            yield doc
+
+    def services(self) -> Iterator[Dict[str, Any]]:
+        rng = self._rng("services")
+        n = itertools.count()
+        for oid, _, _ in self.caretakers:
+            offered = []
+            for stype, price, per_night in rng.sample(SERVICES, rng.randint(1, 3)):
+                sid = make_oid(oid.generation_time.replace(tzinfo=None), 2, next(n))
+                price = round(max(5.0, rng.gauss(price, price * 0.25)), 0)
+                offered.append((str(sid), stype, price, per_night))
+                yield {
+                    "_id": sid,
+                    "caretaker_id": str(oid),
+                    "type": stype,
+                    "price": price,
+                    "description": "",
+                    "enabled": rng.random() < 0.95,
+                }
+            self.caretaker_services.append(offered)
+
+    def pets(self) -> Iterator[Dict[str, Any]]:
+        rng = self._rng("pets")
+        n = itertools.count()
+        for oid, _, _ in self.owners:
+            ids = []
+            for _ in range(1 if rng.random() < 0.7 else rng.randint(2, 3)):
+                pid = make_oid(oid.generation_time.replace(tzinfo=None), 3, next(n))
+                ids.append(str(pid))
+                yield {
+                    "_id": pid,
+                    "owner_id": str(oid),
+                    "name": rng.choice(PET_NAMES),
+                    "breed": rng.choice(BREEDS),
+                    "age_years": round(rng.uniform(0.5, 15), 1),
+                    "weight_kg": round(rng.uniform(2, 45), 1),
+                    "sex": rng.choice(["M", "F"]),
+                    "photos": [],
+                }
+            self.owner_pets.append(ids)
+
+    # ---------- reservas y derivados ----------
+
+    def bookings(self) -> Iterator[Dict[str, Any]]:
+        if not self.caretakers or not self.owners:
+            return
+        rng = self._rng("bookings")
+        # Popularidad de cola larga: unos pocos cuidadores reciben muchas reservas
+        popularity = [rng.paretovariate(1.5) for _ in self.caretakers]
+        by_city: Dict[int, Tuple[List[int], List[float]]] = {}
+        for idx, (_, _, city_idx) in enumerate(self.caretakers):
+            by_city.setdefault(city_idx, ([], []))[0].append(idx)
+        for members, cum in by_city.values():
+            cum.extend(itertools.accumulate(popularity[i] for i in members))
+        everyone = list(range(len(self.caretakers)))
+        everyone_cum = list(itertools.accumulate(popularity))
+
+        for n in range(self.n_bookings):
+            owner_idx = rng.randrange(len(self.owners))
+            owner_oid, _, city_idx = self.owners[owner_idx]
+            # La mayoría reserva en su ciudad
+            members, cum = by_city.get(city_idx) if rng.random() < 0.85 and city_idx in by_city else (everyone, everyone_cum)
+            caretaker_idx = rng.choices(members, cum_weights=cum)[0]
+            caretaker_oid = self.caretakers[caretaker_idx][0]
+            service_id, _, price, per_night = rng.choice(self.caretaker_services[caretaker_idx])
+
+            start = self._moment(rng, self.since, self.until + timedelta(days=30))
+            start = start.replace(hour=rng.choice([8, 9, 10, 17, 18]), minute=0, second=0)
+            if per_night:
+                units = rng.choice([1, 1, 2, 3, 4, 7, 10, 14])
+                end = start + timedelta(days=units)
+            else:
+                units = 1
+                end = start + timedelta(hours=rng.choice([1, 2, 8]))
+            created_at = max(self.since, start - timedelta(days=rng.uniform(1, 30)))
+            r = rng.random()
+            if end < self.until:
+                status = "completed" if r < 0.8 else "rejected" if r < 0.92 else "pending"
+            else:
+                status = "accepted" if r < 0.6 else "pending" if r < 0.95 else "rejected"
+            total = round(price * units, 2)
+
+            oid = make_oid(created_at, 4, n)
+            self.booking_rows.append((oid, owner_idx, caretaker_idx, status, total, created_at, end))
+            pair = (owner_idx, caretaker_idx)
+            if pair not in self.threads or created_at < self.threads[pair]:
+                self.threads[pair] = created_at
+            yield {
+                "_id": oid,
+                "owner_id": str(owner_oid),
+                "caretaker_id": str(caretaker_oid),
+                "service_id": service_id,
+                "pet_id": rng.choice(self.owner_pets[owner_idx]),
+                "start": start,
+                "end": end,
+                "status": status,
+                "total_price": total,
+                "created_at": created_at,
+            }
+
+    def payments(self) -> Iterator[Dict[str, Any]]:
+        rng = self._rng("payments")
+        n = itertools.count()
+        for oid, owner_idx, caretaker_idx, status, total, created_at, _ in self.booking_rows:
+            r = rng.random()
+            if status == "completed" and r < 0.95:
+                pay_status = "refunded" if r < 0.03 else "completed"
+            elif status == "accepted" and r < 0.6:
+                pay_status = "processing" if r < 0.1 else "pending"
+            else:
+                continue
+            paid_at = created_at + timedelta(hours=rng.uniform(0.1, 48))
+            done = pay_status in ("completed", "refunded")
+            yield {
+                "_id": make_oid(paid_at, 5, next(n)),
+                "booking_id": oid,
+                "owner_id": self.owners[owner_idx][0],
+                "caretaker_id": self.caretakers[caretaker_idx][0],
+                "amount": total,
+                **_calculate_payment(total),
+                "status": pay_status,
+                "payment_method": "card" if rng.random() < 0.9 else "bank_transfer",
+                "transaction_id": f"mock_txn_{rng.getrandbits(64):016x}" if done else None,
+                "created_at": paid_at,
+                "completed_at": paid_at + timedelta(seconds=rng.uniform(1, 30)) if done else None,
+            }
+
+    def reviews(self) -> Iterator[Dict[str, Any]]:
+        rng = self._rng("reviews")
+        n = itertools.count()
+        for oid, owner_idx, caretaker_idx, status, _, _, end in self.booking_rows:
+            if status != "completed" or rng.random() >= 0.45:
+                continue
+            created_at = end + timedelta(days=rng.uniform(0.2, 5))
+            if created_at >= self.until:
+                continue
+            owner_oid, owner_name, _ = self.owners[owner_idx]
+            yield {
+                "_id": make_oid(created_at, 6, next(n)),
+                "booking_id": oid,
+                "review_type": "sitter",
+                "author_id": owner_oid,
+                "author": owner_name,
+                "rating": rng.choices([5, 4, 3, 2, 1], weights=[55, 28, 10, 4, 3])[0],
+                "comment": rng.choice(REVIEW_COMMENTS),
+                "created_at": created_at,
+                "sitter_id": self.caretakers[caretaker_idx][0],
+            }
+
+    def messages(self, batch: int = 10_000) -> Iterator[Dict[str, Any]]:
+        if not self.threads:
+            return
+        rng = self._rng("messages")
+        # Conversaciones de cola larga; se elige una por mensaje, en lotes
+        threads = sorted(self.threads.items())
+        cum = list(itertools.accumulate(rng.paretovariate(1.2) for _ in threads))
+        n = 0
+        while n < self.n_messages:
+            for (owner_idx, caretaker_idx), first in rng.choices(threads, cum_weights=cum, k=min(batch, self.n_messages - n)):
+                owner, caretaker = str(self.owners[owner_idx][0]), str(self.caretakers[caretaker_idx][0])
+                sender, receiver = (owner, caretaker) if rng.random() < 0.5 else (caretaker, owner)
+                created_at = min(
+                    self.until - timedelta(seconds=1),
+                    first + timedelta(seconds=int(rng.expovariate(1 / (7 * 86400)))),
+                )
+                read = created_at < self.until - timedelta(days=1) or rng.random() < 0.5
+                yield {
+                    "_id": make_oid(created_at, 7, n),
+                    "thread_id": "_".join(sorted((owner, caretaker))),
+                    "sender_id": sender,
+                    "receiver_id": receiver,
+                    "body": rng.choice(MESSAGE_BODIES),
+                    "created_at": created_at,
+                    "read": read,
+                    "read_at": created_at + timedelta(minutes=rng.uniform(1, 600)) if read else None,
+                }
+                n += 1
+
+
+# ---------- carga ----------
+
+def ensure_local(uri: str) -> None:
+    if uri.startswith("mongodb+srv://"):
+        sys.exit("Sólo se admite un mongod local (mongodb://localhost...)")
+    hosts = {host for host, _ in parse_uri(uri)["nodelist"]}
+    if not hosts <= LOCAL_HOSTS:
+        sys.exit(f"Sólo se admite un mongod local; la URI apunta a {', '.join(sorted(hosts))}")
+
+
+async def insert_all(coll, docs: Iterable[Dict[str, Any]], batch: int, concurrency: int) -> int:
+    """insert_many por lotes con hasta `concurrency` escrituras en vuelo."""
+    pending: set = set()
+    total = 0
+    started = time.perf_counter()
+    for chunk in batched(docs, batch):
+        if len(pending) >= concurrency:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        pending.add(asyncio.create_task(coll.insert_many(chunk, ordered=False)))
+        await asyncio.sleep(0)  # Deja arrancar la escritura mientras se genera el siguiente lote
+        total += len(chunk)
+        if total % (batch * 50) == 0:
+            print(f"  {coll.name}: {total:,} ({total / (time.perf_counter() - started):,.0f} docs/s)", flush=True)
+    if pending:
+        await asyncio.gather(*pending)
+    return total
+
+
+async def run(args: argparse.Namespace) -> None:
+    ensure_local(args.uri)
+    client = AsyncIOMotorClient(args.uri)
+    db = client[args.db]
+
+    if args.drop:
+        for name in (*COLLECTIONS, "caretaker_ledger", "caretaker_daily"):
+            await db.drop_collection(name)
+    elif await db.users.estimated_document_count():
+        sys.exit(f"La base '{args.db}' ya tiene usuarios; usa --drop para regenerarla")
+
+    generator = DatasetGenerator(
+        users=args.users,
+        bookings=args.bookings,
+        messages=args.messages,
+        caretaker_ratio=args.caretaker_ratio,
+        days=args.days,
+        seed=args.seed,
+        until=args.until,
+        password_hash=hash_password(PASSWORD),
+    )
+    started = time.perf_counter()
+    for name in COLLECTIONS:
+        t0 = time.perf_counter()
+        count = await insert_all(db[name], getattr(generator, name)(), args.batch, args.concurrency)
+        print(f"{name:<10} {count:>12,} docs en {time.perf_counter() - t0:7.1f} s", flush=True)
+
+    # Índices de la app (los mismos que crea get_db al arrancar)
+    t0 = time.perf_counter()
+    settings = get_settings()
+    settings.mongodb_uri, settings.db_name = args.uri, args.db
+    await app_db.get_db()
+    print(f"índices    {time.perf_counter() - t0:19.1f} s")
+
+    # Libro de ganancias de los cuidadores, desde los pagos generados
+    t0 = time.perf_counter()
+    created = await ledger.reconcile(db, fix=True, settle=0)
+    print(f"libro      {len(created):>12,} cuidadores en {time.perf_counter() - t0:7.1f} s")
+    t0 = time.perf_counter()
+    days = await ledger.backfill_daily(db)
+    print(f"diarios    {days:>12,} días en {time.perf_counter() - t0:7.1f} s")
+    print(f"total      {time.perf_counter() - started:19.1f} s  (contraseña: {PASSWORD})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="petconnect_bench")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--caretaker-ratio", type=float, default=0.2)
+    parser.add_argument("--bookings", type=int, default=50_000)
+    parser.add_argument("--messages", type=int, default=500_000)
+    parser.add_argument("--days", type=int, default=365, help="días de historia hasta --until")
+    parser.add_argument("--until", type=date.fromisoformat, default=None, help="AAAA-MM-DD (por defecto, hoy)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=4, help="insert_many en vuelo")
+    parser.add_argument("--drop", action="store_true", help="borra las colecciones antes de cargar")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# benchmarks/endpoints.py
+"""
+Benchmark de los endpoints calientes contra una base sembrada con
+`benchmarks.dataset`.
+
+La app se ejecuta en el mismo proceso con el transporte ASGI de httpx (sin
+red ni servidor). Cada escenario se repite N veces, en serie, y se guarda la
+latencia (p50/p90/p99) y los comandos MongoDB por petición (vía
+`dbstats.add_observer`, como el fixture `max_db_calls`). El resultado es un
+JSON que sirve de línea base; `compare` marca regresiones por encima de un
+umbral y sale con código 1.
+
+Uso:
+    python -m benchmarks.endpoints run [--db petconnect_bench] [--requests 200] [--output FICHERO]
+    python -m benchmarks.endpoints run --baseline benchmarks/baselines/main.json
+    python -m benchmarks.endpoints compare BASE.json ACTUAL.json [--threshold 0.2]
+
+Los usuarios de prueba se eligen de los datos: el cuidador con más reservas
+y el dueño que más ha reservado con él (los casos más pesados). Las reservas
+creadas por el escenario de creación se borran al terminar.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+from bson import ObjectId
+
+from app import dbstats, security
+from app.config import get_settings
+
+from .dataset import ensure_local
+
+BASELINES_DIR = Path(__file__).parent / "baselines"
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    path: str
+    role: str  # "owner", "caretaker" o "" (sin autenticar)
+    body: Optional[Callable[[int], Dict[str, Any]]] = None
+    expected: int = 200
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies: List[float], db_calls: List[int], db_seconds: List[float], errors: int) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    n = len(ordered) or 1
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "p50_ms": round(percentile(ordered, 0.5) * 1000, 2),
+        "p90_ms": round(percentile(ordered, 0.9) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "mean_ms": round(sum(ordered) / n * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        "db_calls": round(sum(db_calls) / n, 2),
+        "db_calls_max": max(db_calls, default=0),
+        "db_ms": round(sum(db_seconds) / n * 1000, 2),
+    }
+
+
+# ---------- preparación ----------
+
+async def pick_fixtures(db) -> Dict[str, Any]:
+    """Elige los usuarios e ids que usan los escenarios."""
+    top = await db.bookings.aggregate([
+        {"$group": {"_id": "$caretaker_id", "n": {"$sum": 1}}},
+        {"$sort": {"n": -1}},
+        {"$limit": 1},
+    ]).to_list(1)
+    if not top:
+        sys.exit("La base no tiene reservas; genera datos con `python -m benchmarks.dataset`")
+    caretaker_id = top[0]["_id"]
+    owner = await db.bookings.aggregate([
+        {"$match": {"caretaker_id": caretaker_id}},
+        {"$group": {"_id": "$owner_id", "n": {"$sum": 1}}},
+        {"$sort": {"n": -1}},
+        {"$limit": 1},
+    ]).to_list(1)
+    owner_id = owner[0]["_id"]
+
+    caretaker = await db.users.find_one({"_id": ObjectId(caretaker_id)})
+    service = await db.services.find_one({"caretaker_id": caretaker_id, "enabled": True})
+    pet = await db.pets.find_one({"owner_id": owner_id})
+    return {
+        "owner_id": owner_id,
+        "caretaker_id": caretaker_id,
+        "city": caretaker.get("city"),
+        "lat": caretaker.get("lat"),
+        "lng": caretaker.get("lng"),
+        "service_id": str(service["_id"]) if service else None,
+        "pet_id": str(pet["_id"]) if pet else None,
+        "thread_id": "_".join(sorted((owner_id, caretaker_id))),
+    }
+
+
+def build_scenarios(f: Dict[str, Any]) -> List[Scenario]:
+    search = f"/sitters/search?city={f['city']}&lat={f['lat']}&lng={f['lng']}"
+    # Cada reserva en un día distinto y muy en el futuro: no choca con el hueco del cuidador
+    first_day = datetime.utcnow().replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(days=3650)
+
+    def booking(i: int) -> Dict[str, Any]:
+        start = first_day + timedelta(days=i)
+        return {
+            "caretaker_id": f["caretaker_id"],
+            "service_id": f["service_id"],
+            "pet_id": f["pet_id"],
+            "start": start.isoformat(),
+            "end": (start + timedelta(hours=1)).isoformat(),
+        }
+
+    scenarios = [
+        Scenario("search_distance", "GET", f"{search}&sort_by=distance", ""),
+        Scenario("search_price", "GET", f"{search}&sort_by=price", ""),
+        Scenario("search_rating", "GET", f"{search}&sort_by=rating", ""),
+        Scenario("sitter_profile", "GET", f"/sitters/{f['caretaker_id']}", ""),
+        Scenario("thread_list", "GET", "/messages/threads", "owner"),
+        Scenario("message_page", "GET", f"/messages?thread_id={f['thread_id']}", "owner"),
+        Scenario("caretaker_stats", "GET", "/payments/caretaker/stats", "caretaker"),
+        Scenario("review_list", "GET", f"/reviews?sitter_id={f['caretaker_id']}&review_type=sitter", ""),
+    ]
+    if f["service_id"] and f["pet_id"]:
+        scenarios.append(Scenario("booking_create", "POST", "/bookings", "owner", body=booking, expected=201))
+    return scenarios
+
+
+# ---------- ejecución ----------
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, headers: Dict[str, str], requests: int, warmup: int, created: List[str]) -> Dict[str, Any]:
+    seen: List[dbstats.RequestDbStats] = []
+    latencies: List[float] = []
+    db_calls: List[int] = []
+    db_seconds: List[float] = []
+    errors = 0
+    remove = dbstats.add_observer(lambda method, route, stats: seen.append(stats))
+    try:
+        for i in range(warmup + requests):
+            kwargs: Dict[str, Any] = {"headers": headers}
+            if scenario.body is not None:
+                kwargs["json"] = scenario.body(i)
+            seen.clear()
+            started = time.perf_counter()
+            resp = await client.request(scenario.method, scenario.path, **kwargs)
+            elapsed = time.perf_counter() - started
+            if resp.status_code == 201 and scenario.method == "POST":
+                created.append(resp.json()["id"])
+            if i < warmup:
+                continue
+            if resp.status_code != scenario.expected:
+                errors += 1
+                continue
+            latencies.append(elapsed)
+            if seen:
+                db_calls.append(seen[-1].commands)
+                db_seconds.append(seen[-1].seconds)
+    finally:
+        remove()
+    return summarize(latencies, db_calls, db_seconds, errors)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    ensure_local(args.uri)
+    settings = get_settings()
+    settings.mongodb_uri, settings.db_name = args.uri, args.db
+
+    from app.db import get_db
+    from app.main import app
+
+    # Se mide la app, no el rate limiting
+    app.state.limiter = None
+    db = await get_db()
+    fixtures = await pick_fixtures(db)
+    tokens = {
+        "owner": security.create_access_token(fixtures["owner_id"]),
+        "caretaker": security.create_access_token(fixtures["caretaker_id"]),
+    }
+    only = set(args.only.split(",")) if args.only else None
+
+    results: Dict[str, Any] = {}
+    created: List[str] = []
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for scenario in build_scenarios(fixtures):
+                if only and scenario.name not in only:
+                    continue
+                headers = {"Authorization": f"Bearer {tokens[scenario.role]}"} if scenario.role else {}
+                results[scenario.name] = await run_scenario(client, scenario, headers, args.requests, args.warmup, created)
+                print(format_row(scenario.name, results[scenario.name]), flush=True)
+    finally:
+        if created:
+            await db.bookings.delete_many({"_id": {"$in": [ObjectId(i) for i in created]}})
+
+    counts = {name: await db[name].estimated_document_count() for name in ("users", "bookings", "messages", "payments", "reviews")}
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "db": args.db,
+            "counts": counts,
+            "requests": args.requests,
+        },
+        "scenarios": results,
+    }
+
+
+# ---------- comparación ----------
+
+HEADER = f"{'escenario':<18} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'db':>6} {'errores':>8}"
+
+
+def format_row(name: str, r: Dict[str, Any]) -> str:
+    return f"{name:<18} {r['p50_ms']:>9.2f} {r['p90_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['db_calls']:>6.1f} {r['errors']:>8}"
+
+
+def compare(base: Dict[str, Any], current: Dict[str, Any], threshold: float, min_delta_ms: float) -> List[str]:
+    """
+    Devuelve las regresiones: p50 o p99 peor que la base en más de `threshold`
+    (y en más de `min_delta_ms`, para no saltar por ruido en rutas de 1 ms),
+    más comandos MongoDB por petición, o errores nuevos.
+    """
+    regressions = []
+    for name, cur in current["scenarios"].items():
+        old = base["scenarios"].get(name)
+        if old is None:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if cur[key] > old[key] * (1 + threshold) and cur[key] - old[key] > min_delta_ms:
+                change = f" ({cur[key] / old[key] - 1:+.0%})" if old[key] else ""
+                regressions.append(f"{name}: {key} {old[key]:.2f} -> {cur[key]:.2f}{change}")
+        if cur["db_calls"] > old["db_calls"]:
+            regressions.append(f"{name}: comandos MongoDB {old['db_calls']:.1f} -> {cur['db_calls']:.1f}")
+        if cur["errors"] > old["errors"]:
+            regressions.append(f"{name}: errores {old['errors']} -> {cur['errors']}")
+    return regressions
+
+
+def print_comparison(base: Dict[str, Any], current: Dict[str, Any], threshold: float, min_delta_ms: float) -> int:
+    print(f"\n{'escenario':<18} {'p50 base':>9} {'p50 act':>9} {'p99 base':>9} {'p99 act':>9} {'db base':>8} {'db act':>8}")
+    for name, cur in current["scenarios"].items():
+        old = base["scenarios"].get(name)
+        if old is None:
+            print(f"{name:<18} (nuevo)")
+            continue
+        print(
+            f"{name:<18} {old['p50_ms']:>9.2f} {cur['p50_ms']:>9.2f} {old['p99_ms']:>9.2f} "
+            f"{cur['p99_ms']:>9.2f} {old['db_calls']:>8.1f} {cur['db_calls']:>8.1f}"
+        )
+    regressions = compare(base, current, threshold, min_delta_ms)
+    if regressions:
+        print(f"\nREGRESIONES (umbral {threshold:.0%}):")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print(f"\nSin regresiones (umbral {threshold:.0%})")
+    return 0
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="ejecuta los escenarios y guarda el resultado")
+    run_p.add_argument("--uri", default="mongodb://localhost:27017")
+    run_p.add_argument("--db", default="petconnect_bench")
+    run_p.add_argument("--requests", type=int, default=200)
+    run_p.add_argument("--warmup", type=int, default=10)
+    run_p.add_argument("--only", default="", help="escenarios separados por comas")
+    run_p.add_argument("--output", default="", help="JSON de salida (por defecto baselines/<git>.json)")
+    run_p.add_argument("--baseline", default="", help="compara con esta línea base al terminar")
+
+    cmp_p = sub.add_parser("compare", help="compara dos resultados")
+    cmp_p.add_argument("base")
+    cmp_p.add_argument("current")
+
+    for p in (run_p, cmp_p):
+        p.add_argument("--threshold", type=float, default=0.2, help="empeoramiento relativo tolerado")
+        p.add_argument("--min-delta-ms", type=float, default=1.0, help="diferencia absoluta mínima para marcar")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(print_comparison(load(args.base), load(args.current), args.threshold, args.min_delta_ms))
+
+    print(HEADER)
+    result = asyncio.run(run(args))
+    output = Path(args.output) if args.output else BASELINES_DIR / f"{result['meta']['git'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    print(f"\nResultado guardado en {output}")
+    if args.baseline:
+        sys.exit(print_comparison(load(args.baseline), result, args.threshold, args.min_delta_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+# benchmarks/loadgen.py
+"""
+Generador de carga mixta contra la app levantada en local.
+
+Reproduce el tráfico de producción en una sola máquina:
+- Usuarios HTTP virtuales que repiten escenarios según un reparto (`--mix`):
+  dueños buscando cuidadores, viendo perfiles y reservando, y cuidadores
+  consultando sus estadísticas.
+- Miles de sesiones de chat por WebSocket (parejas dueño/cuidador) que
+  envían eventos de escritura y mensajes, y responden al heartbeat.
+
+Al final (y cada `--report-every` segundos) muestra por escenario el
+throughput, los percentiles de latencia y la tasa de errores. Los 429/503
+(rate limiting, control de admisión) se cuentan aparte de los errores.
+
+Los usuarios salen de la base generada con `benchmarks.dataset` y los tokens
+se firman aquí con el mismo JWT_SECRET que la app (mismo .env), sin pasar por
+bcrypt. Cada usuario virtual usa su propia IP de loopback (127.0.0.x) para
+que el rate limiting por IP se comporte como con clientes reales.
+
+Uso:
+    DB_NAME=petconnect_bench uvicorn app.main:app --workers 4
+    python -m benchmarks.loadgen --users 100 --ws-sessions 2000 --duration 120
+
+Para miles de sesiones WebSocket sube el límite de descriptores (`ulimit -n 65536`).
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+import websockets
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.security import create_access_token
+
+from .dataset import CITIES, LOCAL_HOSTS, ensure_local
+from .endpoints import percentile
+
+DEFAULT_MIX = "search=50,profile=25,booking=10,stats=15"
+SORTS = ["distance", "price", "rating"]
+
+
+class Stats:
+    """Latencias y resultados por nombre de petición."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.rejected: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+
+    def ok(self, name: str, seconds: float) -> None:
+        self.latencies[name].append(seconds)
+
+    def error(self, name: str) -> None:
+        self.errors[name] += 1
+
+    def reject(self, name: str) -> None:
+        self.rejected[name] += 1
+
+    def http(self, name: str, seconds: float, status: int, expected=(200,)) -> None:
+        if status in expected:
+            self.ok(name, seconds)
+        elif status in (429, 503):
+            self.reject(name)
+        else:
+            self.error(name)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        elapsed = time.perf_counter() - self.started
+        out = {}
+        for name in sorted(set(self.latencies) | set(self.errors) | set(self.rejected)):
+            ordered = sorted(self.latencies[name])
+            total = len(ordered) + self.errors[name] + self.rejected[name]
+            out[name] = {
+                "requests": total,
+                "rps": round(total / elapsed, 1),
+                "p50_ms": round(percentile(ordered, 0.5) * 1000, 1),
+                "p90_ms": round(percentile(ordered, 0.9) * 1000, 1),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+                "error_rate": round(self.errors[name] / total, 4) if total else 0.0,
+                "rejected_rate": round(self.rejected[name] / total, 4) if total else 0.0,
+            }
+        return out
+
+    def print(self, title: str) -> None:
+        print(f"\n{title} ({time.perf_counter() - self.started:.0f} s)")
+        print(f"{'petición':<18} {'total':>8} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'errores':>8} {'429/503':>8}")
+        for name, r in self.summary().items():
+            print(
+                f"{name:<18} {r['requests']:>8} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p90_ms']:>8.1f} "
+                f"{r['p99_ms']:>8.1f} {r['error_rate']:>8.2%} {r['rejected_rate']:>8.2%}",
+                flush=True,
+            )
+
+
+# ---------- datos ----------
+
+async def load_fixtures(uri: str, db_name: str, owners: int, caretakers: int) -> Dict[str, Any]:
+    """Muestra aleatoria de dueños (con mascota) y cuidadores (con servicio)."""
+    db = AsyncIOMotorClient(uri)[db_name]
+
+    async def sample(is_caretaker: bool, size: int) -> List[Dict[str, Any]]:
+        return await db.users.aggregate([
+            {"$match": {"is_caretaker": is_caretaker}},
+            {"$sample": {"size": size}},
+            {"$project": {"_id": 1, "city": 1}},
+        ]).to_list(size)
+
+    owner_docs = await sample(False, owners)
+    caretaker_docs = await sample(True, caretakers)
+    if not owner_docs or not caretaker_docs:
+        sys.exit(f"La base '{db_name}' no tiene usuarios; genera datos con `python -m benchmarks.dataset`")
+
+    owner_ids = [str(u["_id"]) for u in owner_docs]
+    caretaker_ids = [str(u["_id"]) for u in caretaker_docs]
+    pets: Dict[str, str] = {}
+    async for pet in db.pets.find({"owner_id": {"$in": owner_ids}}, {"owner_id": 1}):
+        pets.setdefault(pet["owner_id"], str(pet["_id"]))
+    services: Dict[str, str] = {}
+    async for svc in db.services.find({"caretaker_id": {"$in": caretaker_ids}, "enabled": True}, {"caretaker_id": 1}):
+        services.setdefault(svc["caretaker_id"], str(svc["_id"]))
+
+    return {
+        "owners": [(i, create_access_token(i), pets.get(i)) for i in owner_ids],
+        "caretakers": [(i, create_access_token(i), services.get(i)) for i in caretaker_ids],
+    }
+
+
+def parse_mix(text: str) -> Tuple[List[str], List[float]]:
+    names, cum = [], []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            sys.exit(f"Escenario desconocido: {name!r} (disponibles: {', '.join(SCENARIOS)})")
+        names.append(name.strip())
+        cum.append((cum[-1] if cum else 0.0) + float(weight or 1))
+    return names, cum
+
+
+# ---------- escenarios HTTP ----------
+
+async def timed(stats: Stats, name: str, client: httpx.AsyncClient, method: str, url: str, expected=(200,), **kwargs) -> Optional[httpx.Response]:
+    started = time.perf_counter()
+    try:
+        resp = await client.request(method, url, **kwargs)
+    except httpx.HTTPError:
+        stats.error(name)
+        return None
+    stats.http(name, time.perf_counter() - started, resp.status_code, expected)
+    return resp
+
+
+async def scenario_search(client, stats, rng, fx) -> None:
+    city = rng.choices([c for c, _ in CITIES], weights=[w for _, w in CITIES])[0]
+    await timed(stats, "search", client, "GET", "/sitters/search", params={"city": city, "sort_by": rng.choice(SORTS)})
+
+
+async def scenario_profile(client, stats, rng, fx) -> None:
+    caretaker_id = rng.choice(fx["caretakers"])[0]
+    await timed(stats, "profile", client, "GET", f"/sitters/{caretaker_id}")
+
+
+async def scenario_booking(client, stats, rng, fx) -> None:
+    """Dueño: busca, abre un perfil, reserva y consulta sus reservas."""
+    owner_id, token, pet_id = rng.choice(fx["owners"])
+    caretaker_id, _, service_id = rng.choice(fx["caretakers"])
+    auth = {"Authorization": f"Bearer {token}"}
+    await scenario_search(client, stats, rng, fx)
+    await timed(stats, "profile", client, "GET", f"/sitters/{caretaker_id}")
+    if pet_id and service_id:
+        start = datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(days=rng.randint(30, 3650), hours=rng.randint(0, 23))
+        # 409 (sin hueco) es una respuesta normal del flujo
+        await timed(stats, "booking_create", client, "POST", "/bookings", expected=(201, 409), headers=auth, json={
+            "caretaker_id": caretaker_id,
+            "service_id": service_id,
+            "pet_id": pet_id,
+            "start": start.isoformat(),
+            "end": (start + timedelta(hours=1)).isoformat(),
+        })
+    await timed(stats, "bookings_list", client, "GET", "/bookings/mine", headers=auth)
+
+
+async def scenario_stats(client, stats, rng, fx) -> None:
+    """Cuidador: consulta sus estadísticas de pagos y sus reservas."""
+    _, token, _ = rng.choice(fx["caretakers"])
+    auth = {"Authorization": f"Bearer {token}"}
+    await timed(stats, "caretaker_stats", client, "GET", "/payments/caretaker/stats", headers=auth)
+    await timed(stats, "bookings_list", client, "GET", "/bookings/mine", headers=auth)
+
+
+SCENARIOS = {
+    "search": scenario_search,
+    "profile": scenario_profile,
+    "booking": scenario_booking,
+    "stats": scenario_stats,
+}
+
+
+async def http_user(n: int, args, fx, stats: Stats, deadline: float, mix: Tuple[List[str], List[float]]) -> None:
+    rng = random.Random(f"{args.seed}:http:{n}")
+    await asyncio.sleep(rng.random() * args.ramp)
+    transport = httpx.AsyncHTTPTransport(local_address=args.local_ip(n)) if args.local_ip else None
+    async with httpx.AsyncClient(base_url=args.base_url, transport=transport, timeout=30) as client:
+        names, cum = mix
+        while time.perf_counter() < deadline:
+            name = names[bisect.bisect_left(cum, rng.random() * cum[-1])]
+            await SCENARIOS[name](client, stats, rng, fx)
+            await asyncio.sleep(rng.expovariate(1 / args.think) if args.think else 0)
+
+
+# ---------- chat por WebSocket ----------
+
+async def ws_session(n: int, args, me: Tuple[str, str], peer: str, stats: Stats, deadline: float) -> None:
+    """
+    Una sesión de chat: conecta, y hasta el final alterna 'escribiendo' y
+    send_message con su pareja. Mide el tiempo de conexión, el ack
+    (message_sent) y la entrega a la pareja (new_message).
+    """
+    rng = random.Random(f"{args.seed}:ws:{n}")
+    await asyncio.sleep(rng.random() * args.ramp)
+    user_id, token = me
+    thread_id = "_".join(sorted((user_id, peer)))
+    url = f"{args.ws_url}/ws/{token}"
+    pending: Dict[str, float] = {}
+    seq = itertools.count()
+
+    started = time.perf_counter()
+    try:
+        async with websockets.connect(url, open_timeout=30, max_queue=None) as ws:
+            first = json.loads(await asyncio.wait_for(ws.recv(), 30))
+            if first.get("type") != "connected":
+                stats.error("ws_connect")
+                return
+            stats.ok("ws_connect", time.perf_counter() - started)
+
+            async def reader():
+                async for raw in ws:
+                    frame = json.loads(raw)
+                    kind = frame.get("type")
+                    if kind == "ping":
+                        await ws.send('{"type":"pong"}')
+                    elif kind == "message_sent":
+                        sent = pending.pop(frame["message"]["body"], None)
+                        if sent is not None:
+                            stats.ok("ws_message_ack", time.perf_counter() - sent)
+                    elif kind == "new_message":
+                        # El cuerpo lleva la hora de envío (mismo reloj: misma máquina)
+                        _, _, sent_at = frame["message"]["body"].rpartition(" ")
+                        try:
+                            stats.ok("ws_delivery", time.time() - float(sent_at))
+                        except ValueError:
+                            pass
+                    elif kind == "error":
+                        if frame.get("code") == "rate_limited":
+                            stats.reject("ws_message_ack")
+                        else:
+                            stats.error("ws_message_ack")
+
+            reading = asyncio.create_task(reader())
+            try:
+                while time.perf_counter() < deadline and not reading.done():
+                    await asyncio.sleep(rng.expovariate(1 / args.ws_interval))
+                    typing = {"type": "typing", "thread_id": thread_id, "receiver_id": peer}
+                    await ws.send(json.dumps({**typing, "is_typing": True}))
+                    await asyncio.sleep(rng.uniform(0.5, 3))
+                    await ws.send(json.dumps({**typing, "is_typing": False}))
+                    body = f"loadgen {n}-{next(seq)} {time.time():.6f}"
+                    pending[body] = time.perf_counter()
+                    await ws.send(json.dumps({
+                        "type": "send_message",
+                        "thread_id": thread_id,
+                        "receiver_id": peer,
+                        "body": body,
+                    }))
+                # Margen para los últimos acks
+                if pending and not reading.done():
+                    await asyncio.wait({reading}, timeout=5)
+            finally:
+                reading.cancel()
+            for _ in pending:
+                stats.error("ws_message_ack")
+    except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+        stats.error("ws_session")
+
+
+# ---------- principal ----------
+
+async def run(args) -> Stats:
+    host = urlparse(args.base_url).hostname
+    if host not in LOCAL_HOSTS:
+        sys.exit(f"Sólo contra la app local; {args.base_url} no lo es")
+    ensure_local(args.mongo_uri)
+    args.ws_url = "ws" + args.base_url[len("http"):]
+    # IPs de loopback distintas por usuario virtual (sólo con 127.0.0.1)
+    args.local_ip = (lambda n: f"127.0.{(n // 250) % 250}.{n % 250 + 2}") if host == "127.0.0.1" and args.spread_ips else None
+
+    pairs = args.ws_sessions // 2
+    fx = await load_fixtures(args.mongo_uri, args.db, max(args.fixtures, pairs), max(args.fixtures // 4, pairs))
+    mix = parse_mix(args.mix)
+    stats = Stats()
+    deadline = time.perf_counter() + args.duration
+
+    tasks = [asyncio.create_task(http_user(n, args, fx, stats, deadline, mix)) for n in range(args.users)]
+    owners, caretakers = fx["owners"], fx["caretakers"]
+    for i in range(min(pairs, len(owners), len(caretakers))):
+        owner, caretaker = owners[i], caretakers[i]
+        tasks.append(asyncio.create_task(ws_session(2 * i, args, owner[:2], caretaker[0], stats, deadline)))
+        tasks.append(asyncio.create_task(ws_session(2 * i + 1, args, caretaker[:2], owner[0], stats, deadline)))
+
+    async def progress():
+        while True:
+            await asyncio.sleep(args.report_every)
+            stats.print("Parcial")
+
+    reporter = asyncio.create_task(progress())
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        reporter.cancel()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="petconnect_bench")
+    parser.add_argument("--users", type=int, default=50, help="usuarios HTTP virtuales concurrentes")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"reparto de escenarios (por defecto {DEFAULT_MIX})")
+    parser.add_argument("--think", type=float, default=0.5, help="pausa media entre escenarios (s)")
+    parser.add_argument("--ws-sessions", type=int, default=1000, help="sesiones de chat WebSocket")
+    parser.add_argument("--ws-interval", type=float, default=10.0, help="segundos medios entre mensajes por sesión")
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--ramp", type=float, default=10.0, help="segundos para arrancar todos los clientes")
+    parser.add_argument("--fixtures", type=int, default=2000, help="dueños de la muestra")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--report-every", type=float, default=10.0)
+    parser.add_argument("--no-spread-ips", dest="spread_ips", action="store_false", help="todos desde 127.0.0.1")
+    parser.add_argument("--output", default="", help="guarda el resumen en JSON")
+    args = parser.parse_args()
+
+    stats = asyncio.run(run(args))
+    stats.print("Resultado")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "local_ip"}, "results": stats.summary()}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
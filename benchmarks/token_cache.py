@@ -0,0 +1,75 @@
+# benchmarks/token_cache.py
+"""
+Benchmark de la caché de tokens verificados.
+
+Mide peticiones por segundo contra una ruta trivial autenticada con
+`get_current_user_id`, con la caché activa y desactivada (TTL 0). Usa el
+transporte ASGI de httpx, así que no hace falta levantar el servidor ni MongoDB.
+
+Uso:
+    python -m benchmarks.token_cache [--requests 5000] [--tokens 1]
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+
+from app import security
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping(user_id: str = Depends(security.get_current_user_id)):
+        return {"user_id": user_id}
+
+    return app
+
+
+async def measure(app: FastAPI, tokens: list, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = [{"Authorization": f"Bearer {t}"} for t in tokens]
+        # Calentamiento
+        for h in headers:
+            (await client.get("/ping", headers=h)).raise_for_status()
+        start = time.perf_counter()
+        for i in range(requests):
+            r = await client.get("/ping", headers=headers[i % len(headers)])
+            r.raise_for_status()
+        return requests / (time.perf_counter() - start)
+
+
+async def run(requests: int, n_tokens: int) -> dict:
+    app = build_app()
+    tokens = [security.create_access_token(f"user{i}") for i in range(n_tokens)]
+    results = {}
+    original_ttl = security.settings.token_cache_ttl
+    try:
+        for label, ttl in (("sin caché", 0), ("con caché", original_ttl)):
+            security._token_cache.clear()
+            security.settings.token_cache_ttl = ttl
+            results[label] = await measure(app, tokens, requests)
+    finally:
+        security.settings.token_cache_ttl = original_ttl
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--tokens", type=int, default=1, help="tokens distintos en rotación")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.requests, args.tokens))
+    for label, rps in results.items():
+        print(f"{label:<10} {rps:>10.0f} req/s")
+    base = results["sin caché"]
+    print(f"mejora: {results['con caché'] / base - 1:+.0%}")
+
+
+if __name__ == "__main__":
+    main()
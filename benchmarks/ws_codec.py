@@ -0,0 +1,85 @@
+# benchmarks/ws_codec.py
+"""
+Benchmark de codificación de frames WebSocket: JSON vs MessagePack.
+
+Mide bytes por frame y coste de CPU por codificación para los eventos
+`new_message` y `new_report`, con documentos como los que produce `to_id`.
+
+Uso:
+    python -m benchmarks.ws_codec [--iterations 20000]
+"""
+import argparse
+import timeit
+from datetime import datetime
+
+from bson import ObjectId
+
+from app.realtime.codec import JSON, MSGPACK
+from app.utils import to_id
+
+
+def sample_events() -> dict:
+    now = datetime.utcnow()
+    message = to_id({
+        "_id": ObjectId(),
+        "thread_id": f"{ObjectId()}_{ObjectId()}",
+        "sender_id": str(ObjectId()),
+        "receiver_id": str(ObjectId()),
+        "body": "¡Hola! Luna ha comido bien y ya hemos salido a pasear por el parque.",
+        "created_at": now,
+        "read": False,
+    })
+    report = to_id({
+        "_id": ObjectId(),
+        "booking_id": str(ObjectId()),
+        "caretaker_id": str(ObjectId()),
+        "type": "photo",
+        "message": "Paseo de la tarde completado",
+        "photo_url": "/media/reports/3f2b8c1d9e7a4b6c8d0e1f2a3b4c5d6e.jpg",
+        "activity_type": "walk",
+        "created_at": now,
+    })
+    return {
+        "new_message": {"type": "new_message", "event_id": 123456, "message": message},
+        "new_report": {
+            "type": "new_report",
+            "event_id": 123457,
+            "report": report,
+            "booking_id": report["booking_id"],
+        },
+    }
+
+
+def run(iterations: int) -> list:
+    if MSGPACK is None:
+        raise SystemExit("msgpack no está instalado: pip install msgpack")
+    rows = []
+    for name, event in sample_events().items():
+        for codec in (JSON, MSGPACK):
+            size = len(codec.encode(event) if codec.binary else codec.encode(event).encode("utf-8"))
+            seconds = timeit.timeit(lambda: codec.encode(event), number=iterations)
+            rows.append({
+                "event": name,
+                "codec": "msgpack" if codec.binary else "json",
+                "bytes": size,
+                "encode_us": seconds / iterations * 1e6,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    rows = run(args.iterations)
+    print(f"{'evento':<12} {'codec':<8} {'bytes':>6} {'encode µs':>10}")
+    for row in rows:
+        print(f"{row['event']:<12} {row['codec']:<8} {row['bytes']:>6} {row['encode_us']:>10.2f}")
+    for name in ("new_message", "new_report"):
+        js, mp = [r for r in rows if r["event"] == name]
+        print(f"{name}: msgpack ocupa {mp['bytes'] / js['bytes']:.0%} de JSON")
+
+
+if __name__ == "__main__":
+    main()
@@ -51,6 +51,32 @@ def client():
     app.state.limiter = None
     return TestClient(app)
 
+@pytest.fixture
+def max_db_calls():
+    """
+    Acota los comandos MongoDB por petición para detectar N+1:
+
+        with max_db_calls(4):
+            client.get("/messages/threads", headers=auth)
+
+    Falla si alguna petición del bloque ejecuta más de `limit` comandos.
+    """
+    from contextlib import contextmanager
+    from app import dbstats
+
+    @contextmanager
+    def check(limit: int):
+        seen = []
+        remove = dbstats.add_observer(lambda method, route, stats: seen.append((method, route, stats.commands)))
+        try:
+            yield seen
+        finally:
+            remove()
+        over = [f"{m} {r}: {n} comandos" for m, r, n in seen if n > limit]
+        assert not over, f"Más de {limit} comandos MongoDB por petición: {over}"
+
+    return check
+
 @pytest.fixture
 def test_user_data():
     """Datos de usuario de prueba"""
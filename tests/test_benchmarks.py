@@ -0,0 +1,85 @@
+"""
+Tests de las herramientas de benchmarks/: el generador de datos sintéticos
+y la comparación con líneas base. No requieren MongoDB.
+"""
+from datetime import date
+
+import pytest
+
+from benchmarks.dataset import COLLECTIONS, DatasetGenerator, ensure_local
+from benchmarks.endpoints import compare, percentile
+
+
+def generate(seed: int = 7) -> dict:
+    gen = DatasetGenerator(users=300, bookings=1000, messages=2000, seed=seed, until=date(2025, 6, 1), password_hash="x")
+    return {name: list(getattr(gen, name)()) for name in COLLECTIONS}
+
+
+def test_same_seed_same_dataset():
+    """Con la misma semilla y fecha se generan exactamente los mismos documentos."""
+    assert generate() == generate()
+    assert generate(seed=8)["users"] != generate()["users"]
+
+
+def test_referential_integrity():
+    """Reservas, pagos, reseñas y mensajes apuntan a documentos que existen."""
+    data = generate()
+    users = {u["_id"]: u for u in data["users"]}
+    caretakers = {str(i) for i, u in users.items() if u["is_caretaker"]}
+    owners = {str(i) for i, u in users.items() if not u["is_caretaker"]}
+    services = {str(s["_id"]): s for s in data["services"]}
+    pets = {str(p["_id"]): p for p in data["pets"]}
+    bookings = {b["_id"]: b for b in data["bookings"]}
+
+    assert len(data["bookings"]) == 1000 and len(data["messages"]) == 2000
+    assert len({u["email"] for u in data["users"]}) == len(users)
+    for b in data["bookings"]:
+        assert b["owner_id"] in owners and b["caretaker_id"] in caretakers
+        assert services[b["service_id"]]["caretaker_id"] == b["caretaker_id"]
+        assert pets[b["pet_id"]]["owner_id"] == b["owner_id"]
+        assert b["start"] < b["end"]
+    for p in data["payments"]:
+        booking = bookings[p["booking_id"]]
+        assert str(p["caretaker_id"]) == booking["caretaker_id"]
+        assert p["platform_fee"] + p["caretaker_payout"] == pytest.approx(p["amount"])
+    for r in data["reviews"]:
+        assert bookings[r["booking_id"]]["status"] == "completed"
+    for m in data["messages"]:
+        assert {m["sender_id"], m["receiver_id"]} == set(m["thread_id"].split("_"))
+    assert len({m["_id"] for m in data["messages"]}) == 2000
+
+
+def test_only_local_mongod():
+    """Se niega a cargar datos en un servidor que no sea local."""
+    ensure_local("mongodb://localhost:27017")
+    with pytest.raises(SystemExit):
+        ensure_local("mongodb://db.example.com:27017")
+
+
+def _result(**scenarios):
+    base = {"p50_ms": 10.0, "p99_ms": 20.0, "db_calls": 3.0, "errors": 0}
+    return {"scenarios": {name: {**base, **values} for name, values in scenarios.items()}}
+
+
+def test_compare_flags_regressions():
+    """compare marca latencia peor que el umbral, más comandos MongoDB y errores nuevos."""
+    base = _result(search={}, threads={}, stats={}, profile={})
+    current = _result(
+        search={"p50_ms": 13.0},       # +30 %
+        threads={"db_calls": 4.0},     # una consulta más
+        stats={"errors": 2},
+        profile={"p99_ms": 22.0},      # +10 %: dentro del umbral
+    )
+    regressions = compare(base, current, threshold=0.2, min_delta_ms=1.0)
+    assert len(regressions) == 3
+    assert any(r.startswith("search: p50_ms") for r in regressions)
+    assert any(r.startswith("threads: comandos") for r in regressions)
+    assert any(r.startswith("stats: errores") for r in regressions)
+
+
+def test_compare_ignores_noise_below_min_delta():
+    """Un +50 % en una ruta de 1 ms no es regresión si no supera la diferencia mínima."""
+    base = _result(fast={"p50_ms": 1.0, "p99_ms": 1.0})
+    current = _result(fast={"p50_ms": 1.5, "p99_ms": 1.5})
+    assert compare(base, current, threshold=0.2, min_delta_ms=1.0) == []
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 3.0
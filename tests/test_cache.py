@@ -0,0 +1,104 @@
+"""
+Tests de la caché en proceso y de la caché del usuario autenticado (sin base de datos)
+"""
+import pytest
+from bson import ObjectId
+
+from app.cache import TTLCache
+
+
+def test_ttl_cache_expires_entries():
+    """Las entradas caducan pasado el TTL"""
+    now = [0.0]
+    cache = TTLCache("test", maxsize=10, ttl=5, clock=lambda: now[0])
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    now[0] += 5
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_is_bounded_lru():
+    """Al superar maxsize se expulsa la entrada menos usada"""
+    cache = TTLCache("test", maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.hits == 3 and cache.misses == 1
+    assert cache.hit_rate() == pytest.approx(0.75)
+
+
+class FakeUsers:
+    def __init__(self, doc):
+        self.doc = doc
+        self.calls = 0
+        self.projection = None
+
+    async def find_one(self, query, projection=None):
+        self.calls += 1
+        self.projection = projection
+        return self.doc
+
+
+class FakeDB:
+    def __init__(self, doc):
+        self.users = FakeUsers(doc)
+
+
+async def test_get_current_user_is_cached_and_invalidated():
+    """El usuario se lee una vez, sin password_hash, y se invalida tras escribir"""
+    from app.security import get_current_user, invalidate_user
+
+    oid = ObjectId()
+    db = FakeDB({"_id": oid, "name": "Ana", "is_caretaker": True})
+
+    first = await get_current_user(db=db, user_id=str(oid))
+    second = await get_current_user(db=db, user_id=str(oid))
+    assert first == second == {"id": str(oid), "name": "Ana", "is_caretaker": True}
+    assert db.users.calls == 1
+    assert db.users.projection["password_hash"] == 0
+
+    # Mutar el resultado no altera la caché
+    second["name"] = "Otra"
+    invalidate_user(oid)
+    third = await get_current_user(db=db, user_id=str(oid))
+    assert third["name"] == "Ana"
+    assert db.users.calls == 2
+
+
+def test_verify_token_caches_claims_until_exp(monkeypatch):
+    """Un token válido se verifica una vez; la entrada no dura más que su exp"""
+    from app import security
+
+    security._token_cache.clear()
+    calls = []
+    real_decode = security.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(1)
+        return real_decode(*args, **kwargs)
+
+    monkeypatch.setattr(security.jwt, "decode", counting_decode)
+    token = security.create_access_token("abc", expires_hours=1)
+
+    assert security.user_id_from_token(token) == "abc"
+    assert security.user_id_from_token(token) == "abc"
+    assert len(calls) == 1
+
+    expires_at, _ = next(iter(security._token_cache._data.values()))
+    assert expires_at - security._token_cache._clock() <= 3600
+
+
+def test_verify_token_rejects_invalid_tokens():
+    """Los tokens inválidos no se cachean y devuelven None"""
+    from app import security
+
+    security._token_cache.clear()
+    assert security.user_id_from_token("no-es-un-jwt") is None
+    assert security.user_id_from_token(security.create_access_token("abc", expires_hours=-1)) is None
+    assert len(security._token_cache) == 0
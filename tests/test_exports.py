@@ -0,0 +1,111 @@
+"""
+Tests de las exportaciones en streaming (app/exports.py).
+Los del cursor falso no requieren MongoDB; el de reservas sí.
+"""
+import json
+from datetime import date, datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app import exports
+from app.routers.bookings import EXPORT_COLUMNS as BOOKING_COLUMNS
+
+COLUMNS = ("id", "amount", "status", "created_at")
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+    async def close(self):
+        self.closed = True
+
+
+def _docs(n):
+    return [
+        {"_id": ObjectId(), "amount": 10.5, "status": "completed", "created_at": datetime(2026, 1, 1, 12, 0, i)}
+        for i in range(n)
+    ]
+
+
+async def _collect(cursor, fmt, batch_size=2):
+    return [chunk async for chunk in exports.stream(cursor, COLUMNS, fmt, "test", batch_size)]
+
+
+def test_projection_only_exported_columns():
+    assert exports.projection(COLUMNS) == {"amount": 1, "status": 1, "created_at": 1}
+    assert exports.projection(("amount",)) == {"_id": 0, "amount": 1}
+
+
+def test_date_range_is_inclusive_and_bounded():
+    start, end = exports.date_range(date(2026, 1, 1), date(2026, 1, 31), max_days=366)
+    assert (start, end) == (datetime(2026, 1, 1), datetime(2026, 2, 1))
+    start, end = exports.date_range(None, date(2026, 12, 31), max_days=365)
+    assert start == datetime(2026, 1, 1)
+    with pytest.raises(HTTPException):
+        exports.date_range(date(2026, 2, 1), date(2026, 1, 1), max_days=366)
+    with pytest.raises(HTTPException):
+        exports.date_range(date(2024, 1, 1), date(2026, 1, 1), max_days=366)
+
+
+async def test_csv_streams_one_chunk_per_batch():
+    """Cabecera y luego un trozo por lote; el cursor se cierra al terminar."""
+    docs = _docs(5)
+    cursor = FakeCursor(docs)
+    chunks = await _collect(cursor, "csv")
+    assert len(chunks) == 1 + 3  # cabecera + lotes de 2, 2 y 1
+    lines = b"".join(chunks).decode().splitlines()
+    assert lines[0] == "id,amount,status,created_at"
+    assert lines[1] == f"{docs[0]['_id']},10.5,completed,2026-01-01T12:00:00"
+    assert len(lines) == 6 and cursor.closed
+
+
+async def test_ndjson_rows_are_objects():
+    docs = _docs(3)
+    chunks = await _collect(FakeCursor(docs), "ndjson")
+    rows = [json.loads(line) for line in b"".join(chunks).splitlines()]
+    assert rows[2] == {"id": str(docs[2]["_id"]), "amount": 10.5, "status": "completed", "created_at": "2026-01-01T12:00:02"}
+
+
+async def test_cursor_closed_when_client_disconnects():
+    """Si la descarga se corta a medias, el cursor no queda abierto en el servidor."""
+    cursor = FakeCursor(_docs(10))
+    gen = exports.stream(cursor, COLUMNS, "csv", "test", 2)
+    await gen.__anext__()
+    await gen.__anext__()
+    await gen.aclose()
+    assert cursor.closed
+
+
+def test_booking_export_streams_csv(client, clean_db):
+    """El export de reservas incluye las del rango, sólo con las columnas exportadas."""
+    from tests.test_ledger import _signup_and_login
+
+    caretaker_id, ct_auth = _signup_and_login(client, "ct@example.com", is_caretaker=True)
+    _, owner_auth = _signup_and_login(client, "owner@example.com")
+    service_id = client.post("/services", headers=ct_auth, json={"type": "walking", "price": 10}).json()["id"]
+    pet_id = client.post("/pets", headers=owner_auth, json={"name": "Luna"}).json()["id"]
+    start = datetime.utcnow() + timedelta(days=1)
+    client.post("/bookings", headers=owner_auth, json={
+        "caretaker_id": caretaker_id, "service_id": service_id, "pet_id": pet_id,
+        "start": start.isoformat(), "end": (start + timedelta(hours=1)).isoformat(),
+    })
+
+    day = start.date().isoformat()
+    resp = client.get(f"/bookings/export?role=caretaker&from={day}&to={day}", headers=ct_auth)
+    assert resp.status_code == 200 and resp.headers["content-type"].startswith("text/csv")
+    lines = resp.text.splitlines()
+    assert lines[0] == ",".join(BOOKING_COLUMNS) and len(lines) == 2
+
+    resp = client.get(f"/bookings/export?format=ndjson&role=owner&from={day}&to={day}", headers=ct_auth)
+    assert resp.text == ""
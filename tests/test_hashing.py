@@ -0,0 +1,56 @@
+"""
+Tests del hash de contraseñas fuera del event loop (no requieren MongoDB)
+"""
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.hashing import HASH_DURATION, HASH_REJECTED, PasswordHasher
+from app.metrics import Histogram
+
+
+async def test_hash_and_verify_run_in_pool():
+    """hash/verify funcionan y registran el tiempo de hash"""
+    hasher = PasswordHasher(workers=1, max_pending=4)
+    before = HASH_DURATION.count(op="hash")
+
+    hashed = await hasher.hash("abc12345")
+
+    assert await hasher.verify("abc12345", hashed)
+    assert not await hasher.verify("otra", hashed)
+    assert HASH_DURATION.count(op="hash") == before + 1
+    assert hasher.pending == 0
+
+
+async def test_full_queue_returns_503_with_retry_after(monkeypatch):
+    """Con la cola llena se rechaza enseguida con 503 y Retry-After"""
+    release = threading.Event()
+    monkeypatch.setattr("app.hashing.hash_password", lambda plain: release.wait(5) and "hash")
+    hasher = PasswordHasher(workers=1, max_pending=2, retry_after=3)
+    before = HASH_REJECTED.value(op="hash")
+
+    running = [asyncio.create_task(hasher.hash("x")) for _ in range(2)]
+    await asyncio.sleep(0)
+    with pytest.raises(HTTPException) as exc:
+        await hasher.hash("x")
+
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "3"
+    assert HASH_REJECTED.value(op="hash") == before + 1
+
+    release.set()
+    assert await asyncio.gather(*running) == ["hash", "hash"]
+    assert hasher.pending == 0
+
+
+def test_histogram_buckets_and_quantile():
+    """El histograma acumula por bucket y estima cuantiles"""
+    h = Histogram("test_histogram_seconds", "test", buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 2.0):
+        h.observe(v)
+
+    assert h.cumulative() == [(0.1, 2), (1.0, 3), (float("inf"), 4)]
+    assert h.count() == 4 and h.sum() == pytest.approx(2.65)
+    assert 0.1 < h.quantile(0.7) <= 1.0
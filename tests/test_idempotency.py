@@ -0,0 +1,225 @@
+"""
+Tests de Idempotency-Key (app/idempotency.py).
+Los de la colección falsa no requieren MongoDB; el de reservas sí.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from pymongo.errors import AutoReconnect, DuplicateKeyError
+
+from app import idempotency
+
+IDENT = ("user_id", "route", "key")
+
+
+class FakeIdempotency:
+    """Colección `idempotency` en memoria con el índice único (user_id, route, key)."""
+
+    def __init__(self):
+        self.docs = {}
+        self.fail_updates = False
+
+    def _key(self, doc):
+        return tuple(doc[f] for f in IDENT)
+
+    def _matches(self, doc, query):
+        return all(doc.get(k) == v for k, v in query.items())
+
+    async def insert_one(self, doc):
+        if self._key(doc) in self.docs:
+            raise DuplicateKeyError("duplicado")
+        self.docs[self._key(doc)] = dict(doc)
+
+    async def find_one(self, query):
+        doc = self.docs.get(self._key(query))
+        return dict(doc) if doc and self._matches(doc, query) else None
+
+    async def find_one_and_update(self, query, update, return_document=None):
+        doc = self.docs.get(self._key(query))
+        if not doc or not self._matches(doc, query):
+            return None
+        doc.update(update["$set"])
+        return dict(doc)
+
+    async def update_one(self, query, update):
+        if self.fail_updates:
+            raise AutoReconnect("primario no disponible")
+        doc = self.docs.get(self._key(query))
+        if not doc or not self._matches(doc, query):
+            return
+        doc.update(update["$set"])
+        for field in update.get("$unset", {}):
+            doc.pop(field, None)
+
+    async def delete_one(self, query):
+        doc = self.docs.get(self._key(query))
+        if doc and self._matches(doc, query):
+            del self.docs[self._key(query)]
+
+
+class FakeDB:
+    def __init__(self):
+        self.idempotency = FakeIdempotency()
+
+
+class Item(BaseModel):
+    name: str
+
+
+class ItemOut(BaseModel):
+    id: int
+    name: str
+
+
+def _app(db, fail_first=None):
+    """App mínima: cada ejecución real del handler crea un id nuevo."""
+    app = FastAPI()
+    calls = []
+
+    async def create(payload: Item):
+        calls.append(payload.name)
+        if fail_first and len(calls) == 1:
+            raise HTTPException(fail_first, "no se pudo crear")
+        # Campos de más: la respuesta guardada debe filtrarse como la de FastAPI
+        return {"id": len(calls), "name": payload.name, "secret": "x"}
+
+    @app.post("/items", response_model=ItemOut, status_code=status.HTTP_201_CREATED)
+    async def post_item(request: Request, payload: Item):
+        return await idempotency.execute(request, db, "u1", payload, lambda: create(payload), status_code=201)
+
+    return TestClient(app), calls
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    idempotency._completed.clear()
+    yield
+    idempotency._completed.clear()
+
+
+def test_retry_replays_stored_response():
+    """El reintento con la misma clave devuelve la respuesta guardada sin volver a ejecutar."""
+    db = FakeDB()
+    client, calls = _app(db)
+    headers = {"Idempotency-Key": "abc"}
+
+    first = client.post("/items", json={"name": "a"}, headers=headers)
+    assert first.status_code == 201 and first.json() == {"id": 1, "name": "a"}
+
+    again = client.post("/items", json={"name": "a"}, headers=headers)
+    assert again.status_code == 201 and again.json() == first.json()
+    assert again.headers["Idempotent-Replayed"] == "true"
+
+    # Sin caché en proceso (otro worker) se reproduce desde la colección
+    idempotency._completed.clear()
+    assert client.post("/items", json={"name": "a"}, headers=headers).json() == first.json()
+    assert calls == ["a"]
+
+    # Sin cabecera no hay deduplicación
+    assert client.post("/items", json={"name": "a"}).json()["id"] == 2
+
+
+def test_key_reused_with_other_body_is_rejected():
+    """Misma clave con otro cuerpo es un error del cliente (422), también desde la colección."""
+    db = FakeDB()
+    client, calls = _app(db)
+    client.post("/items", json={"name": "a"}, headers={"Idempotency-Key": "abc"})
+
+    assert client.post("/items", json={"name": "b"}, headers={"Idempotency-Key": "abc"}).status_code == 422
+    idempotency._completed.clear()
+    assert client.post("/items", json={"name": "b"}, headers={"Idempotency-Key": "abc"}).status_code == 422
+    assert calls == ["a"]
+
+
+def test_in_flight_key_is_never_run_twice():
+    """Una clave en curso responde 409; si su lock caducó (worker caído) su resultado es desconocido y no se repite."""
+    db = FakeDB()
+    client, calls = _app(db)
+    route = "POST /items"
+    fp = idempotency.fingerprint(Item(name="a"))
+    doc = {
+        "user_id": "u1", "route": route, "key": "abc", "fingerprint": fp, "state": "processing",
+        "locked_until": datetime.utcnow() + timedelta(seconds=30),
+    }
+    db.idempotency.docs[("u1", route, "abc")] = dict(doc)
+
+    resp = client.post("/items", json={"name": "a"}, headers={"Idempotency-Key": "abc"})
+    assert resp.status_code == 409 and resp.headers["Retry-After"] == "1"
+    assert calls == []
+
+    db.idempotency.docs[("u1", route, "abc")]["locked_until"] = datetime.utcnow() - timedelta(seconds=1)
+    resp = client.post("/items", json={"name": "a"}, headers={"Idempotency-Key": "abc"})
+    assert resp.status_code == 409 and "otra clave" in resp.json()["detail"]
+    assert calls == [] and db.idempotency.docs[("u1", route, "abc")]["state"] == "unknown"
+
+
+def test_rejected_request_releases_key():
+    """Un 4xx del handler no escribió nada: se libera la clave y el reintento se ejecuta."""
+    db = FakeDB()
+    client, calls = _app(db, fail_first=400)
+    headers = {"Idempotency-Key": "abc"}
+
+    assert client.post("/items", json={"name": "a"}, headers=headers).status_code == 400
+    assert db.idempotency.docs == {}
+    resp = client.post("/items", json={"name": "a"}, headers=headers)
+    assert resp.status_code == 201 and calls == ["a", "a"]
+
+
+def test_server_error_keeps_key_unknown():
+    """Tras un 5xx puede que el efecto ya esté escrito: el reintento no vuelve a ejecutarse."""
+    db = FakeDB()
+    client, calls = _app(db, fail_first=503)
+    headers = {"Idempotency-Key": "abc"}
+
+    assert client.post("/items", json={"name": "a"}, headers=headers).status_code == 503
+    assert client.post("/items", json={"name": "a"}, headers=headers).status_code == 409
+    assert calls == ["a"]
+
+
+def test_unsaved_response_is_not_run_twice():
+    """Si falla guardar la respuesta el recurso ya existe: se devuelve y un reintento no lo duplica."""
+    db = FakeDB()
+    client, calls = _app(db)
+    headers = {"Idempotency-Key": "abc"}
+
+    db.idempotency.fail_updates = True
+    first = client.post("/items", json={"name": "a"}, headers=headers)
+    assert first.status_code == 201 and first.json() == {"id": 1, "name": "a"}
+
+    # Otro worker (sin caché) con el lock ya caducado
+    db.idempotency.fail_updates = False
+    idempotency._completed.clear()
+    db.idempotency.docs[("u1", "POST /items", "abc")]["locked_until"] = datetime.utcnow() - timedelta(seconds=1)
+    assert client.post("/items", json={"name": "a"}, headers=headers).status_code == 409
+    assert calls == ["a"]
+
+
+def test_invalid_key_is_rejected():
+    client, calls = _app(FakeDB())
+    assert client.post("/items", json={"name": "a"}, headers={"Idempotency-Key": "x" * 256}).status_code == 400
+    assert calls == []
+
+
+def test_booking_retry_creates_one_booking(client, clean_db):
+    """Reintentar POST /bookings con la misma clave no duplica la reserva."""
+    from tests.test_ledger import _signup_and_login
+
+    caretaker_id, ct_auth = _signup_and_login(client, "ct@example.com", is_caretaker=True)
+    _, owner_auth = _signup_and_login(client, "owner@example.com")
+    service_id = client.post("/services", headers=ct_auth, json={"type": "walking", "price": 10}).json()["id"]
+    pet_id = client.post("/pets", headers=owner_auth, json={"name": "Luna"}).json()["id"]
+    start = datetime.utcnow() + timedelta(days=1)
+    body = {
+        "caretaker_id": caretaker_id, "service_id": service_id, "pet_id": pet_id,
+        "start": start.isoformat(), "end": (start + timedelta(hours=1)).isoformat(),
+    }
+    headers = {**owner_auth, "Idempotency-Key": "booking-1"}
+
+    first = client.post("/bookings", headers=headers, json=body)
+    again = client.post("/bookings", headers=headers, json=body)
+    assert first.status_code == again.status_code == 201
+    assert again.json()["id"] == first.json()["id"]
+    assert len(client.get("/bookings/mine", headers=owner_auth).json()) == 1
@@ -0,0 +1,199 @@
+"""
+Tests del libro de ganancias por cuidador (app/ledger.py).
+Los de `delta`/`to_stats` y los de la serie con colección falsa no requieren
+MongoDB; el resto sí.
+"""
+from datetime import date, datetime, timedelta
+
+from bson import ObjectId
+from fastapi import status
+
+from app import ledger
+
+PAYMENT = {"caretaker_payout": 85.0, "platform_fee": 15.0}
+
+
+def test_delta_moves_amount_between_buckets():
+    """Cada transición resta del cubo de origen y suma en el de destino."""
+    assert ledger.delta(PAYMENT, None, "pending") == {"pending_cents": 8500, "pending_count": 1}
+    assert ledger.delta(PAYMENT, "pending", "completed") == {
+        "pending_cents": -8500, "pending_count": -1,
+        "earned_cents": 8500, "platform_fee_cents": 1500, "completed_count": 1,
+    }
+    assert ledger.delta(PAYMENT, "completed", "refunded") == {
+        "earned_cents": -8500, "platform_fee_cents": -1500, "completed_count": -1,
+        "refunded_cents": 8500, "refunded_count": 1,
+    }
+    # pending -> processing no cambia nada; failed no cuenta
+    assert ledger.delta(PAYMENT, "pending", "processing") == {}
+    assert ledger.delta(PAYMENT, "processing", "failed") == {"pending_cents": -8500, "pending_count": -1}
+
+
+def test_to_stats_shape():
+    """La respuesta de estadísticas sale del documento del libro (en euros)."""
+    assert ledger.to_stats(None) == {
+        "total_earnings": 0, "total_payments": 0, "total_platform_fee": 0,
+        "pending_earnings": 0, "pending_count": 0,
+    }
+    stats = ledger.to_stats({"earned_cents": 12345, "completed_count": 3, "platform_fee_cents": 2179, "pending_cents": 850, "pending_count": 1})
+    assert stats["total_earnings"] == 123.45 and stats["total_platform_fee"] == 21.79
+    assert stats["pending_earnings"] == 8.5 and stats["pending_count"] == 1
+
+
+def test_merge_buckets_by_week_and_month():
+    """Los días se suman por semana (desde el lunes) o mes, y los periodos vacíos salen a cero."""
+    daily = [
+        {"day": "2026-03-02", "gross_cents": 10000, "payout_cents": 8500, "fee_cents": 1500, "bookings": 1},
+        {"day": "2026-03-08", "gross_cents": 2000, "payout_cents": 1700, "fee_cents": 300, "bookings": 1},
+        {"day": "2026-03-09", "gross_cents": 1000, "payout_cents": 850, "fee_cents": 150, "bookings": 1},
+        {"day": "2026-05-20", "gross_cents": 500, "payout_cents": 425, "fee_cents": 75, "bookings": 1},
+    ]
+    weeks = ledger.merge_buckets(daily, "week", date(2026, 3, 4), date(2026, 3, 20))
+    assert [w["start"] for w in weeks] == ["2026-03-02", "2026-03-09", "2026-03-16"]
+    assert [w["bookings"] for w in weeks] == [2, 1, 0]
+    assert weeks[0]["payout"] == 102.0
+
+    months = ledger.merge_buckets(daily, "month", date(2026, 1, 15), date(2026, 5, 31))
+    assert [m["start"] for m in months] == ["2026-01-01", "2026-02-01", "2026-03-01", "2026-04-01", "2026-05-01"]
+    assert [m["gross"] for m in months] == [0, 0, 130.0, 0, 5.0]
+
+    days = ledger.merge_buckets(daily, "day", date(2026, 3, 8), date(2026, 3, 9))
+    assert [d["fee"] for d in days] == [3.0, 1.5]
+
+
+class FakeDaily:
+    """`caretaker_daily` en memoria: sólo el filtro por rango de días."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        days = query["day"]
+        matched = [d for d in self.docs if days["$gte"] <= d["day"] <= days["$lte"]]
+
+        class Cursor:
+            async def to_list(self, n):
+                return matched[:n]
+
+        return Cursor()
+
+
+async def test_timeseries_first_bucket_covers_whole_period():
+    """Con un from a mitad de semana, la primera semana suma también sus días anteriores."""
+    daily = [
+        {"day": "2026-03-02", "gross_cents": 10000, "payout_cents": 8500, "fee_cents": 1500, "bookings": 1},
+        {"day": "2026-03-05", "gross_cents": 2000, "payout_cents": 1700, "fee_cents": 300, "bookings": 1},
+    ]
+
+    class DB:
+        caretaker_daily = FakeDaily(daily)
+
+    series = await ledger.timeseries(DB(), ObjectId(), "week", date(2026, 3, 4), date(2026, 3, 10))
+    assert series["from"] == "2026-03-02"
+    assert [p["start"] for p in series["points"]] == ["2026-03-02", "2026-03-09"]
+    assert series["points"][0]["bookings"] == 2 and series["points"][0]["gross"] == 120.0
+
+
+def _signup_and_login(client, email, **extra):
+    resp = client.post("/auth/signup", json={
+        "name": email.split("@")[0], "email": email, "password": "password123", "city": "Madrid", **extra,
+    })
+    assert resp.status_code == status.HTTP_201_CREATED
+    token = client.post("/auth/login", json={"email": email, "password": "password123"}).json()["access_token"]
+    return resp.json()["id"], {"Authorization": f"Bearer {token}"}
+
+
+def test_stats_follow_payment_lifecycle(client, clean_db, monkeypatch):
+    """Crear, procesar y reembolsar un pago actualiza las estadísticas del cuidador."""
+    from app.payment_processor import MockProvider, processor
+
+    # Sin lifespan no hay workers: el cobro se hace en la propia petición, sin fallos simulados
+    monkeypatch.setattr(processor, "provider", MockProvider(latency=0))
+    caretaker_id, ct_auth = _signup_and_login(client, "ct@example.com", is_caretaker=True)
+    _, owner_auth = _signup_and_login(client, "owner@example.com")
+    service_id = client.post("/services", headers=ct_auth, json={"type": "walking", "price": 100}).json()["id"]
+    pet_id = client.post("/pets", headers=owner_auth, json={"name": "Luna"}).json()["id"]
+    start = datetime.utcnow() + timedelta(days=1)
+    booking_id = client.post("/bookings", headers=owner_auth, json={
+        "caretaker_id": caretaker_id, "service_id": service_id, "pet_id": pet_id,
+        "start": start.isoformat(), "end": (start + timedelta(hours=1)).isoformat(),
+    }).json()["id"]
+    client.patch(f"/bookings/{booking_id}/status", headers=ct_auth, json={"status": "accepted"})
+
+    payment = client.post("/payments", headers=owner_auth, json={"booking_id": booking_id, "amount": 100}).json()
+    stats = client.get("/payments/caretaker/stats", headers=ct_auth).json()
+    assert stats["pending_count"] == 1 and stats["pending_earnings"] == 85.0
+
+    resp = client.post(f"/payments/{payment['id']}/process", headers=owner_auth)
+    assert resp.status_code == 202 and resp.json()["status"] == "completed"
+    stats = client.get("/payments/caretaker/stats", headers=ct_auth).json()
+    assert stats == {"total_earnings": 85.0, "total_payments": 1, "total_platform_fee": 15.0, "pending_earnings": 0, "pending_count": 0}
+    series = client.get("/payments/caretaker/timeseries?granularity=week", headers=ct_auth).json()
+    assert series["totals"] == {"gross": 100.0, "payout": 85.0, "fee": 15.0, "bookings": 1}
+    assert len(series["points"]) == 13
+
+    # Procesar dos veces no cuenta dos veces
+    assert client.post(f"/payments/{payment['id']}/process", headers=owner_auth).status_code == 400
+
+    assert client.post(f"/payments/{payment['id']}/refund", headers=owner_auth).status_code == 200
+    stats = client.get("/payments/caretaker/stats", headers=ct_auth).json()
+    assert stats["total_earnings"] == 0 and stats["total_payments"] == 0
+    series = client.get("/payments/caretaker/timeseries", headers=ct_auth).json()
+    assert series["totals"]["bookings"] == 0
+
+
+def test_timeseries_validates_range(client, clean_db):
+    """El rango está acotado: la respuesta no crece con el historial."""
+    _, ct_auth = _signup_and_login(client, "ct@example.com", is_caretaker=True)
+    resp = client.get("/payments/caretaker/timeseries?from=2020-01-01&to=2026-01-01", headers=ct_auth)
+    assert resp.status_code == 400
+    resp = client.get("/payments/caretaker/timeseries?granularity=month&from=2025-01-01&to=2025-12-31", headers=ct_auth)
+    assert resp.status_code == 200 and len(resp.json()["points"]) == 12
+
+
+async def test_reconcile_fixes_drift(clean_db):
+    """La reconciliación detecta y corrige un libro desfasado o ausente."""
+    db = clean_db
+    drifted, missing = ObjectId(), ObjectId()
+    payments = [
+        {"caretaker_id": drifted, "status": "completed", "caretaker_payout": 85.0, "platform_fee": 15.0},
+        {"caretaker_id": drifted, "status": "pending", "caretaker_payout": 42.5, "platform_fee": 7.5},
+        {"caretaker_id": missing, "status": "completed", "caretaker_payout": 17.0, "platform_fee": 3.0},
+    ]
+    await db.payments.insert_many(payments)
+    for p in payments[:2]:
+        await ledger.record(db, p, None, p["status"])
+    # Un $inc que se perdió
+    await db.caretaker_ledger.update_one({"_id": drifted}, {"$inc": {"earned_cents": -100}})
+
+    report = await ledger.reconcile(db, fix=True, settle=0)
+    assert {r["caretaker_id"] for r in report} == {str(drifted), str(missing)}
+    assert all(r["fixed"] for r in report)
+    assert ledger.to_stats(await db.caretaker_ledger.find_one({"_id": drifted}))["total_earnings"] == 85.0
+    assert (await ledger.get_stats(db, missing))["total_payments"] == 1
+    assert await ledger.reconcile(db, fix=True, settle=0) == []
+
+
+async def test_backfill_daily_matches_incremental(clean_db):
+    """El backfill por agregación da los mismos acumulados diarios que los $inc."""
+    db = clean_db
+    await db.caretaker_daily.create_index([("caretaker_id", 1), ("day", 1)], unique=True)
+    caretaker = ObjectId()
+    day1, day2 = datetime(2026, 3, 2, 10), datetime(2026, 3, 3, 18)
+    payments = [
+        {"caretaker_id": caretaker, "status": "completed", "amount": 100.0, "caretaker_payout": 85.0, "platform_fee": 15.0, "completed_at": day1},
+        {"caretaker_id": caretaker, "status": "completed", "amount": 20.0, "caretaker_payout": 17.0, "platform_fee": 3.0, "completed_at": day1},
+        {"caretaker_id": caretaker, "status": "refunded", "amount": 50.0, "caretaker_payout": 42.5, "platform_fee": 7.5, "completed_at": day2},
+    ]
+    await db.payments.insert_many(payments)
+    for p in payments:
+        await ledger.record(db, p, None, "completed")
+    await ledger.record(db, payments[2], "completed", "refunded")
+
+    fields = {"_id": 0, "rebuilt_at": 0}
+    incremental = await db.caretaker_daily.find({}, fields).sort("day", 1).to_list(None)
+    assert await ledger.backfill_daily(db) == 1
+    rebuilt = await db.caretaker_daily.find({}, fields).sort("day", 1).to_list(None)
+    # El día del reembolso queda a cero en incremental y desaparece en el backfill
+    assert [d for d in incremental if d["bookings"]] == rebuilt
+    assert rebuilt[0]["payout_cents"] == 10200 and rebuilt[0]["bookings"] == 2
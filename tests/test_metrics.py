@@ -0,0 +1,109 @@
+"""
+Tests de la instrumentación HTTP y del endpoint /metrics (no requieren MongoDB)
+"""
+import httpx
+from fastapi import FastAPI
+
+from app import dbstats
+from app.metrics import Counter, Gauge, Histogram, Registry, export, merge, render_prometheus
+from app.middleware.instrumentation import HTTP_DURATION, HTTP_REQUESTS, InstrumentationMiddleware
+
+
+def test_render_prometheus_text_format():
+    """Contadores, gauges e histogramas en formato de texto de Prometheus"""
+    registry = Registry()
+    requests = Counter("t_requests_total", "Peticiones", ["route"])
+    depth = Gauge("t_depth", "Profundidad")
+    latency = Histogram("t_latency_seconds", "Latencia", buckets=(0.1, 1.0))
+    for metric in (requests, depth, latency):
+        registry.register(metric)
+    requests.inc(route='/a"b')
+    depth.set(3)
+    latency.observe(0.05)
+    latency.observe(2)
+
+    text = render_prometheus(export(registry))
+
+    assert "# TYPE t_requests_total counter" in text
+    assert 't_requests_total{route="/a\\"b"} 1' in text
+    assert "t_depth 3" in text
+    assert 't_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 't_latency_seconds_bucket{le="+Inf"} 2' in text
+    assert "t_latency_seconds_count 2" in text
+
+
+def test_merge_sums_counters_and_labels_gauges():
+    """Al combinar workers los contadores se suman y los gauges llevan label worker"""
+    registry = Registry()
+    c = Counter("t_merge_total", "x")
+    g = Gauge("t_merge_gauge", "x")
+    registry.register(c)
+    registry.register(g)
+    c.inc(2)
+    g.set(5)
+
+    families = {f["name"]: f for f in merge({"w1": export(registry), "w2": export(registry)})}
+
+    assert families["t_merge_total"]["series"] == [[[], 4.0]]
+    assert families["t_merge_gauge"]["labelnames"] == ["worker"]
+    assert len(families["t_merge_gauge"]["series"]) == 2
+
+
+async def test_middleware_records_route_template_and_db_time():
+    """Se mide por plantilla de ruta y se suma el tiempo en MongoDB de la petición"""
+    app = FastAPI()
+    app.add_middleware(InstrumentationMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        dbstats.current().record("find", 0.002)
+        return {"id": item_id}
+
+    before = HTTP_REQUESTS.value(method="GET", route="/items/{item_id}", status=200)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.get("/items/1")
+        await client.get("/items/2")
+        await client.get("/nope")
+
+    assert HTTP_REQUESTS.value(method="GET", route="/items/{item_id}", status=200) == before + 2
+    assert HTTP_REQUESTS.value(method="GET", route="<unmatched>", status=404) >= 1
+    assert HTTP_DURATION.count(method="GET", route="/items/{item_id}", status=200) >= 2
+
+
+async def test_server_timing_and_max_db_calls(max_db_calls):
+    """En dev se añade Server-Timing y el fixture detecta peticiones con demasiadas consultas"""
+    import pytest
+
+    app = FastAPI()
+    app.add_middleware(InstrumentationMiddleware, server_timing=True)
+
+    @app.get("/n-plus-one")
+    async def n_plus_one():
+        for _ in range(5):
+            dbstats.current().record("find", 0.001)
+        return {}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        with max_db_calls(5) as seen:
+            r = await client.get("/n-plus-one")
+        assert seen == [("GET", "/n-plus-one", 5)]
+        assert r.headers["server-timing"].startswith('db;dur=5.0;desc="5 comandos"')
+
+        with pytest.raises(AssertionError):
+            with max_db_calls(2):
+                await client.get("/n-plus-one")
+
+
+def test_db_stats_record_from_several_threads():
+    """El listener corre en los hilos de Motor: registros simultáneos no se pierden"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    stats = dbstats.RequestDbStats()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for _ in range(8):
+            pool.submit(lambda: [stats.record("find", 0.001) for _ in range(2000)])
+
+    assert stats.commands == 16000
+    assert stats.by_command["find"][0] == 16000
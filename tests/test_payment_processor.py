@@ -0,0 +1,249 @@
+"""
+Tests del procesamiento asíncrono de pagos (app/payment_processor.py) con una
+colección de pagos falsa (no requieren MongoDB).
+"""
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from app.payment_processor import (
+    MockProvider,
+    PaymentProcessor,
+    ProviderUnavailable,
+    apply_event,
+    backoff_delay,
+    sign,
+    verify,
+)
+
+
+def _matches(doc, query):
+    for field, cond in query.items():
+        value = doc.get(field)
+        if isinstance(cond, dict) and "$lte" in cond:
+            if value is None or value > cond["$lte"]:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, n):
+        return self.docs[:n]
+
+
+class FakePayments:
+    def __init__(self, docs):
+        self.docs = {d["_id"]: d for d in docs}
+
+    async def find_one(self, query):
+        return next((dict(d) for d in self.docs.values() if _matches(d, query)), None)
+
+    def find(self, query, projection=None):
+        return FakeCursor([{"_id": d["_id"]} for d in self.docs.values() if _matches(d, query)])
+
+    async def find_one_and_update(self, query, update, return_document=None):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                self._apply(doc, update)
+                return dict(doc)
+        return None
+
+    async def update_one(self, query, update):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                self._apply(doc, update)
+                return
+
+    def _apply(self, doc, update):
+        doc.update(update.get("$set", {}))
+        for field, amount in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + amount
+        for field in update.get("$unset", {}):
+            doc.pop(field, None)
+
+
+class FakeLedger:
+    def __init__(self):
+        self.incs = []
+
+    async def update_one(self, query, update, upsert=False):
+        self.incs.append(update["$inc"])
+
+
+class FakeDB:
+    def __init__(self, payment):
+        self.payments = FakePayments([payment])
+        self.caretaker_ledger = FakeLedger()
+        self.caretaker_daily = FakeLedger()
+
+
+class FlakyProvider:
+    """Falla de forma transitoria las primeras `failures` veces."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    async def charge(self, payment, idempotency_key):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ProviderUnavailable("503")
+        return {"type": "payment.succeeded", "data": {"payment_id": idempotency_key, "transaction_id": "txn_1"}}
+
+
+def _payment():
+    return {
+        "_id": ObjectId(), "owner_id": ObjectId(), "caretaker_id": ObjectId(), "booking_id": ObjectId(),
+        "status": "processing", "attempts": 0, "next_attempt_at": datetime.utcnow(),
+        "caretaker_payout": 85.0, "platform_fee": 15.0,
+    }
+
+
+def _due(db, payment_id):
+    db.payments.docs[payment_id]["next_attempt_at"] = datetime.utcnow() - timedelta(seconds=1)
+
+
+def test_backoff_delay_grows_and_is_capped():
+    """Entre la mitad y el total de base·2^(n-1), nunca por encima del tope."""
+    low, high = (lambda a, b: a), (lambda a, b: b)
+    assert backoff_delay(1, 1.0, 60, rng=low) == 0.5
+    assert backoff_delay(3, 1.0, 60, rng=high) == 4.0
+    assert backoff_delay(20, 1.0, 60, rng=high) == 60
+    assert 30 <= backoff_delay(20, 1.0, 60) <= 60
+
+
+def test_webhook_signature():
+    body = json.dumps({"type": "payment.succeeded"}).encode()
+    signature = sign(body, "secreto")
+    assert verify(body, signature, "secreto")
+    assert not verify(body + b" ", signature, "secreto")
+    assert not verify(body, signature, "")  # sin secreto nunca es válida
+
+
+async def test_mock_provider_does_not_charge_twice():
+    """Reintentar con la misma clave devuelve el mismo cobro."""
+    provider = MockProvider(latency=0, rng=random.Random(1))
+    payment = {"_id": ObjectId()}
+    first = await provider.charge(payment, idempotency_key="k")
+    again = await provider.charge(payment, idempotency_key="k")
+    assert first["type"] == again["type"] == "payment.succeeded"
+    assert first["data"]["transaction_id"] == again["data"]["transaction_id"]
+
+    # La memoria de cobros está acotada
+    small = MockProvider(latency=0, max_charges=2)
+    for key in ("a", "b", "c"):
+        await small.charge(payment, idempotency_key=key)
+    assert len(small._charges) == 2
+
+    declined = await MockProvider(latency=0, decline_rate=1).charge(payment, idempotency_key="otra")
+    assert declined["type"] == "payment.failed" and declined["data"]["reason"] == "card_declined"
+    with pytest.raises(ProviderUnavailable):
+        await MockProvider(latency=0, failure_rate=1).charge(payment, idempotency_key="otra")
+
+
+async def test_transient_failures_are_retried_with_backoff():
+    """Un fallo transitorio aplaza el intento; al final el pago se completa y entra en el libro."""
+    payment = _payment()
+    db = FakeDB(payment)
+    processor = PaymentProcessor(lambda: db, FlakyProvider(failures=2), workers=0, retry_base=10)
+
+    await processor.attempt(db, payment["_id"])
+    doc = db.payments.docs[payment["_id"]]
+    assert doc["status"] == "processing" and doc["attempts"] == 1 and doc["last_error"] == "503"
+    assert doc["next_attempt_at"] > datetime.utcnow() + timedelta(seconds=4)
+
+    # Antes de tiempo no se intenta
+    await processor.attempt(db, payment["_id"])
+    assert processor.provider.calls == 1
+
+    _due(db, payment["_id"])
+    await processor.attempt(db, payment["_id"])
+    _due(db, payment["_id"])
+    await processor.attempt(db, payment["_id"])
+    doc = db.payments.docs[payment["_id"]]
+    assert doc["status"] == "completed" and doc["transaction_id"] == "txn_1" and doc["attempts"] == 3
+    assert "next_attempt_at" not in doc
+    assert db.caretaker_ledger.incs == [{
+        "pending_cents": -8500, "pending_count": -1,
+        "earned_cents": 8500, "platform_fee_cents": 1500, "completed_count": 1,
+    }]
+
+
+async def test_exhausted_attempts_fail_payment():
+    """Agotados los intentos el pago pasa a failed y sale de pendientes."""
+    payment = _payment()
+    db = FakeDB(payment)
+    processor = PaymentProcessor(lambda: db, FlakyProvider(failures=99), workers=0, max_attempts=2)
+
+    await processor.attempt(db, payment["_id"])
+    _due(db, payment["_id"])
+    await processor.attempt(db, payment["_id"])
+    doc = db.payments.docs[payment["_id"]]
+    assert doc["status"] == "failed" and doc["failure_reason"] == "provider_unavailable"
+    assert db.caretaker_ledger.incs == [{"pending_cents": -8500, "pending_count": -1}]
+
+
+async def test_submit_without_workers_retries_until_resolved():
+    """Sin workers no hay barrido: la propia petición reintenta y el pago no se queda en processing."""
+    payment = _payment()
+    db = FakeDB(payment)
+    processor = PaymentProcessor(lambda: db, FlakyProvider(failures=2), workers=0, retry_base=0.01)
+    await processor.submit(db, payment["_id"])
+    doc = db.payments.docs[payment["_id"]]
+    assert doc["status"] == "completed" and doc["attempts"] == 3 and processor.provider.calls == 3
+
+    payment = _payment()
+    db = FakeDB(payment)
+    processor = PaymentProcessor(lambda: db, FlakyProvider(failures=99), workers=0, max_attempts=3, retry_base=0.01)
+    await processor.submit(db, payment["_id"])
+    doc = db.payments.docs[payment["_id"]]
+    assert doc["status"] == "failed" and doc["failure_reason"] == "provider_unavailable"
+    assert processor.provider.calls == 3
+
+
+async def test_repeated_event_is_applied_once():
+    """Un webhook repetido no vuelve a contar en el libro."""
+    payment = _payment()
+    db = FakeDB(payment)
+    event = {"type": "payment.succeeded", "data": {"payment_id": str(payment["_id"]), "transaction_id": "t"}}
+    assert await apply_event(db, event) is True
+    assert await apply_event(db, event) is False
+    assert len(db.caretaker_ledger.incs) == 1
+    with pytest.raises(ValueError):
+        await apply_event(db, {"type": "payment.refunded", "data": {}})
+
+
+async def test_workers_process_submitted_payment():
+    """Con workers la petición sólo encola; el cobro termina en segundo plano."""
+    payment = _payment()
+    db = FakeDB(payment)
+
+    async def get_db():
+        return db
+
+    processor = PaymentProcessor(get_db, MockProvider(latency=0.01), workers=2, sweep_interval=60)
+    processor.start()
+    try:
+        await processor.submit(db, payment["_id"])
+        assert db.payments.docs[payment["_id"]]["status"] == "processing"
+        for _ in range(100):
+            if db.payments.docs[payment["_id"]]["status"] != "processing":
+                break
+            await asyncio.sleep(0.01)
+        assert db.payments.docs[payment["_id"]]["status"] == "completed"
+        assert processor.queued == 0
+    finally:
+        processor.stop()
@@ -0,0 +1,81 @@
+"""
+Tests del perfilador por muestreo, del seguimiento de memoria y del monitor
+de lag del event loop.
+No requieren MongoDB.
+"""
+import asyncio
+import threading
+import time
+
+from app.profiling import LOOP_STALLS, LoopLagMonitor, MemoryTracker, SamplingProfiler, profile_pstats
+
+
+def _busy(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def test_sampling_profiler_speedscope():
+    """El perfil en formato speedscope incluye la función que ocupa el loop."""
+    profiler = SamplingProfiler(threading.get_ident(), interval=0.002)
+    task = asyncio.create_task(profiler.run(0.2))
+    await asyncio.sleep(0.01)
+    _busy(0.15)
+    await task
+
+    data = profiler.speedscope()
+    profile = data["profiles"][0]
+    assert profile["type"] == "sampled"
+    assert len(profile["samples"]) == len(profile["weights"]) > 0
+    names = {frame["name"] for frame in data["shared"]["frames"]}
+    assert "_busy" in names
+    # Todos los índices apuntan a frames existentes
+    assert all(0 <= i < len(data["shared"]["frames"]) for s in profile["samples"] for i in s)
+
+
+async def test_profile_pstats_returns_report():
+    """profile_pstats devuelve el informe de pstats en texto."""
+    async def work():
+        await asyncio.sleep(0.01)
+        _busy(0.02)
+
+    task = asyncio.create_task(work())
+    report = await profile_pstats(0.1, sort="tottime", limit=10)
+    await task
+    assert "function calls" in report
+    assert "_busy" in report
+
+
+async def test_loop_lag_monitor_detects_stall():
+    """Un bloqueo del loop se refleja en el lag y cuenta como stall."""
+    monitor = LoopLagMonitor(interval=0.02, threshold=0.1, log_every=0)
+    before = LOOP_STALLS.value()
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)  # Bloquea el loop a propósito
+        await asyncio.sleep(0.05)
+    finally:
+        monitor.stop()
+    assert LOOP_STALLS.value() >= before + 1
+    assert monitor.percentile(1.0) >= 0.1
+    assert not monitor.running
+
+
+async def test_memory_tracker_attributes_growth():
+    """El diff contra la línea base señala la línea que retiene memoria."""
+    tracker = MemoryTracker()
+    assert not tracker.tracing
+    await tracker.start(frames=1)
+    try:
+        retained = [bytearray(1024) for _ in range(2000)]  # ~2 MB
+        report = await tracker.diff(limit=5)
+    finally:
+        tracker.stop()
+    assert not tracker.tracing
+    top = report["top"][0]
+    assert "test_profiling.py" in top["where"][0]
+    assert top["size_diff"] >= 2000 * 1024
+    assert top["count_diff"] >= 2000
+    assert len(retained) == 2000
@@ -0,0 +1,52 @@
+"""
+Tests de número máximo de consultas MongoDB por endpoint (detectan N+1)
+"""
+from fastapi import status
+
+
+def _signup_and_login(client, email, **extra):
+    resp = client.post("/auth/signup", json={
+        "name": email.split("@")[0],
+        "email": email,
+        "password": "password123",
+        "city": "Madrid",
+        **extra,
+    })
+    assert resp.status_code == status.HTTP_201_CREATED
+    user_id = resp.json()["id"]
+    token = client.post("/auth/login", json={"email": email, "password": "password123"}).json()["access_token"]
+    return user_id, {"Authorization": f"Bearer {token}"}
+
+
+def test_list_threads_query_count_is_constant(client, clean_db, max_db_calls):
+    """Listar conversaciones no hace una consulta por conversación"""
+    me, auth = _signup_and_login(client, "me@example.com")
+    for i in range(4):
+        other, _ = _signup_and_login(client, f"other{i}@example.com")
+        client.post("/messages", headers=auth, json={
+            "thread_id": f"{me}_{other}",
+            "sender_id": me,
+            "receiver_id": other,
+            "body": "hola",
+        })
+
+    client.get("/messages/threads", headers=auth)  # arranca la presencia
+    with max_db_calls(2):
+        resp = client.get("/messages/threads", headers=auth)
+
+    assert resp.status_code == 200
+    assert len(resp.json()) == 4
+    assert all("password_hash" not in t["other_user"] for t in resp.json())
+
+
+def test_search_sitters_query_count_is_constant(client, clean_db, max_db_calls):
+    """La búsqueda no hace una consulta de reseñas por cuidador"""
+    for i in range(4):
+        _signup_and_login(client, f"sitter{i}@example.com", is_caretaker=True)
+
+    client.get("/sitters/search")  # arranca la presencia
+    with max_db_calls(3):
+        resp = client.get("/sitters/search")
+
+    assert resp.status_code == 200
+    assert len(resp.json()) == 4
@@ -0,0 +1,167 @@
+"""
+Tests del rate limiting y del control de admisión (backend en memoria, sin MongoDB)
+"""
+import pytest
+
+from app.ratelimit import MemoryBackend, RateLimiter, parse_limit
+
+
+class FailingBackend:
+    async def hit(self, key, limit):
+        raise RuntimeError("mongo caído")
+
+    def key_count(self):
+        return 0
+
+
+class CountingBackend(MemoryBackend):
+    """Hace de backend compartido y cuenta las llamadas que le llegan"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def hit(self, key, limit):
+        self.calls += 1
+        return await super().hit(key, limit)
+
+
+def test_parse_limit():
+    """Formatos de límite admitidos"""
+    assert parse_limit("5/minute")[:2] == (5, 60)
+    assert parse_limit("100 per hour")[:2] == (100, 3600)
+    assert parse_limit("10/30 seconds")[:2] == (10, 30)
+    with pytest.raises(ValueError):
+        parse_limit("muchas")
+
+
+async def test_sliding_window_weights_previous_window():
+    """La ventana anterior cuenta en proporción a lo que aún se solapa"""
+    now = [0.0]
+    limiter = RateLimiter(MemoryBackend(clock=lambda: now[0]))
+
+    for _ in range(5):
+        assert await limiter.hit("ip", "5/minute") is None
+    retry_after = await limiter.hit("ip", "5/minute")
+    assert retry_after is not None and retry_after >= 1
+    assert limiter.limited_keys() == 1
+
+    # A mitad de la ventana siguiente la anterior pesa ~50%: caben ~2 más
+    now[0] = 90.0
+    limiter._blocked.clear()
+    assert await limiter.hit("ip", "5/minute") is None
+    assert await limiter.hit("ip", "5/minute") is None
+    assert await limiter.hit("ip", "5/minute") is not None
+
+
+async def test_blocked_keys_skip_backend():
+    """Una clave bloqueada se rechaza sin volver a contar en el backend"""
+    backend = MemoryBackend()
+    limiter = RateLimiter(backend)
+    for _ in range(3):
+        await limiter.hit("ip", "2/minute")
+    counted = backend._data["2/60:ip"][1]
+
+    assert await limiter.hit("ip", "2/minute") is not None
+    assert backend._data["2/60:ip"][1] == counted
+
+
+async def test_flood_is_rejected_without_reaching_shared_backend():
+    """Lo que la cuenta local ya rechaza no llega al backend compartido"""
+    shared = CountingBackend()
+    limiter = RateLimiter(shared, fallback=MemoryBackend())
+    results = []
+    for _ in range(50):
+        limiter._blocked.clear()  # sin la caché de bloqueos: sólo la cuenta local
+        results.append(await limiter.hit("ip", "5/minute"))
+
+    assert results[:5] == [None] * 5 and all(r is not None for r in results[5:])
+    assert shared.calls == 5
+
+
+async def test_memory_backend_is_bounded_and_fallback_used():
+    """El backend en memoria no crece sin límite y respalda al compartido"""
+    fallback = MemoryBackend(max_keys=2)
+    limiter = RateLimiter(FailingBackend(), fallback=fallback)
+    for i in range(5):
+        assert await limiter.hit(f"ip{i}", "1/minute") is None
+
+    assert fallback.key_count() == 2
+    assert await limiter.hit("ip4", "1/minute") is not None
+
+
+def test_route_limits_match_templates():
+    """Las rutas con parámetros se comparan con su plantilla precompilada"""
+    from app.middleware.rate_limit import RouteRateLimitMiddleware
+
+    mw = RouteRateLimitMiddleware(None, {
+        "POST /auth/login": "10/minute",
+        "POST /payments/{payment_id}/process": "20/minute",
+    })
+
+    assert mw.match("POST", "/auth/login/") == ("/auth/login", "10/minute")
+    assert mw.match("POST", "/payments/abc123/process") == ("/payments/{payment_id}/process", "20/minute")
+    assert mw.match("GET", "/auth/login") is None
+    assert mw.match("POST", "/payments/a/b/process") is None
+
+
+async def test_route_limit_rejects_before_handler():
+    """Por encima del límite se responde 429 sin llegar al handler"""
+    import httpx
+    from fastapi import FastAPI
+    from app.middleware.rate_limit import RouteRateLimitMiddleware
+
+    calls = []
+    app = FastAPI()
+    app.state.limiter = RateLimiter(MemoryBackend())
+    app.add_middleware(RouteRateLimitMiddleware, limits={"POST /login": "2/minute"})
+
+    @app.post("/login")
+    async def login(payload: dict):
+        calls.append(payload)
+        return {"ok": True}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        statuses = [(await client.post("/login", json={"n": i})).status_code for i in range(4)]
+        rejected = await client.post("/login", json={})
+
+    assert statuses == [200, 200, 429, 429]
+    assert len(calls) == 2
+    assert int(rejected.headers["retry-after"]) >= 1
+
+
+def test_admission_classifies_route_groups():
+    """Cada ruta cae en su grupo; las baratas no se limitan"""
+    from app.middleware.admission import AdmissionMiddleware
+
+    mw = AdmissionMiddleware(None, concurrency={"search": 1, "writes": 1, "auth": 1, "media": 1, "exports": 1}, queue_size={})
+
+    assert mw.classify("GET", "/sitters/search").name == "search"
+    assert mw.classify("POST", "/auth/login").name == "auth"
+    assert mw.classify("POST", "/pets/abc/photos").name == "media"
+    assert mw.classify("PATCH", "/bookings/abc/status").name == "writes"
+    assert mw.classify("GET", "/payments/export").name == "exports"
+    assert mw.classify("POST", "/messages") is None
+    assert mw.classify("GET", "/health") is None
+
+
+async def test_admission_queue_and_shedding():
+    """Con el grupo lleno se espera en cola; si la cola está llena o caduca, se rechaza"""
+    import asyncio
+    from app.middleware.admission import AdmissionGroup
+
+    group = AdmissionGroup("test", concurrency=1, queue_size=1, timeout=0.05)
+    assert await group.acquire() is None
+
+    waiting = asyncio.create_task(group.acquire())
+    await asyncio.sleep(0)
+    assert await group.acquire() == "queue_full"
+
+    group.release()
+    assert await waiting is None
+    assert group.in_flight == 1
+
+    assert await group.acquire() == "timeout"
+    group.release()
+    assert group.in_flight == 0 and group.queued == 0
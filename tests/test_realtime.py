@@ -0,0 +1,461 @@
+"""
+Tests del gestor de conexiones WebSocket (sin base de datos)
+"""
+import asyncio
+import json
+from datetime import datetime, timedelta
+import pytest
+
+from app.realtime import manager as manager_module
+from app.realtime.manager import ConnectionManager, WS_DROPPED, WS_FRAMES_RECEIVED, WS_SLOW_CLOSED
+from app.realtime.throttle import TokenBucket, TypingCoalescer
+from app.realtime.events import EventRing
+from app.realtime.codec import Frame, JSON, MSGPACK, SUBPROTOCOL_MSGPACK, negotiate
+from app.realtime.presence import PresenceService
+
+
+class FakeWebSocket:
+    """WebSocket mínimo que registra lo enviado"""
+
+    def __init__(self, delay: float = 0, subprotocols=()):
+        self.sent = []
+        self.raw = []
+        self.accepted = None
+        self.closed_with = None
+        self.delay = delay
+        self.scope = {"subprotocols": list(subprotocols)}
+
+    async def accept(self, subprotocol=None):
+        self.accepted = subprotocol or True
+
+    async def send_text(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.raw.append(data)
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.raw.append(data)
+        self.sent.append(MSGPACK.decode(data))
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = (code, reason)
+
+
+async def _drain():
+    # Deja correr a las tareas escritoras
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_multiple_connections_per_user():
+    """Dos dispositivos del mismo usuario reciben el mensaje"""
+    manager = ConnectionManager(queue_size=10)
+    phone, laptop = FakeWebSocket(), FakeWebSocket()
+    c1 = await manager.connect(phone, "u1")
+    c2 = await manager.connect(laptop, "u1")
+
+    delivered = await manager.send_personal_message({"type": "new_message"}, "u1")
+    await _drain()
+
+    assert delivered == 2
+    assert phone.sent == [{"type": "new_message"}]
+    assert laptop.sent == [{"type": "new_message"}]
+
+    manager.disconnect(c1)
+    assert manager.is_online("u1")
+    manager.disconnect(c2)
+    assert not manager.is_online("u1")
+
+
+async def test_slow_consumer_does_not_block_others():
+    """Un cliente lento no retrasa la entrega al resto"""
+    manager = ConnectionManager(queue_size=10)
+    slow, fast = FakeWebSocket(delay=10), FakeWebSocket()
+    c_slow = await manager.connect(slow, "slow")
+    c_fast = await manager.connect(fast, "fast")
+
+    await manager.broadcast({"type": "ping"})
+    await _drain()
+
+    assert fast.sent == [{"type": "ping"}]
+    assert slow.sent == []
+    manager.disconnect(c_slow)
+    manager.disconnect(c_fast)
+
+
+async def test_drop_policy_discards_oldest():
+    """Con la cola llena se descarta el mensaje más antiguo"""
+    manager = ConnectionManager(queue_size=2, policy="drop")
+    ws = FakeWebSocket(delay=10)
+    conn = await manager.connect(ws, "u1")
+    await _drain()  # el escritor queda bloqueado en el primer envío
+
+    before = WS_DROPPED.value()
+    for i in range(5):
+        conn.send({"n": i})
+
+    assert conn.queue.qsize() == 2
+    assert [conn.queue.get_nowait().message["n"] for _ in range(2)] == [3, 4]
+    assert WS_DROPPED.value() - before == 3
+    manager.disconnect(conn)
+
+
+async def test_close_policy_closes_slow_consumer():
+    """Con política close, el consumidor lento se desconecta (una sola vez aunque siga la ráfaga)"""
+    manager = ConnectionManager(queue_size=1, policy="close")
+    ws = FakeWebSocket(delay=10)
+    conn = await manager.connect(ws, "u1")
+    await _drain()
+
+    before = WS_SLOW_CLOSED.value()
+    conn.send({"n": 1})
+    assert all(conn.send({"n": n}) is False for n in range(2, 10))
+    assert WS_SLOW_CLOSED.value() - before == 1
+    assert len(manager_module._close_tasks) == 1
+    await _drain()
+
+    assert ws.closed_with is not None and ws.closed_with[0] == 1013
+    assert not manager.is_online("u1")
+
+
+async def test_idle_connections_are_reaped():
+    """Las conexiones sin actividad se cierran; las activas reciben ping"""
+    manager = ConnectionManager(queue_size=10, ping_interval=60, idle_timeout=30)
+    idle_ws, active_ws = FakeWebSocket(), FakeWebSocket()
+    idle = await manager.connect(idle_ws, "idle")
+    active = await manager.connect(active_ws, "active")
+    idle.last_seen -= 31
+
+    closed = await manager.reap_idle()
+    await _drain()
+
+    assert closed == 1
+    assert idle_ws.closed_with == (1001, "Idle timeout")
+    assert not manager.is_online("idle")
+    assert active_ws.sent and active_ws.sent[0]["type"] == "ping"
+    manager.disconnect(active)
+
+
+async def test_connection_limits():
+    """Se rechazan conexiones por encima del límite por usuario y global"""
+    manager = ConnectionManager(queue_size=10, max_per_user=1, max_total=2)
+    c1 = await manager.connect(FakeWebSocket(), "u1")
+
+    extra = FakeWebSocket()
+    assert await manager.connect(extra, "u1") is None
+    assert extra.closed_with[0] == 1008
+
+    c2 = await manager.connect(FakeWebSocket(), "u2")
+    busy = FakeWebSocket()
+    assert await manager.connect(busy, "u3") is None
+    assert busy.closed_with[0] == 1013
+
+    manager.disconnect(c1)
+    manager.disconnect(c2)
+
+
+def test_token_bucket():
+    """El token bucket permite ráfagas y luego limita al ritmo configurado"""
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=3, clock=lambda: now[0])
+
+    assert all(bucket.allow() for _ in range(3))
+    assert not bucket.allow()
+    assert bucket.retry_after() == pytest.approx(0.5)
+
+    now[0] += 0.5
+    assert bucket.allow()
+    assert not bucket.allow()
+
+
+class RecordingManager:
+    def __init__(self):
+        self.sent = []
+
+    async def send_personal_message(self, message, user_id):
+        self.sent.append((user_id, message["is_typing"]))
+        return 1
+
+
+async def test_typing_coalescing():
+    """Las pulsaciones se agrupan y los cambios de estado se reenvían"""
+    now = [0.0]
+    rec = RecordingManager()
+    coalescer = TypingCoalescer(rec, interval=1.0, timeout=5.0, clock=lambda: now[0])
+
+    for _ in range(10):
+        await coalescer.update("a", "b", "t1", True)
+    assert rec.sent == [("b", True)]
+
+    now[0] += 1.0
+    await coalescer.update("a", "b", "t1", True)
+    assert rec.sent == [("b", True), ("b", True)]
+
+    await coalescer.update("a", "b", "t1", False)
+    await coalescer.update("a", "b", "t1", False)
+    assert rec.sent[-1] == ("b", False)
+    assert len(rec.sent) == 3
+    assert coalescer.active_count() == 0
+
+
+async def test_typing_auto_stop():
+    """Sin actividad se envía automáticamente 'dejó de escribir'"""
+    rec = RecordingManager()
+    coalescer = TypingCoalescer(rec, interval=1.0, timeout=0.01)
+
+    await coalescer.update("a", "b", "t1", True)
+    await asyncio.sleep(0.05)
+
+    assert rec.sent == [("b", True), ("b", False)]
+    assert coalescer.active_count() == 0
+
+
+def test_event_ring_replay():
+    """El buffer devuelve los eventos posteriores al último visto"""
+    ring = EventRing(size_per_user=10)
+    first = ring.record("u1", {"type": "new_message", "n": 1})
+    ring.record("u2", {"type": "new_message", "n": 2})
+    ring.record("u1", {"type": "new_report", "n": 3})
+
+    assert first["event_id"] == 1
+    missed = ring.since("u1", first["event_id"])
+    assert [e["n"] for e in missed] == [3]
+    assert ring.since("u1", 0) is not None
+    assert ring.since("u3", 1) == []
+    # Un id que este proceso no ha emitido no es fiable
+    assert ring.since("u1", 99) is None
+
+
+def test_event_ring_gap_too_large():
+    """Si se descartaron eventos del hueco, hay que resincronizar"""
+    now = [0.0]
+    ring = EventRing(size_per_user=2, max_age=60, clock=lambda: now[0])
+    for n in range(4):
+        ring.record("u1", {"type": "new_message", "n": n})
+
+    # Quedan los event_id 3 y 4; el 2 se descartó
+    assert ring.since("u1", 1) is None
+    assert [e["n"] for e in ring.since("u1", 2)] == [2, 3]
+
+    now[0] += 120
+    assert ring.since("u1", 4) == []
+    assert ring.since("u1", 3) is None
+
+
+async def test_manager_stamps_replayable_events():
+    """Los eventos reproducibles llevan event_id aunque el usuario no esté conectado"""
+    manager = ConnectionManager(queue_size=10, events=EventRing())
+    await manager.send_personal_message({"type": "new_message"}, "offline")
+    await manager.send_personal_message({"type": "typing", "is_typing": True}, "offline")
+
+    missed = manager.events.since("offline", 0)
+    assert [e["type"] for e in missed] == ["new_message"]
+
+
+def test_negotiate_subprotocol():
+    """MessagePack sólo si el cliente lo ofrece; JSON por defecto"""
+    assert negotiate([]) == (JSON, None)
+    codec, subprotocol = negotiate([SUBPROTOCOL_MSGPACK, "petconnect.json.v1"])
+    assert subprotocol == SUBPROTOCOL_MSGPACK and codec.binary
+
+
+def test_msgpack_roundtrip_and_size():
+    """Campos cortos y timestamps enteros; el cliente recibe los nombres completos"""
+    event = {
+        "type": "new_message",
+        "event_id": 7,
+        "message": {
+            "id": "65f1c0ffee0000000000abcd",
+            "thread_id": "t-1",
+            "sender_id": "65f1c0ffee0000000000aaaa",
+            "receiver_id": "65f1c0ffee0000000000bbbb",
+            "body": "hola",
+            "created_at": "2025-01-02T03:04:05.678000",
+            "read": False,
+        },
+    }
+    packed = MSGPACK.encode(event)
+    decoded = MSGPACK.decode(packed)
+
+    assert len(packed) < len(JSON.encode(event))
+    assert decoded["message"]["body"] == "hola"
+    assert decoded["message"]["created_at"] == 1735787045678
+
+
+async def test_received_frames_counted_by_client_type():
+    """Los frames del cliente se cuentan por su tipo; los desconocidos como other"""
+    manager = ConnectionManager(queue_size=10)
+    ws = FakeWebSocket()
+    conn = await manager.connect(ws, "u1")
+    incoming = [json.dumps({"type": "mark_read", "thread_id": "t1"}), json.dumps({"type": "inventado"})]
+
+    async def receive():
+        return {"type": "websocket.receive", "text": incoming.pop(0)}
+
+    ws.receive = receive
+    mark_read = WS_FRAMES_RECEIVED.value(type="mark_read")
+    other = WS_FRAMES_RECEIVED.value(type="other")
+    await conn.receive()
+    await conn.receive()
+
+    assert WS_FRAMES_RECEIVED.value(type="mark_read") == mark_read + 1
+    assert WS_FRAMES_RECEIVED.value(type="other") == other + 1
+    manager.disconnect(conn)
+
+
+async def test_frame_encoded_once_for_fanout():
+    """Un evento enviado a varias conexiones se codifica una vez por formato"""
+    manager = ConnectionManager(queue_size=10)
+    sockets = [FakeWebSocket(subprotocols=[SUBPROTOCOL_MSGPACK]) for _ in range(3)]
+    conns = [await manager.connect(ws, "u1") for ws in sockets]
+
+    await manager.send_personal_message({"type": "typing", "is_typing": True}, "u1")
+    await _drain()
+
+    assert all(ws.accepted == SUBPROTOCOL_MSGPACK for ws in sockets)
+    assert sockets[0].raw[0] is sockets[1].raw[0] is sockets[2].raw[0]
+    for conn in conns:
+        manager.disconnect(conn)
+
+
+async def test_presence_transitions():
+    """online al conectar, offline sólo tras el periodo de gracia, away por inactividad"""
+    manager = ConnectionManager(queue_size=10)
+    service = PresenceService(manager, away_after=60, offline_grace=0.01)
+    manager.add_listener(service)
+
+    conn = await manager.connect(FakeWebSocket(), "u1")
+    assert service.get("u1")["status"] == "online"
+    assert service.get("nobody") == {"status": "offline", "last_seen": None}
+
+    # Reconexión rápida: no llega a pasar por offline
+    manager.disconnect(conn)
+    conn = await manager.connect(FakeWebSocket(), "u1")
+    await asyncio.sleep(0.03)
+    assert service.get("u1")["status"] == "online"
+
+    service._local["u1"].last_active -= timedelta(seconds=61)
+    service._check_away()
+    assert service.get("u1")["status"] == "away"
+    service.touch("u1")
+    assert service.get("u1")["status"] == "online"
+
+    manager.disconnect(conn)
+    await asyncio.sleep(0.03)
+    result = service.bulk(["u1"])
+    assert result["u1"]["status"] == "offline"
+    assert result["u1"]["last_seen"] is not None
+
+
+def test_presence_merges_other_workers():
+    """El mejor estado de cualquier worker gana; las entradas caducadas cuentan como offline"""
+    service = PresenceService(ConnectionManager(queue_size=1), worker_id="w1")
+    now = datetime.utcnow()
+    service._remote["u1"] = {
+        "w2": ("away", now, now + timedelta(seconds=60)),
+        "w3": ("online", now, now - timedelta(seconds=1)),
+    }
+    assert service.get("u1")["status"] == "away"
+    assert (service.local_count(), service.remote_count()) == (0, 1)
+
+
+class FakePresenceCollection:
+    """Colección en memoria: $set, $currentDate y filtros $ne/$gte/$lt."""
+
+    def __init__(self):
+        self.docs = {}
+        self.read = 0  # documentos devueltos por find
+        self._clock = datetime.utcnow()
+
+    def _now(self):
+        # Reloj del servidor estrictamente creciente, como el de updated_at
+        self._clock = max(self._clock + timedelta(microseconds=1), datetime.utcnow())
+        return self._clock
+
+    @staticmethod
+    def _matches(doc, query):
+        for field, cond in query.items():
+            value = doc.get(field)
+            if isinstance(cond, dict):
+                if "$ne" in cond and value == cond["$ne"]:
+                    return False
+                if "$gte" in cond and (value is None or value < cond["$gte"]):
+                    return False
+                if "$lt" in cond and (value is None or value >= cond["$lt"]):
+                    return False
+            elif value != cond:
+                return False
+        return True
+
+    def _apply(self, doc, update):
+        doc.update(update.get("$set", {}))
+        for field in update.get("$currentDate", {}):
+            doc[field] = self._now()
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            doc = self.docs.setdefault(op._filter["_id"], dict(op._filter))
+            self._apply(doc, op._doc)
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self.docs.get(query["_id"])
+        if doc is None and upsert:
+            doc = self.docs[query["_id"]] = dict(query)
+        if doc is not None:
+            self._apply(doc, update)
+
+    async def update_many(self, query, update):
+        for doc in self.docs.values():
+            if self._matches(doc, query):
+                self._apply(doc, update)
+
+    async def find(self, query, projection=None):
+        for doc in list(self.docs.values()):
+            if self._matches(doc, query):
+                self.read += 1
+                yield dict(doc)
+
+
+class FakePresenceDB:
+    def __init__(self):
+        self.presence = FakePresenceCollection()
+        self.presence_workers = FakePresenceCollection()
+
+
+async def test_presence_renewal_is_not_read_by_other_workers():
+    """El latido del worker mantiene online a sus usuarios en los demás sin volver a leerlos"""
+    db = FakePresenceDB()
+    manager = ConnectionManager(queue_size=10)
+    w1 = PresenceService(manager, worker_id="w1", entry_ttl=0.05)
+    w2 = PresenceService(ConnectionManager(queue_size=1), worker_id="w2", entry_ttl=0.05, watermark_lag=0)
+    manager.add_listener(w1)
+    w1._db = w2._db = db
+
+    conn = await manager.connect(FakeWebSocket(), "u1")
+    await w1.sync()
+    await w2.sync()
+    assert w2.get("u1")["status"] == "online"
+    # Otro cambio posterior adelanta la marca de w2 más allá del documento de u1
+    other = await manager.connect(FakeWebSocket(), "u2")
+    await w1.sync()
+    await w2.sync()
+
+    read = db.presence.read
+    for _ in range(3):
+        await asyncio.sleep(0.04)
+        await w1.sync()  # sólo latido y renovación del TTL: no hay cambios de estado
+        await w2.sync()
+    assert w2.get("u1")["status"] == "online"
+    assert db.presence.docs["w1:u1"]["expires_at"] > datetime.utcnow()  # MongoDB no lo borra
+    # Sólo el último documento cambiado (u2) se relee por el $gte de la marca
+    assert db.presence.read - read == 3
+
+    # w1 deja de latir (caído): sus usuarios pasan a offline en w2
+    await asyncio.sleep(0.06)
+    await w2.sync()
+    assert w2.get("u1")["status"] == "offline"
+    manager.disconnect(conn)
+    manager.disconnect(other)
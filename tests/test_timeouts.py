@@ -0,0 +1,43 @@
+"""
+Tests de los límites de tiempo por clase de consulta (no requieren MongoDB)
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app import db as db_module
+from app.db import DB_QUERY_TIMEOUTS, QueryTimeout, query_deadline
+
+
+async def test_query_deadline_raises_query_timeout(monkeypatch):
+    """Una consulta que no responde se corta con QueryTimeout"""
+    monkeypatch.setitem(db_module._settings.query_timeouts_ms, "point", 20)
+    monkeypatch.setattr(db_module._settings, "query_deadline_grace", 0.01)
+
+    with pytest.raises(QueryTimeout) as exc:
+        async with query_deadline("point"):
+            await asyncio.sleep(1)
+    assert exc.value.query_class == "point"
+
+
+async def test_query_timeout_maps_to_503(monkeypatch):
+    """Las rutas devuelven 503 con Retry-After y se cuenta el timeout por ruta"""
+    from app.main import query_timeout_handler
+
+    app = FastAPI()
+    app.add_exception_handler(QueryTimeout, query_timeout_handler)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        raise QueryTimeout("point")
+
+    before = DB_QUERY_TIMEOUTS.value(route="/items/{item_id}", query_class="point")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/items/abc")
+
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+    assert DB_QUERY_TIMEOUTS.value(route="/items/{item_id}", query_class="point") == before + 1